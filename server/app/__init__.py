@@ -21,6 +21,16 @@ applicable files:
 """
 
 
-from .main import init_app
+from typing import Any
 
 __all__ = ["init_app"]
+
+
+def __getattr__(name: str) -> Any:
+    # Imported on first use: importing a submodule (e.g. `app.config`) must not
+    # build the application, whose services connect to the stores
+    if name == "init_app":
+        from .main import init_app
+
+        return init_app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -66,6 +66,67 @@ class MilvusSettings(BaseSettings):
     text_key: str | None = None
 
 
+class VectorStoreSettings(BaseSettings):
+    model_config = SettingsConfigDict(env_prefix="VECTOR_STORE_")
+
+    mode: Literal["milvus", "local"] = Field(
+        "milvus",
+        description=(
+            "`milvus` uses the Milvus server of `MilvusSettings`. `local` keeps the "
+            "vectors in memory-mapped files of the API, in `local_data`, for "
+            "single-node deployments of up to a few hundred thousand vectors."
+        ),
+    )
+    local_dtype: Literal["float32", "float16"] = Field(
+        "float32",
+        description=(
+            "Type of the stored vectors, `float16` halves the size of the files "
+            "and of the page cache used by the searches, but the searches are "
+            "slower (the vectors are converted to float32 to be scored). Fixed at "
+            "the first ingestion."
+        ),
+    )
+    local_ivf_threshold: int = Field(
+        0,
+        description=(
+            "Count of vectors above which an IVF index restricts a search to the "
+            "vectors of the clusters nearest to the query, instead of scanning them "
+            "all. Approximate, 0 to always search exhaustively."
+        ),
+    )
+    local_ivf_nprobe: int = Field(
+        8,
+        description=(
+            "Count of IVF clusters searched, more is slower with a better recall."
+        ),
+    )
+
+
+class RetrievalCacheSettings(BaseSettings):
+    model_config = SettingsConfigDict(env_prefix="RETRIEVAL_CACHE_")
+
+    mode: Literal["off", "memory", "redis"] = Field(
+        "off",
+        description=(
+            "Cache of the nodes retrieved for a query, by query, document IDs and top "
+            "k. Every ingestion or deletion invalidates it. `memory` keeps it in the "
+            "process, only for a single API worker. `redis` shares it, and the "
+            "invalidations, between the workers through Redis."
+        ),
+    )
+    max_entries: int = Field(
+        1024, description="Count of retrieval results kept in the memory of a worker."
+    )
+    ttl: int = Field(3600, description="Seconds a retrieval result is kept in Redis.")
+    query_embedding_cache_size: int = Field(
+        1024,
+        description=(
+            "Count of query embeddings kept in memory, so a repeated question is not "
+            "embedded again. 0 to disable."
+        ),
+    )
+
+
 class S3Settings(BaseSettings):
     model_config = SettingsConfigDict(env_prefix="S3_")
 
@@ -76,8 +137,10 @@ class S3Settings(BaseSettings):
 
 
 class EmbeddingSettings(BaseSettings):
-    mode: Literal["huggingface", "openai", "sagemaker", "mock", "ollama"] = "ollama"
-    ingest_mode: Literal["simple", "batch", "parallel"] = Field(
+    mode: Literal["huggingface", "onnx", "openai", "sagemaker", "mock", "ollama"] = (
+        "ollama"
+    )
+    ingest_mode: Literal["simple", "batch", "parallel", "pipeline"] = Field(
         "simple",
         description=(
             "The ingest mode to use for the embedding engine:\n"
@@ -86,6 +149,8 @@ class EmbeddingSettings(BaseSettings):
             "and send them in batch to the embedding model.\n"
             "If `parallel` - parse the files in parallel using multiple cores, and embedd them in parallel.\n"
             "`parallel` is the fastest mode for local setup, as it parallelize IO RW in the index.\n"
+            "If `pipeline` - parse, embed and save the files in concurrent stages connected by "
+            "bounded queues, so the embedding model is never waiting for the parsers or the index.\n"
             "For modes that leverage parallelization, you can specify the number of "
             "workers to use with `count_workers`.\n"
         ),
@@ -101,6 +166,273 @@ class EmbeddingSettings(BaseSettings):
             "Do not set it higher than your number of threads of your CPU."
         ),
     )
+    ingest_file_extensions: list[str] | None = Field(
+        None,
+        description=(
+            'If set, the only file extensions (e.g. `[".pdf", ".md"]`) that can be '
+            "ingested, other files are rejected. By default, all the formats are "
+            "supported, files without a specific reader are read as plain text. "
+            "Readers are imported the first time their format is ingested."
+        ),
+    )
+    parser_timeout: float = Field(
+        300.0,
+        description=(
+            "The maximum time, in seconds, to parse a file. The parser process "
+            "is killed and the file is reported as failed when exceeded."
+        ),
+    )
+    parser_max_rss_mb: int = Field(
+        2048,
+        description=(
+            "The maximum resident memory, in megabytes, of a parser process. The "
+            "parser process is killed and the file is reported as failed when exceeded."
+        ),
+    )
+    parser_max_files_per_worker: int = Field(
+        100,
+        description=(
+            "The number of files parsed by a parser process before it is replaced "
+            "by a fresh one, to release the memory leaked by the readers."
+        ),
+    )
+    parser_format_concurrency: dict[str, int] = Field(
+        {".mp3": 1, ".mp4": 1},
+        description=(
+            "The maximum number of files of a given extension parsed at the same "
+            "time, on top of `count_workers`. Useful for the heavy formats "
+            "(e.g. audio and video transcription)."
+        ),
+    )
+    parser_split_pages: int = Field(
+        50,
+        description=(
+            "PDF files with more pages than this are split into ranges of pages, "
+            "parsed in parallel by `count_workers` processes. Set to 0 to parse "
+            "every file in a single process."
+        ),
+    )
+    pipeline_doc_queue_size: int = Field(
+        20,
+        description=(
+            "In `pipeline` mode, the number of parsed files waiting to be embedded. "
+            "The parsers block when it is full, which bounds the memory used."
+        ),
+    )
+    pipeline_node_queue_size: int = Field(
+        40,
+        description=(
+            "In `pipeline` mode, the number of embedded files waiting to be saved "
+            "in the index."
+        ),
+    )
+    pipeline_flush_nodes: int = Field(
+        5000,
+        description="In `pipeline` mode, save the index every # nodes.",
+    )
+    pipeline_flush_interval: float = Field(
+        5.0,
+        description=(
+            "In `pipeline` mode, the maximum time, in seconds, embedded nodes wait "
+            "before being saved in the index."
+        ),
+    )
+    pipeline_flush_mb: int = Field(
+        64,
+        description=(
+            "In `pipeline` mode, save the index as soon as the pending nodes "
+            "(text and embeddings) exceed this size, in megabytes."
+        ),
+    )
+    cache_enabled: bool = Field(
+        True,
+        description=(
+            "If `True`, embeddings are cached on local disk, keyed by the model name "
+            "and the hash of the normalized text. Ingestion, the embeddings API and "
+            "query embeddings all read through the cache."
+        ),
+    )
+    cache_max_size_mb: int = Field(
+        1024,
+        description=(
+            "Maximum size of the embedding cache in megabytes. "
+            "The least recently used embeddings are evicted above this size."
+        ),
+    )
+    onnx_model_path: str = Field(
+        "llm/embedding-onnx",
+        description=(
+            "In `onnx` mode, the directory of the exported model and its tokenizer, "
+            "absolute or relative to the project root. "
+            "Create it with `python -m development.export_onnx`."
+        ),
+    )
+    onnx_quantized: bool = Field(
+        True,
+        description=(
+            "In `onnx` mode, run the int8 quantized model (`model_quantized.onnx`) "
+            "instead of the float one (`model.onnx`)."
+        ),
+    )
+    onnx_intra_op_threads: int = Field(
+        0,
+        description=(
+            "In `onnx` mode, the number of threads used to run an operator. "
+            "0 lets ONNX Runtime use all the physical cores."
+        ),
+    )
+    onnx_inter_op_threads: int = Field(
+        1,
+        description=(
+            "In `onnx` mode, the number of threads used to run independent "
+            "operators in parallel."
+        ),
+    )
+    onnx_max_length: int = Field(
+        512,
+        description="In `onnx` mode, texts are truncated to this number of tokens.",
+    )
+    embedding_workers: int = Field(
+        1,
+        description=(
+            "The number of processes running the embedding model, each with its "
+            "own copy of the model and a share of the CPU cores. Only used by the "
+            "local modes (`huggingface` and `onnx`), 1 embeds in the API process."
+        ),
+    )
+    embedding_worker_timeout: float = Field(
+        300.0,
+        description=(
+            "The maximum time, in seconds, for an embedding process to embed a "
+            "batch. The process is killed and restarted when exceeded, and the "
+            "batch fails."
+        ),
+    )
+    batch_token_budget: int = Field(
+        0,
+        description=(
+            "When ingesting, nodes are sorted by token length and embedded in batches "
+            "whose padded size (count of texts * longest text) fits in this budget, "
+            "e.g. 8192. Benchmark it with your embedding model before enabling it. "
+            "0 (the default) embeds the nodes in arrival order, by `embed_batch_size`."
+        ),
+    )
+    batch_max_size: int = Field(
+        64,
+        description=(
+            "The maximum number of texts in an embedding batch when ingesting. "
+            "Also the `embed_batch_size` of the `huggingface` embedding model."
+        ),
+    )
+    ingest_job_workers: int = Field(
+        1,
+        description=(
+            "The number of background ingest jobs run concurrently. "
+            "Each job goes through the configured `ingest_mode`."
+        ),
+    )
+    ingest_job_queue_size: int = Field(
+        32,
+        description=(
+            "The maximum number of ingest jobs waiting to be run. "
+            "New jobs are rejected when the queue is full."
+        ),
+    )
+    ingest_job_history: int = Field(
+        1000,
+        description="The number of finished ingest jobs kept to be polled.",
+    )
+    ingest_job_ttl: int = Field(
+        7 * 24 * 3600,
+        description=(
+            "The number of seconds an ingest job is kept in Redis, "
+            "after its last change."
+        ),
+    )
+    bulk_ingest_max_files: int = Field(
+        10000,
+        description="The maximum number of files (archive members included) of a bulk upload.",
+    )
+    bulk_ingest_max_mb: int = Field(
+        4096,
+        description="The maximum uncompressed size, in megabytes, of a bulk upload.",
+    )
+    watch_folder: str | None = Field(
+        None,
+        description=(
+            "A folder kept in sync with the index while the API runs: new and "
+            "modified files are ingested, the documents of deleted files are "
+            "deleted. File names are the paths relative to this folder."
+        ),
+    )
+    watch_interval: float = Field(
+        10.0,
+        description=(
+            "Interval, in seconds, between two scans of `watch_folder`. When "
+            "`watchfiles` is installed, a scan is also run as soon as a file changes."
+        ),
+    )
+    watch_debounce: float = Field(
+        5.0,
+        description=(
+            "A changed file of `watch_folder` is synced once it is left unchanged "
+            "for this number of seconds, not to ingest files being written."
+        ),
+    )
+    persist_compaction_interval: int = Field(
+        300,
+        description=(
+            "Every insertion and deletion is appended to a change log instead of "
+            "persisting the whole index. This is the interval, in seconds, at which "
+            "the change log is compacted into a full snapshot of the index."
+        ),
+    )
+    persist_compaction_log_mb: int = Field(
+        64,
+        description=(
+            "Size of the change log, in megabytes, above which it is compacted "
+            "without waiting for `persist_compaction_interval`."
+        ),
+    )
+    incremental_ingest: bool = Field(
+        False,
+        description=(
+            "If `True`, documents get stable IDs derived from their file name and "
+            "position in the file, and only documents whose content hash changed "
+            "since the last ingestion are embedded again.\n"
+            "Stale nodes of changed or removed documents are deleted from the "
+            "vector store and the document store."
+        ),
+    )
+    dedup_mode: Literal["off", "skip", "alias"] = Field(
+        "off",
+        description=(
+            "Near-duplicate nodes (e.g. of versioned documents or repeated email "
+            "threads) are found with MinHash / LSH before the embedding.\n"
+            "`skip`: they are neither embedded nor stored, only the first copy is "
+            "kept (deleting its document doesn't bring the skipped copies back).\n"
+            "`alias`: they are kept, with the ID of the first copy in their "
+            "`duplicate_of` metadata, and retrieval returns one node per group."
+        ),
+    )
+    dedup_threshold: float = Field(
+        0.85,
+        description=(
+            "Min Jaccard similarity, of the word shingles, of a near-duplicate node "
+            "and the first copy."
+        ),
+    )
+    dedup_num_perm: int = Field(
+        128,
+        description="Size of the MinHash signatures, more is more accurate but slower.",
+    )
+    dedup_bands: int = Field(
+        16,
+        description=(
+            "Count of LSH bands, must divide `dedup_num_perm`. More bands find more "
+            "candidates with a lower similarity, all checked against the threshold."
+        ),
+    )
 
 
 class LLMSettings(BaseModel):
@@ -175,6 +507,21 @@ class RerankSettings(BaseSettings):
         2,
         description="This value controls the number of documents returned by the RAG pipeline.",
     )
+    batch_window_ms: float = Field(
+        5,
+        description=(
+            "How long the reranker waits for the pairs of concurrent requests, to "
+            "score them in the same forward pass."
+        ),
+    )
+    max_batch_size: int = Field(
+        64,
+        description="Max count of (query, passage) pairs scored in a forward pass.",
+    )
+    cache_size: int = Field(
+        4096,
+        description="Count of recently scored (query, passage) pairs kept in memory.",
+    )
 
 
 class RagSettings(BaseModel):
@@ -187,6 +534,21 @@ class RagSettings(BaseModel):
         description="If set, any documents retrieved from the RAG must meet a certain match score. Acceptable values are between 0 and 1.",
     )
     rerank: RerankSettings = RerankSettings()  # Come back to this, it wasn't optional
+    sentence_window_mode: Literal["full", "compact"] = Field(
+        "full",
+        description=(
+            "How the window of sentences around each ingested sentence is stored.\n"
+            "If `full` - the whole window is copied in the metadata of every node.\n"
+            "If `compact` - nodes only store their own sentence, the window is rebuilt "
+            "from the neighbor nodes at retrieval time. It divides the size of the "
+            "docstore and vector store by several times, at the cost of a few batched "
+            "docstore reads per query. Nodes ingested in both modes can be mixed."
+        ),
+    )
+    sentence_window_size: int = Field(
+        3,
+        description="The number of sentences on each side of a sentence in its window.",
+    )
 
 
 class OllamaSettings(BaseModel):
@@ -258,6 +620,16 @@ def get_milvus_settings() -> MilvusSettings:
     return MilvusSettings()
 
 
+@lru_cache
+def get_vector_store_settings() -> VectorStoreSettings:
+    return VectorStoreSettings()
+
+
+@lru_cache
+def get_retrieval_cache_settings() -> RetrievalCacheSettings:
+    return RetrievalCacheSettings()
+
+
 @lru_cache
 def get_s3_settings() -> S3Settings:
     return S3Settings()
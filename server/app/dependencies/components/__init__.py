@@ -2,6 +2,7 @@ from .embedding import EmbeddingComponent, get_embeddings_component
 from .ingest import get_embeddings_settings, get_ingestion_component
 from .llm import LLMComponent, get_llm_component
 from .node_store import NodeStoreComponent, get_node_store_component
+from .retrieval import RetrievalComponent, get_retrieval_component
 from .vector_store import VectorStoreComponent, get_vector_store_component
 
 __all__ = [
@@ -13,6 +14,8 @@ __all__ = [
     "get_node_store_component",
     "VectorStoreComponent",
     "get_vector_store_component",
+    "RetrievalComponent",
+    "get_retrieval_component",
     "get_ingestion_component",
     "get_embeddings_settings",
 ]
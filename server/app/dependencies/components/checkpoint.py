@@ -0,0 +1,197 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from collections.abc import Callable
+from pathlib import Path
+from typing import TYPE_CHECKING, Literal
+
+import structlog
+
+if TYPE_CHECKING:
+    from app.dependencies.components.ingest import IngestEvent
+
+logger = structlog.stdlib.get_logger(__name__)
+
+CheckpointStage = Literal["pending", "parsed", "embedded", "persisted"]
+
+# Ingest event stage -> checkpoint stage reached by the files of the event
+_EVENT_STAGES: dict[str, CheckpointStage] = {
+    "parse": "parsed",
+    "embed": "embedded",
+    "persist": "persisted",
+}
+_STAGE_RANKS: dict[str, int] = {
+    "pending": 0,
+    "parsed": 1,
+    "embedded": 2,
+    "persisted": 3,
+}
+
+
+class IngestCheckpoint:
+    """Durable manifest of the progress of bulk ingestion runs.
+
+    Each file of a run is recorded with the fingerprint of its content and
+    the last stage it reached (parsed, embedded, persisted), as reported by
+    the ingest events. When a run is restarted with the same `run_id`, the
+    files already persisted with the same content are skipped; the others
+    are ingested again (their embeddings are usually still in the embedding
+    cache). A run is forgotten once all its files are persisted, or have
+    nothing to persist (skipped as unchanged, or without any document).
+
+    Backed by SQLite, like the embedding cache, so it survives a crash and
+    can be shared by the workers of the API.
+    """
+
+    def __init__(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            str(path), timeout=30, check_same_thread=False, isolation_level=None
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "run_id TEXT NOT NULL, file_name TEXT NOT NULL, "
+            "fingerprint TEXT NOT NULL, stage TEXT NOT NULL, updated_at REAL NOT NULL, "
+            "PRIMARY KEY (run_id, file_name))"
+        )
+
+    @staticmethod
+    def fingerprint(file_data: Path) -> str:
+        """Hash of the content of a file, its path changes between uploads."""
+        digest = hashlib.sha256()
+        with file_data.open("rb") as file:
+            while chunk := file.read(1024 * 1024):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def start(
+        self, run_id: str, files: list[tuple[str, Path]]
+    ) -> list[tuple[str, Path]]:
+        """Record the files of a run, return the ones left to ingest.
+
+        A file whose content changed since the previous attempt is ingested
+        again, even if it was persisted.
+        """
+        remaining = set(
+            self.start_fingerprints(
+                run_id,
+                {
+                    file_name: self.fingerprint(file_data)
+                    for file_name, file_data in files
+                },
+            )
+        )
+        return [file for file in files if file[0] in remaining]
+
+    def start_fingerprints(
+        self, run_id: str, fingerprints: dict[str, str]
+    ) -> list[str]:
+        """Same as `start`, with the fingerprints of the files by name."""
+        with self._lock:
+            stored = {
+                file_name: (fingerprint, stage)
+                for file_name, fingerprint, stage in self._connection.execute(
+                    "SELECT file_name, fingerprint, stage FROM files WHERE run_id = ?",
+                    (run_id,),
+                )
+            }
+            now = time.time()
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, 'pending', ?)",
+                [
+                    (run_id, file_name, fingerprint, now)
+                    for file_name, fingerprint in fingerprints.items()
+                    if stored.get(file_name, (None,))[0] != fingerprint
+                ],
+            )
+        remaining = [
+            file_name
+            for file_name, fingerprint in fingerprints.items()
+            if stored.get(file_name) != (fingerprint, "persisted")
+        ]
+        if len(remaining) < len(fingerprints):
+            logger.info(
+                "Resuming run_id=%s: count=%s of count=%s files already persisted",
+                run_id,
+                len(fingerprints) - len(remaining),
+                len(fingerprints),
+            )
+        return remaining
+
+    def listener(self, run_id: str) -> Callable[["IngestEvent"], None]:
+        """Ingest listener recording the stages reached by the files of a run."""
+
+        def on_event(event: "IngestEvent") -> None:
+            stage = _EVENT_STAGES.get(event.stage)
+            if event.stage == "skip" or (event.stage == "parse" and not event.count):
+                # Unchanged files, or files without text: nothing left to persist
+                stage = "persisted"
+            if stage is not None:
+                self.advance(run_id, event.file_names, stage)
+
+        return on_event
+
+    def advance(
+        self, run_id: str, file_names: list[str], stage: CheckpointStage
+    ) -> None:
+        """Record that the files reached a stage, stages never go backwards."""
+        lower_stages = [
+            s for s, rank in _STAGE_RANKS.items() if rank < _STAGE_RANKS[stage]
+        ]
+        placeholders = ",".join("?" * len(lower_stages))
+        with self._lock:
+            self._connection.executemany(
+                "UPDATE files SET stage = ?, updated_at = ? "
+                f"WHERE run_id = ? AND file_name = ? AND stage IN ({placeholders})",
+                [
+                    (stage, time.time(), run_id, file_name, *lower_stages)
+                    for file_name in file_names
+                ],
+            )
+
+    def progress(self, run_id: str) -> dict[str, int]:
+        """Count of files of a run per stage."""
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT stage, COUNT(*) FROM files WHERE run_id = ? GROUP BY stage",
+                (run_id,),
+            ).fetchall()
+        return dict(rows)
+
+    def forget(self, run_id: str, file_names: list[str]) -> None:
+        """Forget files of a run, e.g. whose documents were deleted meanwhile:
+        they are ingested again by the next attempt, even if unchanged."""
+        with self._lock:
+            self._connection.executemany(
+                "DELETE FROM files WHERE run_id = ? AND file_name = ?",
+                [(run_id, file_name) for file_name in file_names],
+            )
+
+    def finish(self, run_id: str) -> bool:
+        """Forget a run if all its files are persisted, return whether it was."""
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                (count_left,) = self._connection.execute(
+                    "SELECT COUNT(*) FROM files WHERE run_id = ? AND stage != 'persisted'",
+                    (run_id,),
+                ).fetchone()
+                if count_left == 0:
+                    self._connection.execute(
+                        "DELETE FROM files WHERE run_id = ?", (run_id,)
+                    )
+                self._connection.execute("COMMIT")
+            except Exception:
+                self._connection.execute("ROLLBACK")
+                raise
+        if count_left:
+            logger.info(
+                "Run run_id=%s has count=%s files left to retry", run_id, count_left
+            )
+        return count_left == 0
+
+    def close(self) -> None:
+        self._connection.close()
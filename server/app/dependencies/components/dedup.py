@@ -0,0 +1,305 @@
+import collections
+import hashlib
+import re
+import sqlite3
+import threading
+import zlib
+from pathlib import Path
+from typing import Any, Literal
+
+import numpy as np
+import structlog
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.postprocessor.types import BaseNodePostprocessor
+from llama_index.core.schema import (
+    BaseNode,
+    MetadataMode,
+    NodeWithScore,
+    QueryBundle,
+    TransformComponent,
+)
+from llama_index.core.storage.docstore import BaseDocumentStore
+
+from app.dependencies.components.metrics import get_metrics_registry
+from app.dependencies.components.node_store import get_nodes
+
+logger = structlog.stdlib.get_logger(__name__)
+
+DedupAction = Literal["skip", "alias"]
+
+# Metadata key of an alias, the ID of the node it duplicates
+DUPLICATE_OF_METADATA_KEY = "duplicate_of"
+
+DUPLICATE_NODES = get_metrics_registry().counter(
+    "ingest_duplicate_nodes_total",
+    "Count of near-duplicate nodes found at ingestion, by action taken.",
+    labels=("action",),
+)
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+_WORD_RE = re.compile(r"\w+")
+# Originals found by this process recently, possibly not yet in the docstore
+# (e.g. waiting in the write queue of the pipeline ingest mode)
+_RECENT_ORIGINALS = 100_000
+
+
+class NearDuplicateFilter(TransformComponent):
+    """Find the nodes which are near-duplicates of already ingested nodes.
+
+    To put in the ingest transformations, after the node parser and before
+    the embedding model. Each node gets a MinHash signature of its word
+    shingles, and is looked up with locality-sensitive hashing (LSH) among
+    the signatures of all the nodes ingested before: a node whose estimated
+    Jaccard similarity with an existing node is at least `threshold` is a
+    near-duplicate. Depending on `action`:
+
+    - "skip": the node is dropped, it is not embedded nor stored.
+    - "alias": the node is kept, with the ID of the original node in its
+      `duplicate_of` metadata; `NearDuplicateCollapser` keeps only one node
+      of each group at retrieval time.
+
+    The signatures are stored in SQLite, so duplicates of the nodes of the
+    previous runs are found too. An original is only trusted once it is in
+    the docstore: deleted, failed or re-ingested documents never cause new
+    nodes to be skipped. The signatures of the originals missing from the
+    docstore are deleted, except the recent ones of this process, which may
+    still be waiting to be inserted (so a duplicate of a node still in the
+    write queue of the pipeline ingest mode is not found).
+    """
+
+    action: DedupAction = Field(default="skip")
+    threshold: float = Field(
+        default=0.85, description="Min estimated Jaccard similarity of duplicates."
+    )
+    num_perm: int = Field(default=128, description="Size of the MinHash signatures.")
+    bands: int = Field(default=16, description="Count of LSH bands.")
+    shingle_size: int = Field(default=3, description="Count of words per shingle.")
+
+    _docstore: BaseDocumentStore = PrivateAttr()
+    _connection: sqlite3.Connection = PrivateAttr()
+    _lock: threading.Lock = PrivateAttr()
+    _a: np.ndarray = PrivateAttr()
+    _b: np.ndarray = PrivateAttr()
+    _recent: collections.OrderedDict = PrivateAttr()
+
+    def __init__(self, docstore: BaseDocumentStore, path: Path, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        assert self.num_perm % self.bands == 0, "num_perm must be a multiple of bands"
+        self._docstore = docstore
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(
+            str(path), timeout=30, check_same_thread=False, isolation_level=None
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS signatures "
+            "(node_id TEXT PRIMARY KEY, signature BLOB NOT NULL)"
+        )
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS bands "
+            "(band_key INTEGER NOT NULL, node_id TEXT NOT NULL)"
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS bands_band_key ON bands (band_key)"
+        )
+        self._lock = threading.Lock()
+        # Fixed seed: the signatures are compared across runs
+        rng = np.random.RandomState(1)
+        # a * hash + b must not overflow 64 bits, with 32-bit hashes
+        self._a = rng.randint(1, 1 << 31, size=self.num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, 1 << 31, size=self.num_perm, dtype=np.uint64)
+        self._recent = collections.OrderedDict()
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "NearDuplicateFilter"
+
+    def signature(self, text: str) -> np.ndarray | None:
+        """MinHash signature of the word shingles of a text, None if no words."""
+        words = _WORD_RE.findall(text.lower())
+        if not words:
+            return None
+        size = min(self.shingle_size, len(words))
+        shingles = {" ".join(words[i : i + size]) for i in range(len(words) - size + 1)}
+        hashes = np.fromiter(
+            (zlib.crc32(shingle.encode()) for shingle in shingles),
+            dtype=np.uint64,
+            count=len(shingles),
+        )
+        permuted = (hashes[:, None] * self._a + self._b) % _MERSENNE_PRIME
+        return (permuted & _MAX_HASH).min(axis=0).astype(np.uint32)
+
+    def _band_keys(self, signature: np.ndarray) -> list[int]:
+        return [
+            int.from_bytes(
+                hashlib.blake2b(band.tobytes() + bytes([i]), digest_size=8).digest(),
+                "little",
+                signed=True,
+            )
+            for i, band in enumerate(np.split(signature, self.bands))
+        ]
+
+    def _stored_candidates(self, band_keys: list[int]) -> list[tuple[str, np.ndarray]]:
+        placeholders = ",".join("?" * len(band_keys))
+        rows = self._connection.execute(
+            "SELECT DISTINCT s.node_id, s.signature FROM bands b "
+            f"JOIN signatures s USING (node_id) WHERE b.band_key IN ({placeholders})",
+            band_keys,
+        ).fetchall()
+        return [
+            (node_id, np.frombuffer(signature, dtype=np.uint32))
+            for node_id, signature in rows
+        ]
+
+    def _similarity(self, left: np.ndarray, right: np.ndarray) -> float:
+        return float(np.mean(left == right))
+
+    def __call__(self, nodes: list[BaseNode], **kwargs: Any) -> list[BaseNode]:
+        with self._lock:
+            return self._deduplicate(nodes)
+
+    def _deduplicate(self, nodes: list[BaseNode]) -> list[BaseNode]:
+        signatures = [
+            self.signature(node.get_content(metadata_mode=MetadataMode.NONE))
+            for node in nodes
+        ]
+        band_keys = [
+            self._band_keys(signature) if signature is not None else []
+            for signature in signatures
+        ]
+        # Stored nodes similar enough, checked in the docstore in one batch
+        stored_matches: list[list[str]] = []
+        for signature, keys in zip(signatures, band_keys):
+            stored_matches.append(
+                [
+                    node_id
+                    for node_id, candidate in (
+                        self._stored_candidates(keys) if keys else []
+                    )
+                    if self._similarity(signature, candidate) >= self.threshold
+                ]
+            )
+        matched_ids = {node_id for ids in stored_matches for node_id in ids}
+        alive_ids = set(get_nodes(self._docstore, list(matched_ids)))
+        stale_ids = {
+            node_id
+            for node_id in matched_ids - alive_ids
+            if node_id not in self._recent
+        }
+
+        # Originals of this call, by band key
+        new_bands: dict[int, list[tuple[str, np.ndarray]]] = {}
+        new_originals: list[tuple[BaseNode, np.ndarray, list[int]]] = []
+        kept: list[BaseNode] = []
+        count_duplicates = 0
+        for node, signature, keys, matches in zip(
+            nodes, signatures, band_keys, stored_matches
+        ):
+            original_id = next((i for i in matches if i in alive_ids), None)
+            if original_id is None and signature is not None:
+                original_id = next(
+                    (
+                        node_id
+                        for key in keys
+                        for node_id, candidate in new_bands.get(key, ())
+                        if self._similarity(signature, candidate) >= self.threshold
+                    ),
+                    None,
+                )
+            if original_id is None:
+                kept.append(node)
+                if signature is not None:
+                    new_originals.append((node, signature, keys))
+                    for key in keys:
+                        new_bands.setdefault(key, []).append((node.node_id, signature))
+                continue
+            count_duplicates += 1
+            DUPLICATE_NODES.inc(action=self.action)
+            if self.action == "alias":
+                node.metadata[DUPLICATE_OF_METADATA_KEY] = original_id
+                for excluded_keys in (
+                    node.excluded_embed_metadata_keys,
+                    node.excluded_llm_metadata_keys,
+                ):
+                    if DUPLICATE_OF_METADATA_KEY not in excluded_keys:
+                        excluded_keys.append(DUPLICATE_OF_METADATA_KEY)
+                kept.append(node)
+
+        self._save(new_originals, stale_ids)
+        if count_duplicates:
+            logger.debug(
+                "Found count=%s near-duplicate nodes of count=%s",
+                count_duplicates,
+                len(nodes),
+            )
+        return kept
+
+    def _save(
+        self,
+        originals: list[tuple[BaseNode, np.ndarray, list[int]]],
+        stale_ids: set[str],
+    ) -> None:
+        for node, _, _ in originals:
+            self._recent[node.node_id] = None
+        while len(self._recent) > _RECENT_ORIGINALS:
+            self._recent.popitem(last=False)
+        if not originals and not stale_ids:
+            return
+        self._connection.execute("BEGIN")
+        try:
+            # The nodes of deleted or failed documents
+            self._connection.executemany(
+                "DELETE FROM signatures WHERE node_id = ?",
+                [(node_id,) for node_id in stale_ids],
+            )
+            self._connection.executemany(
+                "DELETE FROM bands WHERE node_id = ?",
+                [(node_id,) for node_id in stale_ids],
+            )
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO signatures VALUES (?, ?)",
+                [
+                    (node.node_id, signature.tobytes())
+                    for node, signature, _ in originals
+                ],
+            )
+            self._connection.executemany(
+                "INSERT INTO bands VALUES (?, ?)",
+                [(key, node.node_id) for node, _, keys in originals for key in keys],
+            )
+            self._connection.execute("COMMIT")
+        except Exception:
+            self._connection.execute("ROLLBACK")
+            raise
+
+    def close(self) -> None:
+        self._connection.close()
+
+
+class NearDuplicateCollapser(BaseNodePostprocessor):
+    """Keep one node of each group of near-duplicates among the retrieved ones.
+
+    The aliases made by `NearDuplicateFilter` are grouped with their original
+    node, only the first node of each group is kept: put it after the
+    postprocessors which sort the nodes.
+    """
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "NearDuplicateCollapser"
+
+    def _postprocess_nodes(
+        self,
+        nodes: list[NodeWithScore],
+        query_bundle: QueryBundle | None = None,
+    ) -> list[NodeWithScore]:
+        seen: set[str] = set()
+        collapsed = []
+        for node in nodes:
+            group = node.node.metadata.get(DUPLICATE_OF_METADATA_KEY, node.node.node_id)
+            if group in seen:
+                continue
+            seen.add(group)
+            collapsed.append(node)
+        return collapsed
@@ -10,7 +10,66 @@ from app.config.settings import (
     EmbeddingSettings,
     get_embeddings_settings,
 )
-from app.paths import models_cache_path
+from app.dependencies.components.embedding_cache import (
+    CachedEmbedding,
+    EmbeddingCache,
+)
+from app.paths import PROJECT_ROOT_PATH, embedding_cache_path, models_cache_path
+
+# Local models, computed on this machine, which can run in worker processes
+PROCESS_EMBEDDING_MODES = {"huggingface", "onnx"}
+
+
+def build_embedding_model(
+    app_settings: AppSettings,
+    ollama_settings: OllamaSettings,
+    embeddings_settings: EmbeddingSettings,
+) -> BaseEmbedding:
+    """Build the configured embedding model, without the cache in front of it."""
+    match embeddings_settings.mode:
+        case "huggingface":
+            try:
+                from llama_index.embeddings.huggingface import HuggingFaceEmbedding  # type: ignore
+            except ImportError as e:
+                raise ImportError(
+                    "Local dependencies not found, install with "
+                    "`poetry install --extras embeddings-huggingface`"
+                ) from e
+            return HuggingFaceEmbedding(
+                model_name=app_settings.embedding_hf_model_name,
+                cache_folder=str(models_cache_path),
+                # `encode` splits the texts it is given in batches of this
+                # size, it must not split the batches of the scheduler
+                embed_batch_size=embeddings_settings.batch_max_size,
+            )
+        case "onnx":
+            from app.dependencies.components.onnx_embedding import OnnxEmbedding
+
+            return OnnxEmbedding(
+                model_path=PROJECT_ROOT_PATH / embeddings_settings.onnx_model_path,
+                model_name=app_settings.embedding_hf_model_name,
+                quantized=embeddings_settings.onnx_quantized,
+                intra_op_threads=embeddings_settings.onnx_intra_op_threads,
+                inter_op_threads=embeddings_settings.onnx_inter_op_threads,
+                max_length=embeddings_settings.onnx_max_length,
+            )
+        case "ollama":
+            try:
+                from llama_index.embeddings.ollama import (  # type: ignore
+                    OllamaEmbedding,
+                )
+            except ImportError as e:
+                raise ImportError(
+                    "Local dependencies not found, install with `poetry install --extras embeddings-ollama`"
+                ) from e
+
+            return OllamaEmbedding(
+                model_name=ollama_settings.embedding_model,
+                base_url=ollama_settings.embedding_api_base,
+            )
+        case "mock":
+            return MockEmbedding(384)
+    raise ValueError(f"Unsupported embedding mode {embeddings_settings.mode}")
 
 
 class EmbeddingComponent:
@@ -22,35 +81,31 @@ class EmbeddingComponent:
         ollama_settings: OllamaSettings = get_ollama_settings(),
         embeddings_settings: EmbeddingSettings = get_embeddings_settings(),
     ) -> None:
-        match embeddings_settings.mode:
-            case "huggingface":
-                try:
-                    from llama_index.embeddings.huggingface import HuggingFaceEmbedding  # type: ignore
-                except ImportError as e:
-                    raise ImportError(
-                        "Local dependencies not found, install with "
-                        "`poetry install --extras embeddings-huggingface`"
-                    ) from e
-                self.embedding_model = HuggingFaceEmbedding(
-                    model_name=app_settings.embedding_hf_model_name,
-                    cache_folder=str(models_cache_path),
-                )
-            case "ollama":
-                try:
-                    from llama_index.embeddings.ollama import (  # type: ignore
-                        OllamaEmbedding,
-                    )
-                except ImportError as e:
-                    raise ImportError(
-                        "Local dependencies not found, install with `poetry install --extras embeddings-ollama`"
-                    ) from e
-
-                self.embedding_model = OllamaEmbedding(
-                    model_name=ollama_settings.embedding_model,
-                    base_url=ollama_settings.embedding_api_base,
-                )
-            case "mock":
-                self.embedding_model = MockEmbedding(384)
+        if (
+            embeddings_settings.embedding_workers > 1
+            and embeddings_settings.mode in PROCESS_EMBEDDING_MODES
+        ):
+            from app.dependencies.components.embedding_pool import ProcessEmbedding
+
+            self.embedding_model = ProcessEmbedding(
+                app_settings=app_settings,
+                ollama_settings=ollama_settings,
+                embeddings_settings=embeddings_settings,
+                count_workers=embeddings_settings.embedding_workers,
+            )
+        else:
+            self.embedding_model = build_embedding_model(
+                app_settings, ollama_settings, embeddings_settings
+            )
+
+        if embeddings_settings.cache_enabled and embeddings_settings.mode != "mock":
+            self.embedding_model = CachedEmbedding(
+                embed_model=self.embedding_model,
+                cache=EmbeddingCache(
+                    path=embedding_cache_path,
+                    max_size_bytes=embeddings_settings.cache_max_size_mb * 1024 * 1024,
+                ),
+            )
 
 
 @lru_cache
@@ -0,0 +1,262 @@
+import hashlib
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+from pathlib import Path
+from typing import Any
+
+import structlog
+from llama_index.core.base.embeddings.base import BaseEmbedding, Embedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+
+logger = structlog.stdlib.get_logger(__name__)
+
+
+# Read hits whose access time is written at once, or after `_TOUCH_INTERVAL`
+# seconds: the LRU order is only approximate between two writes
+_TOUCH_BATCH_SIZE = 256
+_TOUCH_INTERVAL = 30.0
+
+
+def _normalize_text(text: str) -> str:
+    return unicodedata.normalize("NFC", text).strip()
+
+
+class EmbeddingCache:
+    """Size-bounded LRU cache of embedding vectors, stored on local disk.
+
+    Vectors are keyed by the model name, the kind of embedding (text or query)
+    and the hash of the normalized text. The cache is backed by SQLite, so it
+    is safe to share between threads and between the workers of the API.
+    When the stored vectors of all the processes exceed `max_size_bytes`,
+    the least recently used entries are evicted.
+    """
+
+    def __init__(self, path: Path, max_size_bytes: int) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_size_bytes = max_size_bytes
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            str(path), timeout=30, check_same_thread=False, isolation_level=None
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_last_access "
+            "ON embeddings (last_access)"
+        )
+        # Size of the stored vectors, kept by triggers so that it is shared by
+        # all the processes using the cache
+        self._connection.execute("BEGIN IMMEDIATE")
+        try:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS cache_size ("
+                "id INTEGER PRIMARY KEY CHECK (id = 0), size_bytes INTEGER NOT NULL)"
+            )
+            self._connection.execute(
+                "INSERT OR IGNORE INTO cache_size "
+                "SELECT 0, COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+            )
+            self._connection.execute(
+                "CREATE TRIGGER IF NOT EXISTS embeddings_insert AFTER INSERT ON "
+                "embeddings BEGIN UPDATE cache_size "
+                "SET size_bytes = size_bytes + LENGTH(NEW.vector); END"
+            )
+            self._connection.execute(
+                "CREATE TRIGGER IF NOT EXISTS embeddings_delete AFTER DELETE ON "
+                "embeddings BEGIN UPDATE cache_size "
+                "SET size_bytes = size_bytes - LENGTH(OLD.vector); END"
+            )
+            self._connection.execute("COMMIT")
+        except Exception:
+            self._connection.execute("ROLLBACK")
+            raise
+        # Access times of the read hits, written in batches: a write per read
+        # would contend for the write lock on the hot path
+        self._touched: dict[str, float] = {}
+        self._touched_since = time.monotonic()
+
+    @staticmethod
+    def key(model_name: str, kind: str, text: str) -> str:
+        text_hash = hashlib.sha256(_normalize_text(text).encode()).hexdigest()
+        return f"{model_name}:{kind}:{text_hash}"
+
+    def get_many(self, keys: list[str]) -> dict[str, Embedding]:
+        if not keys:
+            return {}
+        found: dict[str, Embedding] = {}
+        unique_keys = list(dict.fromkeys(keys))
+        with self._lock:
+            # SQLite limits the number of bound parameters per statement
+            for start in range(0, len(unique_keys), 500):
+                chunk = unique_keys[start : start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._connection.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                    chunk,
+                ).fetchall()
+                for key, vector in rows:
+                    found[key] = array("f", vector).tolist()
+            if found:
+                now = time.time()
+                self._touched.update((key, now) for key in found)
+                if (
+                    len(self._touched) >= _TOUCH_BATCH_SIZE
+                    or time.monotonic() - self._touched_since >= _TOUCH_INTERVAL
+                ):
+                    self._flush_touched()
+        return found
+
+    def _flush_touched(self) -> None:
+        """Write the pending access times, must be called holding the lock."""
+        if self._touched:
+            self._connection.executemany(
+                "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                [(last_access, key) for key, last_access in self._touched.items()],
+            )
+            self._touched.clear()
+        self._touched_since = time.monotonic()
+
+    def put_many(self, items: dict[str, Embedding]) -> None:
+        if not items:
+            return
+        now = time.time()
+        rows = [
+            (key, array("f", vector).tobytes(), now) for key, vector in items.items()
+        ]
+        with self._lock:
+            # Immediate: the size is read and the eviction decided in the same
+            # write transaction, so that concurrent processes don't both evict
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                self._connection.executemany(
+                    "INSERT OR IGNORE INTO embeddings VALUES (?, ?, ?)", rows
+                )
+                (size_bytes,) = self._connection.execute(
+                    "SELECT size_bytes FROM cache_size"
+                ).fetchone()
+                if size_bytes > self.max_size_bytes:
+                    self._flush_touched()
+                    self._evict(size_bytes)
+                self._connection.execute("COMMIT")
+            except Exception:
+                self._connection.execute("ROLLBACK")
+                raise
+
+    def _evict(self, size_bytes: int) -> None:
+        # Evict down to 90% of the budget to avoid evicting on every insert
+        target = int(self.max_size_bytes * 0.9)
+        rows = self._connection.execute(
+            "SELECT key, LENGTH(vector) FROM embeddings ORDER BY last_access"
+        )
+        evicted_keys = []
+        for key, size in rows:
+            if size_bytes <= target:
+                break
+            evicted_keys.append((key,))
+            size_bytes -= size
+        self._connection.executemany(
+            "DELETE FROM embeddings WHERE key = ?", evicted_keys
+        )
+        logger.debug("Evicted count=%s embeddings from the cache", len(evicted_keys))
+
+    def close(self) -> None:
+        with self._lock:
+            self._flush_touched()
+            self._connection.close()
+
+
+class CachedEmbedding(BaseEmbedding):
+    """Read-through cache in front of another embedding model."""
+
+    _embed_model: BaseEmbedding = PrivateAttr()
+    _cache: EmbeddingCache = PrivateAttr()
+
+    def __init__(
+        self, embed_model: BaseEmbedding, cache: EmbeddingCache, **kwargs: Any
+    ) -> None:
+        super().__init__(
+            model_name=embed_model.model_name,
+            embed_batch_size=embed_model.embed_batch_size,
+            callback_manager=embed_model.callback_manager,
+            **kwargs,
+        )
+        self._embed_model = embed_model
+        self._cache = cache
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CachedEmbedding"
+
+    @property
+    def embed_model(self) -> BaseEmbedding:
+        return self._embed_model
+
+    def _cached_embeddings(
+        self, kind: str, texts: list[str]
+    ) -> tuple[list[str], dict[str, Embedding], dict[str, str]]:
+        keys = [EmbeddingCache.key(self.model_name, kind, text) for text in texts]
+        found = self._cache.get_many(keys)
+        # Embed each missing text once, even if it appears several times
+        missing = {key: text for key, text in zip(keys, texts) if key not in found}
+        return keys, found, missing
+
+    def _store(
+        self,
+        keys: list[str],
+        found: dict[str, Embedding],
+        missing: dict[str, str],
+        embeddings: list[Embedding],
+    ) -> list[Embedding]:
+        # Rounded like the stored vectors, so that a miss returns what a hit would
+        computed = {
+            key: array("f", embedding).tolist()
+            for key, embedding in zip(missing, embeddings)
+        }
+        self._cache.put_many(computed)
+        found.update(computed)
+        return [found[key] for key in keys]
+
+    def _get_query_embedding(self, query: str) -> Embedding:
+        keys, found, missing = self._cached_embeddings("query", [query])
+        embeddings = [
+            self._embed_model._get_query_embedding(q) for q in missing.values()
+        ]
+        return self._store(keys, found, missing, embeddings)[0]
+
+    async def _aget_query_embedding(self, query: str) -> Embedding:
+        keys, found, missing = self._cached_embeddings("query", [query])
+        embeddings = [
+            await self._embed_model._aget_query_embedding(q) for q in missing.values()
+        ]
+        return self._store(keys, found, missing, embeddings)[0]
+
+    def _get_text_embedding(self, text: str) -> Embedding:
+        return self._get_text_embeddings([text])[0]
+
+    async def _aget_text_embedding(self, text: str) -> Embedding:
+        return (await self._aget_text_embeddings([text]))[0]
+
+    def _get_text_embeddings(self, texts: list[str]) -> list[Embedding]:
+        keys, found, missing = self._cached_embeddings("text", texts)
+        embeddings = (
+            self._embed_model._get_text_embeddings(list(missing.values()))
+            if missing
+            else []
+        )
+        return self._store(keys, found, missing, embeddings)
+
+    async def _aget_text_embeddings(self, texts: list[str]) -> list[Embedding]:
+        keys, found, missing = self._cached_embeddings("text", texts)
+        embeddings = (
+            await self._embed_model._aget_text_embeddings(list(missing.values()))
+            if missing
+            else []
+        )
+        return self._store(keys, found, missing, embeddings)
@@ -0,0 +1,377 @@
+import asyncio
+import atexit
+import math
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.connection import Connection
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Literal
+
+import numpy as np
+import structlog
+from llama_index.core.base.embeddings.base import BaseEmbedding, Embedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+
+from app.config.settings import AppSettings, EmbeddingSettings, OllamaSettings
+
+logger = structlog.stdlib.get_logger(__name__)
+
+EmbeddingKind = Literal["text", "query"]
+
+# Interval between two liveness checks of a worker embedding a batch
+_POLL_INTERVAL = 0.1
+
+
+class EmbeddingWorkerError(RuntimeError):
+    """An embedding worker process failed to start or to embed a batch."""
+
+
+def _encode_texts(texts: list[str]) -> tuple[bytes, list[int]]:
+    encoded = [text.encode("utf-8", errors="surrogatepass") for text in texts]
+    return b"".join(encoded), [len(data) for data in encoded]
+
+
+def _decode_texts(buffer: memoryview, lengths: list[int]) -> list[str]:
+    texts = []
+    offset = 0
+    for length in lengths:
+        texts.append(
+            bytes(buffer[offset : offset + length]).decode(
+                "utf-8", errors="surrogatepass"
+            )
+        )
+        offset += length
+    return texts
+
+
+def _attach(buffers: dict[str, SharedMemory], role: str, name: str) -> SharedMemory:
+    # The parent replaces a buffer by a bigger one when a batch doesn't fit
+    buffer = buffers.get(role)
+    if buffer is None or buffer.name != name:
+        if buffer is not None:
+            buffer.close()
+        buffer = buffers[role] = SharedMemory(name=name)
+    return buffer
+
+
+def _embedding_worker(
+    connection: Connection,
+    settings: tuple[AppSettings, OllamaSettings, EmbeddingSettings],
+    count_threads: int,
+) -> None:
+    # Runs in the worker process: load the model once, then embed the batches
+    # read from the input buffer into the output buffer until told to stop.
+    # The compute libraries must not start a thread per core in every worker.
+    for variable in ("OMP_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ[variable] = str(count_threads)
+    from app.dependencies.components.embedding import build_embedding_model
+
+    app_settings, ollama_settings, embeddings_settings = settings
+    if embeddings_settings.onnx_intra_op_threads == 0:
+        embeddings_settings = embeddings_settings.model_copy(
+            update={"onnx_intra_op_threads": count_threads}
+        )
+    try:
+        embed_model = build_embedding_model(
+            app_settings, ollama_settings, embeddings_settings
+        )
+        dimension = len(embed_model.get_text_embedding("dimension"))
+    except Exception as e:
+        connection.send(("error", f"{type(e).__name__}: {e}"))
+        return
+    connection.send(("ready", (embed_model.model_name, dimension)))
+
+    buffers: dict[str, SharedMemory] = {}
+    while True:
+        try:
+            job = connection.recv()
+        except EOFError:
+            break
+        if job is None:
+            break
+        kind, input_name, lengths, output_name = job
+        try:
+            texts = _decode_texts(_attach(buffers, "input", input_name).buf, lengths)
+            if kind == "query":
+                embeddings = [embed_model._get_query_embedding(t) for t in texts]
+            else:
+                embeddings = embed_model._get_text_embeddings(texts)
+            vectors = np.ndarray(
+                (len(texts), dimension),
+                dtype=np.float32,
+                buffer=_attach(buffers, "output", output_name).buf,
+            )
+            vectors[:] = embeddings
+            # The buffer can't be closed while an array is using it
+            del vectors
+            connection.send(("ok", len(texts)))
+        except Exception as e:
+            connection.send(("error", f"{type(e).__name__}: {e}"))
+    for buffer in buffers.values():
+        buffer.close()
+
+
+class _EmbeddingWorker:
+    def __init__(
+        self,
+        context: multiprocessing.context.BaseContext,
+        settings: tuple[AppSettings, OllamaSettings, EmbeddingSettings],
+        count_threads: int,
+    ) -> None:
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(  # type: ignore[attr-defined]
+            target=_embedding_worker,
+            args=(child_connection, settings, count_threads),
+            daemon=True,
+        )
+        self.process.start()
+        child_connection.close()
+        self.killed = False
+        self._buffers: dict[str, SharedMemory] = {}
+
+    def wait_ready(self) -> tuple[str, int]:
+        """Wait for the model to be loaded, return its name and dimension."""
+        try:
+            status, result = self.connection.recv()
+        except EOFError as e:
+            raise EmbeddingWorkerError(
+                f"Embedding worker exited with code {self.process.exitcode}"
+            ) from e
+        if status == "error":
+            raise EmbeddingWorkerError(f"Embedding worker failed to start: {result}")
+        return result
+
+    def buffer(self, role: str, size: int) -> SharedMemory:
+        """Shared buffer of at least `size` bytes, grown by doubling."""
+        buffer = self._buffers.get(role)
+        if buffer is None or buffer.size < size:
+            if buffer is not None:
+                size = max(size, 2 * buffer.size)
+                buffer.close()
+                buffer.unlink()
+            buffer = self._buffers[role] = SharedMemory(create=True, size=max(size, 1))
+        return buffer
+
+    def stop(self) -> None:
+        try:
+            self.connection.send(None)
+        except OSError:
+            pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self._release()
+
+    def kill(self) -> None:
+        self.killed = True
+        self.process.kill()
+        self.process.join()
+        self._release()
+
+    def _release(self) -> None:
+        self.connection.close()
+        for buffer in self._buffers.values():
+            buffer.close()
+            buffer.unlink()
+        self._buffers.clear()
+
+
+class ProcessEmbedding(BaseEmbedding):
+    """Run the configured local embedding model in a pool of processes.
+
+    Embedding in threads of the API process is serialized by the GIL, so each
+    worker process loads its own copy of the model (the weights files are
+    shared through the OS page cache) and embeds with a share of the cores.
+    Texts and vectors go through shared memory buffers, one pair per worker,
+    only their lengths are sent through the pipe.
+
+    A large batch is split over all the workers, and concurrent callers (the
+    threads of the `parallel` and `pipeline` ingest modes) each take an idle
+    worker. A worker which dies, or is still embedding a batch after `timeout`
+    seconds, is killed and its batch fails, a new worker is started for the
+    next batch which finds no idle worker.
+    """
+
+    _settings: tuple[AppSettings, OllamaSettings, EmbeddingSettings] = PrivateAttr()
+    _count_threads: int = PrivateAttr()
+    _count_workers: int = PrivateAttr()
+    _timeout: float = PrivateAttr()
+    _context: Any = PrivateAttr()
+    _dimension: int = PrivateAttr()
+    _lock: threading.Lock = PrivateAttr()
+    _workers: list[_EmbeddingWorker] = PrivateAttr()
+    _idle_workers: list[_EmbeddingWorker] = PrivateAttr()
+    _worker_slots: threading.BoundedSemaphore = PrivateAttr()
+    _executor: ThreadPoolExecutor = PrivateAttr()
+
+    def __init__(
+        self,
+        app_settings: AppSettings,
+        ollama_settings: OllamaSettings,
+        embeddings_settings: EmbeddingSettings,
+        count_workers: int,
+        **kwargs: Any,
+    ) -> None:
+        assert count_workers > 0, "count_workers must be > 0"
+        settings = (app_settings, ollama_settings, embeddings_settings)
+        count_threads = max(1, (os.cpu_count() or 1) // count_workers)
+        # Forking a process with running threads can copy locked locks
+        context = multiprocessing.get_context("spawn")
+        logger.info(
+            "Starting count=%s embedding workers with count=%s threads each",
+            count_workers,
+            count_threads,
+        )
+        workers = [
+            _EmbeddingWorker(context, settings, count_threads)
+            for _ in range(count_workers)
+        ]
+        try:
+            model_name, dimension = [worker.wait_ready() for worker in workers][0]
+        except EmbeddingWorkerError:
+            for worker in workers:
+                worker.kill()
+            raise
+
+        super().__init__(model_name=model_name, **kwargs)
+        self._settings = settings
+        self._count_threads = count_threads
+        self._count_workers = count_workers
+        self._timeout = embeddings_settings.embedding_worker_timeout
+        self._context = context
+        self._dimension = dimension
+        self._lock = threading.Lock()
+        self._workers = workers
+        self._idle_workers = list(workers)
+        self._worker_slots = threading.BoundedSemaphore(count_workers)
+        self._executor = ThreadPoolExecutor(
+            max_workers=count_workers, thread_name_prefix="embedding-pool"
+        )
+        atexit.register(self.close)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "ProcessEmbedding"
+
+    def _embed(self, kind: EmbeddingKind, texts: list[str]) -> list[Embedding]:
+        if not texts:
+            return []
+        chunk_size = math.ceil(len(texts) / self._count_workers)
+        chunks = [
+            texts[start : start + chunk_size]
+            for start in range(0, len(texts), chunk_size)
+        ]
+        if len(chunks) == 1:
+            return self._embed_in_worker(kind, texts)
+        embeddings: list[Embedding] = []
+        for chunk_embeddings in self._executor.map(
+            lambda chunk: self._embed_in_worker(kind, chunk), chunks
+        ):
+            embeddings.extend(chunk_embeddings)
+        return embeddings
+
+    def _embed_in_worker(
+        self, kind: EmbeddingKind, texts: list[str]
+    ) -> list[Embedding]:
+        with self._worker_slots:
+            worker = self._acquire_worker()
+            try:
+                return self._run_in_worker(worker, kind, texts)
+            except (EOFError, OSError) as e:
+                logger.warning("Embedding worker pid=%s died", worker.process.pid)
+                self._discard_worker(worker)
+                raise EmbeddingWorkerError("Embedding worker died") from e
+            finally:
+                self._release_worker(worker)
+
+    def _acquire_worker(self) -> _EmbeddingWorker:
+        with self._lock:
+            if self._idle_workers:
+                return self._idle_workers.pop()
+        # A worker died: its slot is free, but without an idle worker
+        logger.info("Starting an embedding worker to replace a dead one")
+        worker = _EmbeddingWorker(self._context, self._settings, self._count_threads)
+        try:
+            worker.wait_ready()
+        except EmbeddingWorkerError:
+            worker.kill()
+            raise
+        with self._lock:
+            self._workers.append(worker)
+        return worker
+
+    def _release_worker(self, worker: _EmbeddingWorker) -> None:
+        if worker.killed:
+            return
+        with self._lock:
+            self._idle_workers.append(worker)
+
+    def _discard_worker(self, worker: _EmbeddingWorker) -> None:
+        worker.kill()
+        with self._lock:
+            self._workers.remove(worker)
+
+    def _run_in_worker(
+        self, worker: _EmbeddingWorker, kind: EmbeddingKind, texts: list[str]
+    ) -> list[Embedding]:
+        data, lengths = _encode_texts(texts)
+        input_buffer = worker.buffer("input", len(data))
+        input_buffer.buf[: len(data)] = data
+        output_buffer = worker.buffer(
+            "output", len(texts) * self._dimension * np.float32().itemsize
+        )
+        deadline = time.monotonic() + self._timeout
+        worker.connection.send((kind, input_buffer.name, lengths, output_buffer.name))
+        while not worker.connection.poll(_POLL_INTERVAL):
+            failure = None
+            if not worker.process.is_alive():
+                failure = f"exited with code {worker.process.exitcode}"
+            elif time.monotonic() > deadline:
+                failure = f"still running after {self._timeout}s"
+            if failure is not None:
+                logger.warning(
+                    "Killing embedding worker pid=%s, it %s",
+                    worker.process.pid,
+                    failure,
+                )
+                self._discard_worker(worker)
+                raise EmbeddingWorkerError(f"Embedding worker {failure}")
+        status, result = worker.connection.recv()
+        if status == "error":
+            raise EmbeddingWorkerError(result)
+        return (
+            np.frombuffer(
+                output_buffer.buf, dtype=np.float32, count=len(texts) * self._dimension
+            )
+            .reshape(len(texts), self._dimension)
+            .tolist()
+        )
+
+    def _get_query_embedding(self, query: str) -> Embedding:
+        return self._embed("query", [query])[0]
+
+    async def _aget_query_embedding(self, query: str) -> Embedding:
+        return await asyncio.to_thread(self._get_query_embedding, query)
+
+    def _get_text_embedding(self, text: str) -> Embedding:
+        return self._embed("text", [text])[0]
+
+    def _get_text_embeddings(self, texts: list[str]) -> list[Embedding]:
+        return self._embed("text", texts)
+
+    async def _aget_text_embeddings(self, texts: list[str]) -> list[Embedding]:
+        return await asyncio.to_thread(self._get_text_embeddings, texts)
+
+    def close(self) -> None:
+        """Stop the workers and release their shared buffers."""
+        atexit.unregister(self.close)
+        self._executor.shutdown(wait=False)
+        with self._lock:
+            workers, self._workers = self._workers, []
+            self._idle_workers = []
+        for worker in workers:
+            worker.stop()
@@ -0,0 +1,92 @@
+from collections.abc import Callable
+from typing import Any
+
+import structlog
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.schema import BaseNode, MetadataMode, TransformComponent
+from llama_index.core.utils import get_tokenizer
+
+logger = structlog.stdlib.get_logger(__name__)
+
+
+class EmbeddingBatchScheduler(TransformComponent):
+    """Embed nodes in batches of similar token length, sized to a token budget.
+
+    Used in place of the embedding model in the ingest transformations. The
+    embedding model embeds the nodes in their arrival order, by batches of
+    `embed_batch_size`: short and long texts are padded to the same length,
+    and a fixed batch size is either too small for short texts or too big
+    for long ones. Here the nodes are sorted by token length, then grouped in
+    batches whose padded size (count of texts * longest text) fits in
+    `token_budget`, up to `max_batch_size` texts. The embeddings are set on
+    the nodes, which are returned in their original order.
+
+    Token lengths are estimated with the global tokenizer, which is close
+    enough to the tokenizer of the embedding model to bucket the texts.
+    The batches are capped to the `embed_batch_size` of the model too, so
+    that `get_text_embedding_batch` embeds each one in a single call.
+    """
+
+    embed_model: BaseEmbedding
+    token_budget: int = Field(
+        default=8192, description="Max count of padded tokens in a batch."
+    )
+    max_batch_size: int = Field(
+        default=64, description="Max count of texts in a batch."
+    )
+
+    _tokenizer: Callable[[str], list] = PrivateAttr()
+
+    def __init__(self, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self._tokenizer = get_tokenizer()
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "EmbeddingBatchScheduler"
+
+    def _batches(self, texts: list[str]) -> list[list[int]]:
+        """Group the indices of the texts in batches, shortest texts first."""
+        lengths = [len(self._tokenizer(text)) for text in texts]
+        max_batch_size = min(self.max_batch_size, self.embed_model.embed_batch_size)
+        batches: list[list[int]] = []
+        batch: list[int] = []
+        for index in sorted(range(len(texts)), key=lengths.__getitem__):
+            # Sorted by length: the text being added is the longest of the batch
+            padded_size = (len(batch) + 1) * lengths[index]
+            if batch and (
+                padded_size > self.token_budget or len(batch) >= max_batch_size
+            ):
+                batches.append(batch)
+                batch = []
+            batch.append(index)
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def __call__(self, nodes: list[BaseNode], **kwargs: Any) -> list[BaseNode]:
+        pending = [node for node in nodes if node.embedding is None]
+        texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in pending]
+        batches = self._batches(texts)
+        logger.debug(
+            "Embedding count=%s nodes in count=%s batches", len(pending), len(batches)
+        )
+        for batch in batches:
+            embeddings = self.embed_model.get_text_embedding_batch(
+                [texts[index] for index in batch]
+            )
+            for index, embedding in zip(batch, embeddings):
+                pending[index].embedding = embedding
+        return nodes
+
+    async def acall(self, nodes: list[BaseNode], **kwargs: Any) -> list[BaseNode]:
+        pending = [node for node in nodes if node.embedding is None]
+        texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in pending]
+        for batch in self._batches(texts):
+            embeddings = await self.embed_model.aget_text_embedding_batch(
+                [texts[index] for index in batch]
+            )
+            for index, embedding in zip(batch, embeddings):
+                pending[index].embedding = embedding
+        return nodes
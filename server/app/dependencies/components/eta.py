@@ -1,12 +1,12 @@
 import datetime
-import logging
 import math
+import threading
 import time
 from collections import deque
+from collections.abc import Iterable, Sequence
+from dataclasses import dataclass
 from typing import Any
 
-logger = logging.getLogger(__name__)
-
 
 def human_time(*args: Any, **kwargs: Any) -> str:
     def timedelta_total_seconds(timedelta: datetime.timedelta) -> float:
@@ -19,7 +19,7 @@ def human_time(*args: Any, **kwargs: Any) -> str:
     secs = float(timedelta_total_seconds(datetime.timedelta(*args, **kwargs)))
     # We want (ms) precision below 2 seconds
     if secs < 2:
-        return f"{secs * 1000}ms"
+        return f"{secs * 1000:.0f}ms"
     units = [("y", 86400 * 365), ("d", 86400), ("h", 3600), ("m", 60), ("s", 1)]
     parts = []
     for unit, mul in units:
@@ -35,25 +35,33 @@ def human_time(*args: Any, **kwargs: Any) -> str:
     return " ".join(parts)
 
 
-def eta(iterator: list[Any]) -> Any:
-    """Report an ETA after 30s and every 60s thereafter."""
-    total = len(iterator)
-    _eta = ETA(total)
-    _eta.needReport(30)
-    for processed, data in enumerate(iterator, start=1):
-        yield data
-        _eta.update(processed)
-        if _eta.needReport(60):
-            logger.info(f"{processed}/{total} - ETA {_eta.human_time()}")
+@dataclass(frozen=True)
+class StageProgress:
+    done: int
+    total: int
+    # Items per second, and seconds left, once enough progress is seen
+    rate: float | None = None
+    seconds_left: float | None = None
+    eta: str | None = None
 
 
 class ETA:
-    """Predict how long something will take to complete."""
+    """Predict how long something will take to complete.
+
+    The progress over time is fitted with a regression line over the last
+    `window` updates. The sums of the regression are updated as the samples
+    enter and leave the window, so updating and predicting are O(1).
+    """
 
-    def __init__(self, total: int):
+    def __init__(self, total: int, window: int = 100):
         self.total: int = total  # Total expected records.
         self.rate: float = 0.0  # per second
-        self._timing_data: deque[tuple[float, int]] = deque(maxlen=100)
+        self.window = window
+        self._timing_data: deque[tuple[float, int]] = deque()
+        # Times are relative to the start, their squares would lose precision
+        self._origin = time.time()
+        self._sums = [0.0, 0.0, 0.0, 0.0]  # x, y, x², xy
+        self._count_evicted = 0
         self.secondsLeft: float = 0.0
         self.nexttime: float = 0.0
 
@@ -62,11 +70,33 @@ class ETA:
             return f"{human_time(seconds=self.secondsLeft)} @ {int(self.rate * 60)}/min"
         return "(computing)"
 
+    def seconds_left(self) -> float | None:
+        return self.secondsLeft if self._calc() else None
+
     def update(self, count: int) -> None:
         # count should be in the range 0 to self.total
         assert count > 0
         assert count <= self.total
-        self._timing_data.append((time.time(), count))  # (X,Y) for pearson
+        sample = (time.time() - self._origin, count)
+        self._timing_data.append(sample)  # (X,Y) for pearson
+        self._add(sample, 1)
+        if len(self._timing_data) > self.window:
+            self._add(self._timing_data.popleft(), -1)
+            self._count_evicted += 1
+            if self._count_evicted >= self.window:
+                # Don't let the rounding errors of the subtractions add up
+                self._count_evicted = 0
+                self._sums = [0.0, 0.0, 0.0, 0.0]
+                for old_sample in self._timing_data:
+                    self._add(old_sample, 1)
+
+    def _add(self, sample: tuple[float, int], sign: int) -> None:
+        x, y = sample
+        sums = self._sums
+        sums[0] += sign * x
+        sums[1] += sign * y
+        sums[2] += sign * x * x
+        sums[3] += sign * x * y
 
     def needReport(self, whenSecs: int) -> bool:
         now = time.time()
@@ -77,46 +107,124 @@ class ETA:
 
     def _calc(self) -> bool:
         # A sample before a prediction.   Need two points to compute slope!
-        if len(self._timing_data) < 3:
-            return False
-
-        # http://en.wikipedia.org/wiki/Pearson_product-moment_correlation_coefficient
-        # Calculate means and standard deviations.
         samples = len(self._timing_data)
-        # column wise sum of the timing tuples to compute their mean.
-        mean_x, mean_y = (
-            sum(i) / samples for i in zip(*self._timing_data, strict=False)
-        )
-        std_x = math.sqrt(
-            sum(pow(i[0] - mean_x, 2) for i in self._timing_data) / (samples - 1)
-        )
-        std_y = math.sqrt(
-            sum(pow(i[1] - mean_y, 2) for i in self._timing_data) / (samples - 1)
-        )
+        if samples < 3:
+            return False
 
-        # Calculate coefficient.
-        sum_xy, sum_sq_v_x, sum_sq_v_y = 0.0, 0.0, 0
-        for x, y in self._timing_data:
-            x -= mean_x
-            y -= mean_y
-            sum_xy += x * y
-            sum_sq_v_x += pow(x, 2)
-            sum_sq_v_y += pow(y, 2)
-        pearson_r = sum_xy / math.sqrt(sum_sq_v_x * sum_sq_v_y)
-
-        # Calculate regression line.
-        # y = mx + b where m is the slope and b is the y-intercept.
-        m = self.rate = pearson_r * (std_y / std_x)
+        # Least squares regression line, y = mx + b where m is the slope and
+        # b is the y-intercept (m is pearson_r * std_y / std_x).
+        sum_x, sum_y, sum_xx, sum_xy = self._sums
+        mean_x, mean_y = sum_x / samples, sum_y / samples
+        var_x = sum_xx - sum_x * mean_x
+        cov_xy = sum_xy - sum_x * mean_y
+        if var_x <= 0 or cov_xy <= 0:
+            # All the samples at once, or no progress
+            return False
+        m = self.rate = cov_xy / var_x
         y = self.total
         b = mean_y - m * mean_x
         x = (y - b) / m
 
         # Calculate fitted line (transformed/shifted regression line horizontally).
-        fitted_b = self._timing_data[-1][1] - (m * self._timing_data[-1][0])
+        last_x, count = self._timing_data[-1]  # adjust last data point progress count
+        fitted_b = count - (m * last_x)
         fitted_x = (y - fitted_b) / m
-        _, count = self._timing_data[-1]  # adjust last data point progress count
         adjusted_x = ((fitted_x - x) * (count / self.total)) + x
-        eta_epoch = adjusted_x
 
-        self.secondsLeft = max([eta_epoch - time.time(), 0])
+        self.secondsLeft = max(adjusted_x - (time.time() - self._origin), 0)
         return True
+
+
+class ProgressTracker:
+    """Progress of items (e.g. files) going through successive stages.
+
+    Each stage has its own count of done items and its own ETA, fed by
+    `advance`. Reaching a stage also counts the previous ones, if they were
+    not reported. An item which stops early (failed, or skipped) is removed
+    from the totals of the stages it didn't reach, so the ETAs only account
+    for the work left. Thread-safe.
+    """
+
+    def __init__(self, items: Iterable[str], stages: Sequence[str]) -> None:
+        self.stages = tuple(stages)
+        self.started_at = time.time()
+        # Item -> count of stages reached
+        self._reached = dict.fromkeys(items, 0)
+        self.totals = {stage: len(self._reached) for stage in self.stages}
+        self.done = {stage: 0 for stage in self.stages}
+        self._etas = {stage: ETA(len(self._reached)) for stage in self.stages}
+        # The first report after 30s
+        self._next_report = self.started_at + 30
+        self._lock = threading.Lock()
+
+    def __contains__(self, item: str) -> bool:
+        return item in self._reached
+
+    def advance(self, stage: str, items: Iterable[str]) -> int:
+        """Record that the items reached a stage, return the count of new ones."""
+        rank = self.stages.index(stage) + 1
+        count_items = 0
+        with self._lock:
+            for item in items:
+                reached = self._reached.get(item)
+                if reached is None or reached >= rank:
+                    continue
+                for passed_stage in self.stages[reached:rank]:
+                    self.done[passed_stage] += 1
+                self._reached[item] = rank
+                count_items += 1
+            if count_items:
+                for passed_stage in self.stages[:rank]:
+                    if self.done[passed_stage]:
+                        self._etas[passed_stage].update(self.done[passed_stage])
+        return count_items
+
+    def stop(self, items: Iterable[str]) -> int:
+        """Record that the items won't go further (e.g. they failed), return
+        the count of items stopped."""
+        count_items = 0
+        with self._lock:
+            for item in items:
+                reached = self._reached.get(item)
+                if reached is None or reached == len(self.stages):
+                    continue
+                count_items += 1
+                for unreached_stage in self.stages[reached:]:
+                    self.totals[unreached_stage] -= 1
+                    self._etas[unreached_stage].total = max(
+                        self.totals[unreached_stage], 1
+                    )
+                self._reached[item] = len(self.stages)
+        return count_items
+
+    def snapshot(self) -> dict[str, StageProgress]:
+        with self._lock:
+            progress = {}
+            for stage in self.stages:
+                done, total = self.done[stage], self.totals[stage]
+                eta = self._etas[stage]
+                seconds_left = eta.seconds_left() if done < total else None
+                progress[stage] = StageProgress(
+                    done=done,
+                    total=total,
+                    rate=eta.rate if seconds_left is not None else None,
+                    seconds_left=seconds_left,
+                    eta=eta.human_time() if seconds_left is not None else None,
+                )
+            return progress
+
+    def need_report(self, when_seconds: int) -> bool:
+        """Whether to log the progress, at most every `when_seconds`."""
+        now = time.time()
+        with self._lock:
+            if now > self._next_report:
+                self._next_report = now + when_seconds
+                return True
+            return False
+
+    def human_progress(self) -> str:
+        return ", ".join(
+            f"{stage} {progress.done}/{progress.total}"
+            + (f" - ETA {progress.eta}" if progress.eta else "")
+            for stage, progress in self.snapshot().items()
+        )
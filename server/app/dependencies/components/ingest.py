@@ -1,13 +1,18 @@
 import abc
+import collections
 import itertools
 import logging
 import multiprocessing
 import multiprocessing.pool
 import os
 import threading
+import time
+import uuid
+from collections.abc import Callable, Iterable, Iterator, Sequence
+from dataclasses import dataclass
 from pathlib import Path
-from queue import Queue
-from typing import Any
+from queue import Empty, Queue
+from typing import Any, Literal
 
 from llama_index.core.data_structs import IndexDict
 from llama_index.core.embeddings.utils import EmbedType
@@ -18,12 +23,111 @@ from llama_index.core.schema import BaseNode, Document, TransformComponent
 from llama_index.core.storage import StorageContext
 
 from app.config.settings import EmbeddingSettings, get_embeddings_settings
-from app.dependencies.components.eta import eta
+from app.dependencies.components.checkpoint import IngestCheckpoint
+from app.dependencies.components.eta import ProgressTracker
 from app.dependencies.components.ingest_helper import IngestionHelper
-from app.paths import local_data_path
+from app.dependencies.components.metrics import get_metrics_registry
+from app.dependencies.components.node_store import delete_ref_docs
+from app.dependencies.components.parser_pool import (
+    BUSY_WORKERS,
+    FileParseError,
+    ParserPool,
+)
+from app.dependencies.components.persistence import DeltaPersister
+from app.dependencies.components.retrieval_cache import get_retrieval_cache
+from app.dependencies.components.run_progress import (
+    RunProgress,
+    get_run_progress_store,
+)
+from app.dependencies.components.vector_store import (
+    delete_ref_docs as delete_ref_doc_vectors,
+)
+from app.paths import ingest_checkpoint_path, local_data_path
 
 logger = logging.getLogger(__name__)
 
+IngestStage = Literal["parse", "embed", "persist", "skip", "fail"]
+
+_metrics = get_metrics_registry()
+STAGE_SECONDS = _metrics.histogram(
+    "ingest_stage_seconds",
+    "Time spent in each ingestion stage (parse, embed, insert, persist), per call.",
+    labels=["stage"],
+)
+FILES_TOTAL = _metrics.counter(
+    "ingest_files_total",
+    "Files by outcome: ingested, failed (parse or save error), or skipped "
+    "(with unchanged documents, in incremental mode).",
+    labels=["status"],
+)
+QUEUE_DEPTH = _metrics.gauge(
+    "ingest_queue_depth",
+    "Number of items waiting in the queues of the `pipeline` ingest mode.",
+    labels=["queue"],
+)
+_FILE_STATUSES = {"persist": "ingested", "fail": "failed", "skip": "skipped"}
+# Stages of the progress of a bulk ingestion run, in order
+PROGRESS_STAGES = ("parse", "embed", "persist")
+
+
+@dataclass(frozen=True)
+class IngestEvent:
+    """Progress of the ingestion, reported to the listeners of a component.
+
+    `count` is the number of documents for the `parse` and `skip` stages, and
+    the number of nodes for the `embed` and `persist` stages. One event can
+    cover several files when the stage ran on a batch of files.
+    """
+
+    stage: IngestStage
+    file_names: list[str]
+    count: int = 0
+    seconds: float = 0.0
+    error: str | None = None
+
+
+@dataclass
+class StreamedFiles:
+    """Files of a bulk ingestion, staged one at a time while they are ingested.
+
+    The names of the files and the fingerprints of their content are known
+    upfront (e.g. from the headers of an archive), for the checkpoint and the
+    progress of the run. `stage` yields the files of the given names in order,
+    each one staged when it is pulled, which the ingestion does as it parses
+    them.
+    """
+
+    file_names: list[str]
+    fingerprints: dict[str, str]
+    stage: Callable[[set[str]], Iterator[tuple[str, Path]]]
+
+
+def _lazy_starmap(
+    pool: multiprocessing.pool.ThreadPool,
+    func: Callable[..., Any],
+    iterable: Iterable[tuple[Any, ...]],
+) -> list[Any]:
+    """`pool.starmap`, pulling the arguments as the workers are free (where
+    `starmap` pulls them all first): all the calls are done before the first
+    error is raised."""
+    results = []
+    error: Exception | None = None
+    iterator = pool.imap(lambda args: func(*args), iterable)
+    while True:
+        try:
+            results.append(next(iterator))
+        except StopIteration:
+            break
+        except Exception as e:
+            error = error or e
+    if error is not None:
+        raise error
+    return results
+
+
+def _file_names(items: Iterable[BaseNode]) -> list[str]:
+    return list(dict.fromkeys(item.metadata.get("file_name", "") for item in items))
+
 
 class BaseIngestComponent(abc.ABC):
     def __init__(
@@ -38,19 +142,70 @@ class BaseIngestComponent(abc.ABC):
         self.storage_context = storage_context
         self.embed_model = embed_model
         self.transformations = transformations
+        self._listeners: list[Callable[[IngestEvent], None]] = []
+
+    def add_listener(self, listener: Callable[[IngestEvent], None]) -> None:
+        """Register a callback notified of the progress of the ingestion.
+
+        Listeners are called from the ingestion threads, they must be fast
+        and thread-safe.
+        """
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[IngestEvent], None]) -> None:
+        self._listeners.remove(listener)
+
+    def running(self) -> dict[str, RunProgress]:
+        """Progress of the bulk ingestions running in any process, by run ID."""
+        return get_run_progress_store().running()
+
+    def _emit(
+        self,
+        stage: IngestStage,
+        file_names: list[str],
+        count: int = 0,
+        seconds: float = 0.0,
+        error: str | None = None,
+    ) -> None:
+        if stage in _FILE_STATUSES and file_names:
+            FILES_TOTAL.inc(len(file_names), status=_FILE_STATUSES[stage])
+        if not self._listeners or not file_names:
+            return
+        event = IngestEvent(stage, file_names, count, seconds, error)
+        for listener in list(self._listeners):
+            try:
+                listener(event)
+            except Exception:
+                logger.exception("Ingest listener failed on event=%s", event)
 
     @abc.abstractmethod
     def ingest(self, file_name: str, file_data: Path) -> list[Document]:
         pass
 
     @abc.abstractmethod
-    def bulk_ingest(self, files: list[tuple[str, Path]]) -> list[Document]:
-        pass
+    def bulk_ingest(
+        self,
+        files: list[tuple[str, Path]] | StreamedFiles,
+        run_id: str | None = None,
+    ) -> list[Document]:
+        """Ingest many files, resuming the run `run_id` if it was interrupted."""
+
+    @abc.abstractmethod
+    def forget_checkpoint(self, run_id: str, file_names: list[str]) -> None:
+        """Forget files of the run `run_id`, its next attempt ingests them."""
 
     @abc.abstractmethod
     def delete(self, doc_id: str) -> None:
         pass
 
+    @abc.abstractmethod
+    def delete_many(self, doc_ids: Sequence[str]) -> list[str]:
+        pass
+
+    @abc.abstractmethod
+    def delete_files(self, file_names: Sequence[str]) -> list[str]:
+        """Delete all the documents of the given files, return their IDs."""
+
 
 class BaseIngestComponentWithIndex(BaseIngestComponent, abc.ABC):
     def __init__(
@@ -61,13 +216,28 @@ class BaseIngestComponentWithIndex(BaseIngestComponent, abc.ABC):
         *args: Any,
         **kwargs: Any,
     ) -> None:
+        incremental = kwargs.pop("incremental", False)
+        persist_dir = kwargs.pop("persist_dir", local_data_path)
+        checkpoint_path = kwargs.pop("checkpoint_path", ingest_checkpoint_path)
+        embed_settings = kwargs.pop("embed_settings", get_embeddings_settings())
         super().__init__(storage_context, embed_model, transformations, *args, **kwargs)
 
         self.show_progress = True
+        self.incremental = incremental
+        self.persist_dir = persist_dir
         self._index_thread_lock = (
             threading.Lock()
         )  # Thread lock! Not Multiprocessing lock
         self._index = self._initialize_index()
+        self._parser_pool = ParserPool.from_settings(embed_settings)
+        self._checkpoint = IngestCheckpoint(checkpoint_path)
+        self._persister = DeltaPersister(
+            self._index,
+            self._index_thread_lock,
+            persist_dir=self.persist_dir,
+            compaction_interval=embed_settings.persist_compaction_interval,
+            compaction_log_bytes=embed_settings.persist_compaction_log_mb * 1024 * 1024,
+        )
 
     def _initialize_index(self) -> BaseIndex[IndexDict]:
         """Initialize the index from the storage context."""
@@ -91,19 +261,320 @@ class BaseIngestComponentWithIndex(BaseIngestComponent, abc.ABC):
                 embed_model=self.embed_model,
                 transformations=self.transformations,
             )
-            index.storage_context.persist(persist_dir=local_data_path)
+            index.storage_context.persist(persist_dir=self.persist_dir)
         return index
 
-    def _save_index(self) -> None:
-        self._index.storage_context.persist(persist_dir=local_data_path)
+    def _transform_file(self, file_name: str, file_data: Path) -> list[Document]:
+        """Parse a file into documents, in the supervised parser pool.
+
+        :raises FileParseError: if the file could not be parsed
+        """
+        try:
+            documents, seconds = self._parser_pool.parse(file_name, file_data)
+        except Exception as e:
+            # Every file parsed gets a `parse` or a `fail` event
+            self._emit("fail", [file_name], error=str(e))
+            raise
+        STAGE_SECONDS.observe(seconds, stage="parse")
+        if self.incremental and not documents:
+            # Nothing to embed: the previous documents of the file are removed
+            with self._index_thread_lock:
+                self._delete_ref_docs(self._removed_doc_ids(file_name, 0))
+        self._emit("parse", [file_name], len(documents), seconds)
+        return documents
+
+    def _transform_file_or_skip(
+        self, file_name: str, file_data: Path
+    ) -> list[Document]:
+        """Parse a file into documents, a file that can't be parsed is skipped.
+
+        Used by the bulk ingestion, so that one bad file doesn't fail the others.
+        """
+        try:
+            return self._transform_file(file_name, file_data)
+        except FileParseError as e:
+            logger.warning(f"Skipping {file_name}: {e}")
+            return []
+
+    def bulk_ingest(
+        self,
+        files: list[tuple[str, Path]] | StreamedFiles,
+        run_id: str | None = None,
+    ) -> list[Document]:
+        """Ingest many files, resuming the run `run_id` if it was interrupted.
+
+        With a `run_id`, the stage reached by each file is checkpointed, and
+        the files already persisted by a previous attempt of the run are
+        skipped (reported by a `skip` event). Without, all the files are
+        ingested.
+        """
+        if isinstance(files, StreamedFiles):
+            file_names = files.file_names
+        else:
+            file_names = [file_name for file_name, _ in files]
+        remaining_file_names = file_names
+        listeners = []
+        if run_id is not None:
+            if isinstance(files, StreamedFiles):
+                fingerprints = files.fingerprints
+            else:
+                fingerprints = {
+                    file_name: IngestCheckpoint.fingerprint(file_data)
+                    for file_name, file_data in files
+                }
+            remaining_file_names = self._checkpoint.start_fingerprints(
+                run_id, fingerprints
+            )
+            remaining = set(remaining_file_names)
+            self._emit(
+                "skip",
+                [file_name for file_name in file_names if file_name not in remaining],
+            )
+            listeners.append(self._checkpoint.listener(run_id))
+        if isinstance(files, StreamedFiles):
+            remaining_files: Iterable[tuple[str, Path]] = files.stage(
+                set(remaining_file_names)
+            )
+        else:
+            remaining = set(remaining_file_names)
+            remaining_files = [file for file in files if file[0] in remaining]
+        progress_id = run_id or str(uuid.uuid4())
+        progress = ProgressTracker(remaining_file_names, PROGRESS_STAGES)
+        listeners.append(self._progress_listener(progress_id, progress))
+        get_run_progress_store().publish(progress_id, progress)
+        for listener in listeners:
+            self.add_listener(listener)
+        try:
+            documents = self._bulk_ingest(remaining_files)
+        finally:
+            for listener in listeners:
+                self.remove_listener(listener)
+            get_run_progress_store().remove(progress_id)
+        if run_id is not None:
+            self._checkpoint.finish(run_id)
+        logger.info(
+            "Finished bulk ingestion run=%s: %s", progress_id, progress.human_progress()
+        )
+        return documents
+
+    def forget_checkpoint(self, run_id: str, file_names: list[str]) -> None:
+        self._checkpoint.forget(run_id, file_names)
+
+    @staticmethod
+    def _progress_listener(
+        progress_id: str, progress: ProgressTracker
+    ) -> Callable[[IngestEvent], None]:
+        """Ingest listener feeding the progress of a run, publishing and
+        logging it."""
+
+        def on_event(event: IngestEvent) -> None:
+            count_items = 0
+            if event.stage in PROGRESS_STAGES:
+                count_items = progress.advance(event.stage, event.file_names)
+            elif event.stage in ("fail", "skip"):
+                count_items = progress.stop(event.file_names)
+            if count_items:
+                # Events of the other runs are ignored
+                get_run_progress_store().publish(progress_id, progress)
+            if progress.need_report(60):
+                logger.info(
+                    "Bulk ingestion run=%s: %s", progress_id, progress.human_progress()
+                )
+
+        return on_event
+
+    @abc.abstractmethod
+    def _bulk_ingest(self, files: Iterable[tuple[str, Path]]) -> list[Document]:
+        """Ingest the files, pulled from `files` in order as they are parsed."""
+
+    def close(self) -> None:
+        self._parser_pool.close()
+        self._checkpoint.close()
+
+    def _save_index(
+        self,
+        nodes: Sequence[BaseNode] = (),
+        documents: Sequence[Document] = (),
+        deleted_doc_ids: Sequence[str] = (),
+        deleted_node_ids: Sequence[str] = (),
+    ) -> None:
+        """Persist the given changes, the whole index is compacted in background."""
+        self._persister.record(nodes, documents, deleted_doc_ids, deleted_node_ids)
+
+    def _filter_unchanged_documents(
+        self, documents: list[Document]
+    ) -> tuple[list[Document], list[str]]:
+        """Return the documents that need to be (re-)embedded, and the stale ones.
+
+        Only used in incremental mode, where each document gets a stable ID.
+        Documents whose hash matches the one in the docstore are skipped. The
+        IDs of the changed documents, and of the documents of a file that no
+        longer exist (e.g. a PDF that lost some pages), are returned to be
+        deleted by `_insert`: a file whose new version fails to embed keeps
+        its previous one.
+        Must be called while holding the index lock.
+        """
+        if not self.incremental:
+            return documents, []
+
+        IngestionHelper.assign_stable_doc_ids(documents)
+        docstore = self._index.docstore
+        changed_documents = []
+        unchanged_documents = []
+        stale_doc_ids = []
+        for document in documents:
+            stored_hash = docstore.get_document_hash(document.doc_id)
+            if stored_hash == document.hash:
+                unchanged_documents.append(document)
+                continue
+            if stored_hash is not None:
+                logger.debug("Replacing stale nodes of doc_id=%s", document.doc_id)
+                stale_doc_ids.append(document.doc_id)
+            changed_documents.append(document)
+
+        files = collections.Counter(d.metadata.get("file_name") for d in documents)
+        for file_name, count_documents in files.items():
+            stale_doc_ids.extend(self._removed_doc_ids(file_name, count_documents))
+
+        # A file with a changed document goes on to the next stages, only the
+        # files whose documents are all unchanged are done
+        changed_files = set(_file_names(changed_documents))
+        skipped_documents = [
+            document
+            for document in unchanged_documents
+            if document.metadata.get("file_name", "") not in changed_files
+        ]
+        self._emit("skip", _file_names(skipped_documents), len(skipped_documents))
+        logger.info(
+            "Incremental ingest: count=%s of count=%s documents changed",
+            len(changed_documents),
+            len(documents),
+        )
+        return changed_documents, stale_doc_ids
+
+    def _removed_doc_ids(self, file_name: str, count_documents: int) -> list[str]:
+        """IDs of the stored documents of a file past its `count_documents`."""
+        removed_doc_ids = []
+        position = count_documents
+        removed_doc_id = IngestionHelper.stable_doc_id(file_name, position)
+        while self._index.docstore.get_document_hash(removed_doc_id) is not None:
+            logger.debug("Deleting removed doc_id=%s", removed_doc_id)
+            removed_doc_ids.append(removed_doc_id)
+            position += 1
+            removed_doc_id = IngestionHelper.stable_doc_id(file_name, position)
+        return removed_doc_ids
+
+    def _embed(self, documents: list[Document]) -> list[BaseNode]:
+        """Run the transformations (node parsing and embedding) on the documents."""
+        start = time.perf_counter()
+        BUSY_WORKERS.inc(stage="embed")
+        try:
+            nodes = run_transformations(
+                documents,  # type: ignore[arg-type]
+                self.transformations,
+                show_progress=self.show_progress,
+            )
+        finally:
+            BUSY_WORKERS.dec(stage="embed")
+        seconds = time.perf_counter() - start
+        STAGE_SECONDS.observe(seconds, stage="embed")
+        self._emit("embed", _file_names(documents), len(nodes), seconds)
+        return nodes
+
+    def _insert(
+        self,
+        nodes: list[BaseNode],
+        documents: list[Document],
+        stale_doc_ids: Sequence[str] = (),
+    ) -> None:
+        """Replace the stale documents by the nodes in the index, and persist.
+
+        Must be called while holding the index lock.
+        """
+        start = time.perf_counter()
+        self._delete_ref_docs(stale_doc_ids)
+        logger.info("Inserting count=%s nodes in the index", len(nodes))
+        self._index.insert_nodes(nodes, show_progress=True)
+        for document in documents:
+            self._index.docstore.set_document_hash(document.get_doc_id(), document.hash)
+        get_retrieval_cache().bump_generation()
+        inserted = time.perf_counter()
+        STAGE_SECONDS.observe(inserted - start, stage="insert")
+        logger.debug("Persisting the index and nodes")
+        # persist the index and nodes
+        self._save_index(nodes, documents)
+        logger.debug("Persisted the index and nodes")
+        STAGE_SECONDS.observe(time.perf_counter() - inserted, stage="persist")
+        self._emit(
+            "persist", _file_names(documents), len(nodes), time.perf_counter() - start
+        )
+
+    def _delete_ref_docs(self, doc_ids: Sequence[str]) -> list[str]:
+        """Delete documents with one batch per store, and persist once.
+
+        Must be called while holding the index lock.
+        """
+        if not doc_ids:
+            return []
+        delete_ref_doc_vectors(self._index.vector_store, doc_ids)
+        deleted = delete_ref_docs(self._index.docstore, doc_ids)
+        index_struct = self._index.index_struct
+        deleted_node_ids = [
+            node_id
+            for ref_doc_info in deleted.values()
+            for node_id in ref_doc_info.node_ids
+        ]
+        for node_id in deleted_node_ids:
+            index_struct.nodes_dict.pop(node_id, None)
+        self.storage_context.index_store.add_index_struct(index_struct)
+        get_retrieval_cache().bump_generation()
+        self._save_index(
+            deleted_doc_ids=list(deleted), deleted_node_ids=deleted_node_ids
+        )
+        return list(deleted)
 
     def delete(self, doc_id: str) -> None:
+        self.delete_many([doc_id])
+
+    def delete_many(self, doc_ids: Sequence[str]) -> list[str]:
+        """Delete the given documents, return the IDs of the ones that existed."""
         with self._index_thread_lock:
-            # Delete the document from the index
-            self._index.delete_ref_doc(doc_id, delete_from_docstore=True)
+            deleted_doc_ids = self._delete_ref_docs(list(dict.fromkeys(doc_ids)))
+        logger.info(
+            "Deleted count=%s of count=%s documents", len(deleted_doc_ids), len(doc_ids)
+        )
+        return deleted_doc_ids
 
-            # Save the index
-            self._save_index()
+    def delete_files(self, file_names: Sequence[str]) -> list[str]:
+        """Delete all the documents of the given files, return their IDs.
+
+        In incremental mode, the IDs of the documents of a file are derived
+        from its name, with one lookup per document. Otherwise documents have
+        random IDs, and all the documents of the docstore are scanned.
+        """
+        if not self.incremental:
+            file_names_set = set(file_names)
+            ref_docs = self._index.docstore.get_all_ref_doc_info() or {}
+            return self.delete_many(
+                [
+                    doc_id
+                    for doc_id, ref_doc_info in ref_docs.items()
+                    if (ref_doc_info.metadata or {}).get("file_name") in file_names_set
+                ]
+            )
+        with self._index_thread_lock:
+            doc_ids = [
+                doc_id
+                for file_name in file_names
+                for doc_id in self._removed_doc_ids(file_name, 0)
+            ]
+            deleted_doc_ids = self._delete_ref_docs(doc_ids)
+        logger.info(
+            "Deleted count=%s documents of count=%s files",
+            len(deleted_doc_ids),
+            len(file_names),
+        )
+        return deleted_doc_ids
 
 
 class SimpleIngestComponent(BaseIngestComponentWithIndex):
@@ -119,31 +590,28 @@ class SimpleIngestComponent(BaseIngestComponentWithIndex):
 
     def ingest(self, file_name: str, file_data: Path) -> list[Document]:
         logger.info("Ingesting file_name=%s", file_name)
-        documents = IngestionHelper.transform_file_into_documents(file_name, file_data)
+        documents = self._transform_file(file_name, file_data)
         logger.info(
             "Transformed file=%s into count=%s documents", file_name, len(documents)
         )
         logger.debug("Saving the documents in the index and doc store")
         return self._save_docs(documents)
 
-    def bulk_ingest(self, files: list[tuple[str, Path]]) -> list[Document]:
+    def _bulk_ingest(self, files: Iterable[tuple[str, Path]]) -> list[Document]:
         saved_documents = []
         for file_name, file_data in files:
-            documents = IngestionHelper.transform_file_into_documents(
-                file_name, file_data
-            )
+            documents = self._transform_file_or_skip(file_name, file_data)
             saved_documents.extend(self._save_docs(documents))
         return saved_documents
 
     def _save_docs(self, documents: list[Document]) -> list[Document]:
         logger.debug("Transforming count=%s documents into nodes", len(documents))
         with self._index_thread_lock:
-            for document in documents:
-                self._index.insert(document, show_progress=True)
-            logger.debug("Persisting the index and nodes")
-            # persist the index and nodes
-            self._save_index()
-            logger.debug("Persisted the index and nodes")
+            changed_documents, stale_doc_ids = self._filter_unchanged_documents(
+                documents
+            )
+            nodes = self._embed(changed_documents)
+            self._insert(nodes, changed_documents, stale_doc_ids)
         return documents
 
 
@@ -171,53 +639,44 @@ class BatchIngestComponent(BaseIngestComponentWithIndex):
         assert count_workers > 0, "count_workers must be > 0"
         self.count_workers = count_workers
 
-        self._file_to_documents_work_pool = multiprocessing.Pool(
+        # Lightweight threads, waiting for the parser pool
+        self._file_to_documents_work_pool = multiprocessing.pool.ThreadPool(
             processes=self.count_workers
         )
 
     def ingest(self, file_name: str, file_data: Path) -> list[Document]:
         logger.info("Ingesting file_name=%s", file_name)
-        documents = IngestionHelper.transform_file_into_documents(file_name, file_data)
+        documents = self._transform_file(file_name, file_data)
         logger.info(
             "Transformed file=%s into count=%s documents", file_name, len(documents)
         )
         logger.debug("Saving the documents in the index and doc store")
         return self._save_docs(documents)
 
-    def bulk_ingest(self, files: list[tuple[str, Path]]) -> list[Document]:
-        documents = list(
-            itertools.chain.from_iterable(
-                self._file_to_documents_work_pool.starmap(
-                    IngestionHelper.transform_file_into_documents, files
-                )
-            )
+    def _bulk_ingest(self, files: Iterable[tuple[str, Path]]) -> list[Document]:
+        files_documents = _lazy_starmap(
+            self._file_to_documents_work_pool, self._transform_file_or_skip, files
         )
+        documents = list(itertools.chain.from_iterable(files_documents))
         logger.info(
             "Transformed count=%s files into count=%s documents",
-            len(files),
+            len(files_documents),
             len(documents),
         )
         return self._save_docs(documents)
 
     def _save_docs(self, documents: list[Document]) -> list[Document]:
-        logger.debug("Transforming count=%s documents into nodes", len(documents))
-        nodes = run_transformations(
-            documents,  # type: ignore[arg-type]
-            self.transformations,
-            show_progress=self.show_progress,
+        with self._index_thread_lock:
+            changed_documents, stale_doc_ids = self._filter_unchanged_documents(
+                documents
+            )
+        logger.debug(
+            "Transforming count=%s documents into nodes", len(changed_documents)
         )
+        nodes = self._embed(changed_documents)
         # Locking the index to avoid concurrent writes
         with self._index_thread_lock:
-            logger.info("Inserting count=%s nodes in the index", len(nodes))
-            self._index.insert_nodes(nodes, show_progress=True)
-            for document in documents:
-                self._index.docstore.set_document_hash(
-                    document.get_doc_id(), document.hash
-                )
-            logger.debug("Persisting the index and nodes")
-            # persist the index and nodes
-            self._save_index()
-            logger.debug("Persisted the index and nodes")
+            self._insert(nodes, changed_documents, stale_doc_ids)
         return documents
 
 
@@ -253,53 +712,43 @@ class ParallelizedIngestComponent(BaseIngestComponentWithIndex):
             processes=self.count_workers
         )
 
-        self._file_to_documents_work_pool = multiprocessing.Pool(
-            processes=self.count_workers
-        )
-
     def ingest(self, file_name: str, file_data: Path) -> list[Document]:
         logger.info("Ingesting file_name=%s", file_name)
-        # Running in a single (1) process to release the current
-        # thread, and take a dedicated CPU core for computation
-        documents = self._file_to_documents_work_pool.apply(
-            IngestionHelper.transform_file_into_documents, (file_name, file_data)
-        )
+        # Parsed in a worker process of the parser pool, to take
+        # a dedicated CPU core for computation
+        documents = self._transform_file(file_name, file_data)
         logger.info(
             "Transformed file=%s into count=%s documents", file_name, len(documents)
         )
         logger.debug("Saving the documents in the index and doc store")
         return self._save_docs(documents)
 
-    def bulk_ingest(self, files: list[tuple[str, Path]]) -> list[Document]:
+    def _bulk_ingest(self, files: Iterable[tuple[str, Path]]) -> list[Document]:
         # Lightweight threads, used for parallelize the
         # underlying IO calls made in the ingestion
 
         documents = list(
             itertools.chain.from_iterable(
-                self._ingest_work_pool.starmap(self.ingest, files)
+                _lazy_starmap(self._ingest_work_pool, self._ingest_or_skip, files)
             )
         )
         return documents
 
+    def _ingest_or_skip(self, file_name: str, file_data: Path) -> list[Document]:
+        return self._save_docs(self._transform_file_or_skip(file_name, file_data))
+
     def _save_docs(self, documents: list[Document]) -> list[Document]:
-        logger.debug("Transforming count=%s documents into nodes", len(documents))
-        nodes = run_transformations(
-            documents,  # type: ignore[arg-type]
-            self.transformations,
-            show_progress=self.show_progress,
+        with self._index_thread_lock:
+            changed_documents, stale_doc_ids = self._filter_unchanged_documents(
+                documents
+            )
+        logger.debug(
+            "Transforming count=%s documents into nodes", len(changed_documents)
         )
+        nodes = self._embed(changed_documents)
         # Locking the index to avoid concurrent writes
         with self._index_thread_lock:
-            logger.info("Inserting count=%s nodes in the index", len(nodes))
-            self._index.insert_nodes(nodes, show_progress=True)
-            for document in documents:
-                self._index.docstore.set_document_hash(
-                    document.get_doc_id(), document.hash
-                )
-            logger.debug("Persisting the index and nodes")
-            # persist the index and nodes
-            self._save_index()
-            logger.debug("Persisted the index and nodes")
+            self._insert(nodes, changed_documents, stale_doc_ids)
         return documents
 
     def __del__(self) -> None:
@@ -310,27 +759,28 @@ class ParallelizedIngestComponent(BaseIngestComponentWithIndex):
         self._ingest_work_pool.close()
         self._ingest_work_pool.join()
         self._ingest_work_pool.terminate()
-        logging.debug("Closing the file to documents work pool")
-        self._file_to_documents_work_pool.close()
-        self._file_to_documents_work_pool.join()
-        self._file_to_documents_work_pool.terminate()
+        logging.debug("Closing the parser pool")
+        self.close()
 
 
 class PipelineIngestComponent(BaseIngestComponentWithIndex):
     """Pipeline ingestion - keeping the embedding worker pool as busy as possible.
 
-    This class implements a threaded ingestion pipeline, which comprises two threads
-    and two queues. The primary thread is responsible for reading and parsing files
-    into documents. These documents are then placed into a queue, which is
-    distributed to a pool of worker processes for embedding computation. After
-    embedding, the documents are transferred to another queue where they are
-    accumulated until a threshold is reached. Upon reaching this threshold, the
-    accumulated documents are flushed to the document store, index, and vector
-    store.
+    This class implements a threaded ingestion pipeline, which comprises the
+    parser pool, two threads and two queues. The files are parsed into
+    documents by the parser pool, a bounded number of files at a time. These
+    documents are then placed into a queue, which is distributed to a pool of
+    worker threads for embedding computation. After embedding, the documents are
+    transferred to another queue where they are accumulated until a threshold
+    (count of nodes, size in bytes, or time since the first pending node) is
+    reached. Upon reaching this threshold, the accumulated documents are flushed
+    to the document store, index, and vector store.
 
     Exception handling ensures robustness against erroneous files. However, in the
     pipelined design, one error can lead to the discarding of multiple files. Any
     discarded files will be reported.
+
+    `close` stops the threads once all the queued work is flushed.
     """
 
     NODE_FLUSH_COUNT = 5000  # Save the index every # nodes.
@@ -342,19 +792,30 @@ class PipelineIngestComponent(BaseIngestComponentWithIndex):
         transformations: list[TransformComponent],
         count_workers: int,
         *args: Any,
+        doc_queue_size: int = 20,
+        node_queue_size: int = 40,
+        flush_nodes: int = NODE_FLUSH_COUNT,
+        flush_interval: float = 5.0,
+        flush_bytes: int = 64 * 1024 * 1024,
         **kwargs: Any,
     ) -> None:
         super().__init__(storage_context, embed_model, transformations, *args, **kwargs)
-        self.count_workers = count_workers
         assert (
             len(self.transformations) >= 2
         ), "Embeddings must be in the transformations"
         assert count_workers > 0, "count_workers must be > 0"
         self.count_workers = count_workers
+        self.flush_nodes = flush_nodes
+        self.flush_interval = flush_interval
+        self.flush_bytes = flush_bytes
         # We are doing our own multiprocessing
         # To do not collide with the multiprocessing of huggingface, we disable it
         os.environ["TOKENIZERS_PARALLELISM"] = "false"
 
+        # Lightweight threads, waiting for the parser pool
+        self._file_to_documents_work_pool = multiprocessing.pool.ThreadPool(
+            processes=self.count_workers
+        )
         # doc_q stores parsed files as Document chunks.
         # Using a shallow queue causes the filesystem parser to block
         # when it reaches capacity. This ensures it doesn't outpace the
@@ -364,24 +825,39 @@ class PipelineIngestComponent(BaseIngestComponentWithIndex):
         self.doc_semaphore = multiprocessing.Semaphore(
             self.count_workers
         )  # limit the doc queue to # items.
-        self.doc_q: Queue[tuple[str, str | None, list[Document] | None]] = Queue(20)
+        self.doc_q: Queue[tuple[str, str | None, list[Document] | None]] = Queue(
+            doc_queue_size
+        )
         # node_q stores documents parsed into nodes (embeddings).
         # Larger queue size so we don't block the embedding workers during a slow
         # index update.
         self.node_q: Queue[
-            tuple[str, str | None, list[Document] | None, list[BaseNode] | None]
-        ] = Queue(40)
-        threading.Thread(target=self._doc_to_node, daemon=True).start()
-        threading.Thread(target=self._write_nodes, daemon=True).start()
+            tuple[
+                str,
+                str | None,
+                list[Document] | None,
+                list[BaseNode] | None,
+                list[str] | None,
+            ]
+        ] = Queue(node_queue_size)
+        self._closed = False
+        self._threads = [
+            threading.Thread(target=self._doc_to_node, daemon=True),
+            threading.Thread(target=self._write_nodes, daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
 
     def _doc_to_node(self) -> None:
         # Parse documents into nodes
-        with multiprocessing.pool.ThreadPool(processes=self.count_workers) as pool:
+        pool = multiprocessing.pool.ThreadPool(processes=self.count_workers)
+        try:
             while True:
                 try:
                     cmd, file_name, documents = self.doc_q.get(
                         block=True
                     )  # Documents for a file
+                    self._track_queues()
                     if cmd == "process":
                         # Push CPU/GPU embedding work to the worker pool
                         # Acquire semaphore to control access to worker pool
@@ -394,91 +870,188 @@ class PipelineIngestComponent(BaseIngestComponentWithIndex):
                 finally:
                     if cmd != "process":
                         self.doc_q.task_done()  # unblock Q joins
+        finally:
+            # Let the in-flight embeddings complete before stopping the writer
+            pool.close()
+            pool.join()
+            self.node_q.put(("quit", None, None, None, None))
 
     def _doc_to_node_worker(self, file_name: str, documents: list[Document]) -> None:
         # CPU/GPU intensive work in its own process
         try:
-            nodes = run_transformations(
-                documents,  # type: ignore[arg-type]
-                self.transformations,
-                show_progress=self.show_progress,
-            )
-            self.node_q.put(("process", file_name, documents, nodes))
+            with self._index_thread_lock:
+                documents, stale_doc_ids = self._filter_unchanged_documents(documents)
+            nodes = self._embed(documents)
+            self.node_q.put(("process", file_name, documents, nodes, stale_doc_ids))
+            self._track_queues()
+        except Exception as e:
+            logger.exception(f"Embedding file {file_name}")
+            self._emit("fail", [file_name], len(documents), error=repr(e))
         finally:
             self.doc_semaphore.release()
             self.doc_q.task_done()  # unblock Q joins
 
     def _save_docs(
-        self, files: list[str], documents: list[Document], nodes: list[BaseNode]
+        self,
+        files: list[str],
+        documents: list[Document],
+        nodes: list[BaseNode],
+        stale_doc_ids: list[str],
     ) -> None:
         try:
             logger.info(
                 f"Saving {len(files)} files ({len(documents)} documents / {len(nodes)} nodes)"
             )
-            self._index.insert_nodes(nodes)
-            for document in documents:
-                self._index.docstore.set_document_hash(
-                    document.get_doc_id(), document.hash
-                )
-            self._save_index()
-        except Exception:
+            with self._index_thread_lock:
+                self._insert(nodes, documents, stale_doc_ids)
+        except Exception as e:
             # Tell the user so they can investigate these files
             logger.exception(f"Processing files {files}")
+            self._emit("fail", list(files), len(documents), error=repr(e))
         finally:
             # Clearing work, even on exception, maintains a clean state.
             nodes.clear()
             documents.clear()
             files.clear()
+            stale_doc_ids.clear()
+
+    @staticmethod
+    def _node_size(node: BaseNode) -> int:
+        # Approximate size of what is written: the text and a float vector
+        return len(node.get_content().encode()) + 4 * len(node.embedding or ())
 
     def _write_nodes(self) -> None:
         # Save nodes to index.  I/O intensive.
         node_stack: list[BaseNode] = []
         doc_stack: list[Document] = []
         file_stack: list[str] = []
+        stale_stack: list[str] = []
+        stack_bytes = 0
+        flush_deadline = None
         while True:
+            timeout = (
+                max(flush_deadline - time.monotonic(), 0)
+                if flush_deadline is not None
+                else None
+            )
             try:
-                cmd, file_name, documents, nodes = self.node_q.get(block=True)
-                if cmd in ("flush", "quit"):
-                    if file_stack:
-                        self._save_docs(file_stack, doc_stack, node_stack)
-                    if cmd == "quit":
-                        break
-                elif cmd == "process":
+                cmd, file_name, documents, nodes, stale_doc_ids = self.node_q.get(
+                    block=True, timeout=timeout
+                )
+                self._track_queues()
+            except Empty:
+                # Don't keep the first pending nodes waiting longer than the interval
+                self._save_docs(file_stack, doc_stack, node_stack, stale_stack)
+                stack_bytes = 0
+                flush_deadline = None
+                continue
+            try:
+                if cmd == "process":
                     node_stack.extend(nodes)  # type: ignore[arg-type]
                     doc_stack.extend(documents)  # type: ignore[arg-type]
                     file_stack.append(file_name)  # type: ignore[arg-type]
-                    # Constant saving is heavy on I/O - accumulate to a threshold
-                    if len(node_stack) >= self.NODE_FLUSH_COUNT:
-                        self._save_docs(file_stack, doc_stack, node_stack)
+                    stale_stack.extend(stale_doc_ids)  # type: ignore[arg-type]
+                    stack_bytes += sum(map(self._node_size, nodes))  # type: ignore[arg-type]
+                    if flush_deadline is None:
+                        flush_deadline = time.monotonic() + self.flush_interval
+                # Constant saving is heavy on I/O - accumulate to a threshold
+                if file_stack and (
+                    cmd != "process"
+                    or len(node_stack) >= self.flush_nodes
+                    or stack_bytes >= self.flush_bytes
+                ):
+                    self._save_docs(file_stack, doc_stack, node_stack, stale_stack)
+                    stack_bytes = 0
+                    flush_deadline = None
+                if cmd == "quit":
+                    break
             finally:
                 self.node_q.task_done()
 
+    def _track_queues(self) -> None:
+        QUEUE_DEPTH.set(self.doc_q.qsize(), queue="doc")
+        QUEUE_DEPTH.set(self.node_q.qsize(), queue="node")
+
     def _flush(self) -> None:
         self.doc_q.put(("flush", None, None))
         self.doc_q.join()
-        self.node_q.put(("flush", None, None, None))
+        self.node_q.put(("flush", None, None, None, None))
         self.node_q.join()
 
+    def _parse_files(
+        self, files: Iterable[tuple[str, Path]]
+    ) -> Iterator[tuple[str, list[Document]]]:
+        """Parse the files in the parser pool, yielding them in order.
+
+        Only a sliding window of files is parsed ahead, so the parsers don't
+        outpace the embeddings when the doc queue is full. Files that can't be
+        parsed are skipped.
+        """
+        pending: collections.deque[tuple[str, multiprocessing.pool.AsyncResult]] = (
+            collections.deque()
+        )
+        files_iterator = iter(files)
+
+        def submit_next() -> None:
+            for file_name, file_data in itertools.islice(files_iterator, 1):
+                pending.append(
+                    (
+                        file_name,
+                        self._file_to_documents_work_pool.apply_async(
+                            self._transform_file, (file_name, file_data)
+                        ),
+                    )
+                )
+
+        for _ in range(2 * self.count_workers):
+            submit_next()
+        while pending:
+            file_name, result = pending.popleft()
+            submit_next()
+            try:
+                documents = result.get()
+            except FileParseError as e:
+                logger.warning(f"Skipping {file_name}: {e}")
+            else:
+                yield file_name, documents
+
     def ingest(self, file_name: str, file_data: Path) -> list[Document]:
-        documents = IngestionHelper.transform_file_into_documents(file_name, file_data)
+        if self._closed:
+            raise RuntimeError("The ingest pipeline is closed")
+        documents = self._transform_file(file_name, file_data)
         self.doc_q.put(("process", file_name, documents))
+        self._track_queues()
         self._flush()
         return documents
 
-    def bulk_ingest(self, files: list[tuple[str, Path]]) -> list[Document]:
+    def _bulk_ingest(self, files: Iterable[tuple[str, Path]]) -> list[Document]:
+        if self._closed:
+            raise RuntimeError("The ingest pipeline is closed")
         docs = []
-        for file_name, file_data in eta(files):
-            try:
-                documents = IngestionHelper.transform_file_into_documents(
-                    file_name, file_data
-                )
-                self.doc_q.put(("process", file_name, documents))
-                docs.extend(documents)
-            except Exception:
-                logger.exception(f"Skipping {file_data.name}")
+        for file_name, documents in self._parse_files(files):
+            self.doc_q.put(("process", file_name, documents))
+            self._track_queues()
+            docs.extend(documents)
         self._flush()
         return docs
 
+    def close(self) -> None:
+        """Flush the queued work, then stop the threads and the parser pool."""
+        if self._closed:
+            return
+        self._closed = True
+        self.doc_q.put(("quit", None, None))
+        for thread in self._threads:
+            thread.join()
+        self._file_to_documents_work_pool.close()
+        self._file_to_documents_work_pool.join()
+        super().close()
+
+    def __del__(self) -> None:
+        # Using root logger to avoid the logger to be deleted before the pool
+        logging.debug("Closing the ingest pipeline")
+        self.close()
+
 
 def get_ingestion_component(
     storage_context: StorageContext,
@@ -494,6 +1067,8 @@ def get_ingestion_component(
             embed_model=embed_model,
             transformations=transformations,
             count_workers=embed_settings.count_workers,
+            incremental=embed_settings.incremental_ingest,
+            embed_settings=embed_settings,
         )
     elif ingest_mode == "parallel":
         return ParallelizedIngestComponent(
@@ -501,6 +1076,8 @@ def get_ingestion_component(
             embed_model=embed_model,
             transformations=transformations,
             count_workers=embed_settings.count_workers,
+            incremental=embed_settings.incremental_ingest,
+            embed_settings=embed_settings,
         )
     elif ingest_mode == "pipeline":
         return PipelineIngestComponent(
@@ -508,10 +1085,19 @@ def get_ingestion_component(
             embed_model=embed_model,
             transformations=transformations,
             count_workers=embed_settings.count_workers,
+            doc_queue_size=embed_settings.pipeline_doc_queue_size,
+            node_queue_size=embed_settings.pipeline_node_queue_size,
+            flush_nodes=embed_settings.pipeline_flush_nodes,
+            flush_interval=embed_settings.pipeline_flush_interval,
+            flush_bytes=embed_settings.pipeline_flush_mb * 1024 * 1024,
+            incremental=embed_settings.incremental_ingest,
+            embed_settings=embed_settings,
         )
     else:
         return SimpleIngestComponent(
             storage_context=storage_context,
             embed_model=embed_model,
             transformations=transformations,
+            incremental=embed_settings.incremental_ingest,
+            embed_settings=embed_settings,
         )
@@ -1,64 +1,123 @@
+import importlib
+import itertools
+import threading
+import uuid
+from collections.abc import Iterator, Mapping
 from pathlib import Path
 
 import structlog
 from llama_index.core.readers import StringIterableReader
 from llama_index.core.readers.base import BaseReader
-from llama_index.core.readers.json import JSONReader
 from llama_index.core.schema import Document
 
+from app.config.settings import get_embeddings_settings
+
 logger = structlog.stdlib.get_logger(__name__)
 
 
 # Inspired by the `llama_index.core.readers.file.base` module
-def _try_loading_included_file_formats() -> dict[str, type[BaseReader]]:
-    try:
-        from llama_index.readers.file.docs import (  # type: ignore
-            DocxReader,
-            HWPReader,
-            PDFReader,
+# Readers are given as "module:class", to be imported the first time they are used
+DEFAULT_FILE_READERS: dict[str, str] = {
+    ".hwp": "llama_index.readers.file.docs:HWPReader",
+    ".pdf": "llama_index.readers.file.docs:PDFReader",
+    ".docx": "llama_index.readers.file.docs:DocxReader",
+    ".pptx": "llama_index.readers.file.slides:PptxReader",
+    ".ppt": "llama_index.readers.file.slides:PptxReader",
+    ".pptm": "llama_index.readers.file.slides:PptxReader",
+    ".jpg": "llama_index.readers.file.image:ImageReader",
+    ".png": "llama_index.readers.file.image:ImageReader",
+    ".jpeg": "llama_index.readers.file.image:ImageReader",
+    ".mp3": "llama_index.readers.file.video_audio:VideoAudioReader",
+    ".mp4": "llama_index.readers.file.video_audio:VideoAudioReader",
+    ".csv": "llama_index.readers.file.tabular:PandasCSVReader",
+    ".epub": "llama_index.readers.file.epub:EpubReader",
+    ".md": "llama_index.readers.file.markdown:MarkdownReader",
+    ".mbox": "llama_index.readers.file.mbox:MboxReader",
+    ".ipynb": "llama_index.readers.file.ipynb:IPYNBReader",
+    # Patching the default file readers to support other file types
+    ".json": "llama_index.core.readers.json:JSONReader",
+}
+
+
+class LazyReaderRegistry(Mapping[str, type[BaseReader]]):
+    """Mapping of file extensions to reader classes, imported on first use.
+
+    Importing every reader at startup is slow and memory hungry (the video and
+    audio reader alone pulls whisper and torch), and most deployments only
+    ingest a few formats. When `allowed_extensions` is given, only the files
+    with these extensions can be ingested. Extensions are case-insensitive.
+    """
+
+    def __init__(
+        self,
+        readers: dict[str, str],
+        allowed_extensions: list[str] | None = None,
+    ) -> None:
+        self._readers = {
+            extension.lower(): reader for extension, reader in readers.items()
+        }
+        self.allowed_extensions = (
+            {extension.lower() for extension in allowed_extensions}
+            if allowed_extensions is not None
+            else None
         )
-        from llama_index.readers.file.epub import EpubReader  # type: ignore
-        from llama_index.readers.file.image import ImageReader  # type: ignore
-        from llama_index.readers.file.ipynb import IPYNBReader  # type: ignore
-        from llama_index.readers.file.markdown import MarkdownReader  # type: ignore
-        from llama_index.readers.file.mbox import MboxReader  # type: ignore
-        from llama_index.readers.file.slides import PptxReader  # type: ignore
-        from llama_index.readers.file.tabular import PandasCSVReader  # type: ignore
-        from llama_index.readers.file.video_audio import (  # type: ignore
-            VideoAudioReader,
+        self._loaded: dict[str, type[BaseReader]] = {}
+        self._lock = threading.Lock()
+
+    def is_allowed(self, extension: str) -> bool:
+        return (
+            self.allowed_extensions is None
+            or extension.lower() in self.allowed_extensions
         )
-    except ImportError as e:
-        raise ImportError("`llama-index-readers-file` package not found") from e
-
-    default_file_reader_cls: dict[str, type[BaseReader]] = {
-        ".hwp": HWPReader,
-        ".pdf": PDFReader,
-        ".docx": DocxReader,
-        ".pptx": PptxReader,
-        ".ppt": PptxReader,
-        ".pptm": PptxReader,
-        ".jpg": ImageReader,
-        ".png": ImageReader,
-        ".jpeg": ImageReader,
-        ".mp3": VideoAudioReader,
-        ".mp4": VideoAudioReader,
-        ".csv": PandasCSVReader,
-        ".epub": EpubReader,
-        ".md": MarkdownReader,
-        ".mbox": MboxReader,
-        ".ipynb": IPYNBReader,
-    }
-    return default_file_reader_cls
-
-
-# Patching the default file reader to support other file types
-FILE_READER_CLS = _try_loading_included_file_formats()
-FILE_READER_CLS.update(
-    {
-        ".json": JSONReader,
-    }
+
+    def register(self, extension: str, reader: str) -> None:
+        """Register the reader of an extension, given as "module:class"."""
+        extension = extension.lower()
+        with self._lock:
+            self._readers[extension] = reader
+            self._loaded.pop(extension, None)
+
+    def __getitem__(self, extension: str) -> type[BaseReader]:
+        extension = extension.lower()
+        if extension not in self._readers or not self.is_allowed(extension):
+            raise KeyError(extension)
+        with self._lock:
+            if extension not in self._loaded:
+                self._loaded[extension] = self._import_reader(self._readers[extension])
+            return self._loaded[extension]
+
+    @staticmethod
+    def _import_reader(reader: str) -> type[BaseReader]:
+        module_name, class_name = reader.split(":")
+        logger.debug("Importing reader=%s", reader)
+        try:
+            module = importlib.import_module(module_name)
+        except ImportError as e:
+            raise ImportError(
+                f"Reader {reader} not found, is `llama-index-readers-file` installed?"
+            ) from e
+        return getattr(module, class_name)
+
+    def __iter__(self) -> Iterator[str]:
+        return (extension for extension in self._readers if self.is_allowed(extension))
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def preload(self) -> None:
+        """Import all the allowed readers now, e.g. to warm up a worker."""
+        for extension in self:
+            self[extension]
+
+
+FILE_READER_CLS = LazyReaderRegistry(
+    DEFAULT_FILE_READERS,
+    allowed_extensions=get_embeddings_settings().ingest_file_extensions,
 )
 
+# Formats that can be read by range of pages, to parse a big file on many cores
+PAGED_FILE_EXTENSIONS = {".pdf"}
+
 
 class IngestionHelper:
     """Helper class to transform a file into a list of documents.
@@ -77,10 +136,48 @@ class IngestionHelper:
         IngestionHelper._exclude_metadata(documents)
         return documents
 
+    @staticmethod
+    def count_pages(file_name: str, file_data: Path) -> int:
+        """Number of pages of a file of one of the `PAGED_FILE_EXTENSIONS`."""
+        import pypdf
+
+        logger.debug("Counting the pages of file_name=%s", file_name)
+        return len(pypdf.PdfReader(file_data).pages)
+
+    @staticmethod
+    def transform_file_pages_into_documents(
+        file_name: str, file_data: Path, start: int, stop: int
+    ) -> list[Document]:
+        """Same as `transform_file_into_documents`, for the pages [start, stop).
+
+        Documents are the same as the ones of the `PDFReader`: one per page,
+        with the `page_label` metadata.
+        """
+        import pypdf
+
+        logger.debug(
+            "Transforming pages %s to %s of file_name=%s into documents",
+            start,
+            stop,
+            file_name,
+        )
+        pdf = pypdf.PdfReader(file_data)
+        documents = [
+            Document(
+                text=pdf.pages[page].extract_text(),
+                metadata={"page_label": pdf.page_labels[page], "file_name": file_name},
+            )
+            for page in range(start, stop)
+        ]
+        IngestionHelper._exclude_metadata(documents)
+        return documents
+
     @staticmethod
     def _load_file_to_documents(file_name: str, file_data: Path) -> list[Document]:
         logger.debug("Transforming file_name=%s into documents", file_name)
-        extension = Path(file_name).suffix
+        extension = Path(file_name).suffix.lower()
+        if not FILE_READER_CLS.is_allowed(extension):
+            raise ValueError(f"File extension {extension} is not allowed")
         reader_cls = FILE_READER_CLS.get(extension)
         if reader_cls is None:
             logger.debug(
@@ -94,6 +191,25 @@ class IngestionHelper:
         logger.debug("Specific reader found for extension=%s", extension)
         return reader_cls().load_data(file_data)
 
+    @staticmethod
+    def stable_doc_id(file_name: str, position: int) -> str:
+        """Deterministic document ID for the `position`-th document of a file."""
+        return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{file_name}#{position}"))
+
+    @staticmethod
+    def assign_stable_doc_ids(documents: list[Document]) -> None:
+        """Replace the random document IDs by IDs derived from the file name.
+
+        Documents are expected to be grouped by file, in the order the reader
+        produced them (one document per page for paged formats).
+        """
+        for file_name, file_documents in itertools.groupby(
+            documents, key=lambda d: d.metadata.get("file_name")
+        ):
+            for position, document in enumerate(file_documents):
+                document.id_ = IngestionHelper.stable_doc_id(file_name, position)
+                document.metadata["doc_id"] = document.doc_id
+
     @staticmethod
     def _exclude_metadata(documents: list[Document]) -> None:
         logger.debug("Excluding metadata from count=%s documents", len(documents))
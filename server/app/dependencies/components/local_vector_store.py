@@ -0,0 +1,592 @@
+import contextlib
+import json
+import os
+import sqlite3
+import threading
+from collections.abc import Iterator, Sequence
+from pathlib import Path
+from typing import Any, Literal
+
+import numpy as np
+import structlog
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.schema import BaseNode
+from llama_index.core.vector_stores.types import (
+    BasePydanticVectorStore,
+    FilterCondition,
+    FilterOperator,
+    MetadataFilters,
+    VectorStoreQuery,
+    VectorStoreQueryMode,
+    VectorStoreQueryResult,
+)
+from llama_index.core.vector_stores.utils import (
+    metadata_dict_to_node,
+    node_to_metadata_dict,
+)
+
+try:
+    import fcntl
+except ImportError:  # Windows, which runs a single API process
+    fcntl = None  # type: ignore[assignment]
+
+logger = structlog.stdlib.get_logger(__name__)
+
+VectorDType = Literal["float32", "float16"]
+
+# Rows scored at once, bounds the memory used by a search
+_SEARCH_CHUNK_ROWS = 65536
+# Max count of SQLite variables in a statement
+_SQLITE_BATCH = 500
+
+
+def _batched(
+    items: Sequence[Any], size: int = _SQLITE_BATCH
+) -> Iterator[Sequence[Any]]:
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+class _IVFIndex:
+    """Inverted file index: the vectors are clustered with k-means, and a
+    query only scores the vectors of the `nprobe` clusters nearest to it."""
+
+    def __init__(self, centroids: np.ndarray, assignments: np.ndarray) -> None:
+        self.centroids = centroids
+        self.assignments = assignments
+        self.built_rows = len(assignments)
+
+    @classmethod
+    def build(
+        cls, matrix: np.ndarray, alive: np.ndarray, iterations: int = 10
+    ) -> "_IVFIndex":
+        alive_rows = np.flatnonzero(alive)
+        count_lists = max(1, int(np.sqrt(len(alive_rows))))
+        rng = np.random.default_rng(0)
+        sample_rows = np.sort(
+            rng.choice(
+                alive_rows, min(len(alive_rows), 64 * count_lists), replace=False
+            )
+        )
+        sample = np.asarray(matrix[sample_rows], dtype=np.float32)
+        centroids = sample[rng.choice(len(sample), count_lists, replace=False)]
+        # Spherical k-means, the vectors are normalized
+        for _ in range(iterations):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            empty = ~np.bincount(labels, minlength=count_lists).astype(bool)
+            sums[empty] = centroids[empty]
+            centroids = _normalize(sums)
+        index = cls(centroids, np.empty(0, dtype=np.int32))
+        for start in range(0, len(matrix), _SEARCH_CHUNK_ROWS):
+            index.add(np.asarray(matrix[start : start + _SEARCH_CHUNK_ROWS]))
+        index.built_rows = len(matrix)
+        return index
+
+    def add(self, vectors: np.ndarray) -> None:
+        labels = np.argmax(np.asarray(vectors, np.float32) @ self.centroids.T, axis=1)
+        self.assignments = np.concatenate([self.assignments, labels.astype(np.int32)])
+
+    def keep(self, rows: np.ndarray) -> None:
+        """Keep the assignments of the given rows, renumbered from 0."""
+        self.assignments = self.assignments[rows]
+
+    def candidates(self, query: np.ndarray, nprobe: int) -> np.ndarray:
+        nearest = np.argsort(self.centroids @ query)[::-1][:nprobe]
+        return np.flatnonzero(np.isin(self.assignments, nearest))
+
+
+class LocalVectorStore(BasePydanticVectorStore):
+    """In-process vector store, for single-node deployments without Milvus.
+
+    The vectors are normalized (similarities are cosine similarities, like
+    the inner product of Milvus on normalized embeddings) and appended to a
+    matrix file, memory-mapped to be searched with NumPy: the matrix is read
+    through the OS page cache instead of being loaded at startup. The nodes
+    and their document IDs are stored in SQLite, as is the deletion of a
+    node, so filtering by document ID is an indexed query.
+
+    An append writes and fsyncs the vectors before committing their rows: a
+    crash leaves at worst uncommitted vectors at the end of the file, which
+    are truncated when the store is opened. A deletion only marks the rows;
+    once half of the rows are deleted, the live vectors are copied to a new
+    generation of the matrix file, made current by the same commit that
+    renumbers the rows.
+
+    The store can be shared by the processes of the API: the changes are
+    made under an exclusive lock on the `store.lock` file, and bump a version
+    in SQLite. Before a change or a search, a process whose version is behind
+    reloads the rows (and reopens the matrix file after a compaction).
+
+    Search is exhaustive by default. Above `ivf_threshold` vectors, an IVF
+    index (k-means clusters, rebuilt when the store doubles) restricts the
+    search to the `ivf_nprobe` nearest clusters, trading some recall for
+    speed.
+    """
+
+    stores_text: bool = True
+    flat_metadata: bool = False
+
+    path: str
+    dtype: VectorDType = "float32"
+    ivf_threshold: int = 0
+    ivf_nprobe: int = 8
+
+    _lock: threading.Lock = PrivateAttr()
+    _lock_path: Path = PrivateAttr()
+    _connection: sqlite3.Connection = PrivateAttr()
+    _version: int = PrivateAttr()
+    _generation: int = PrivateAttr()
+    _dim: int | None = PrivateAttr()
+    _file: Any = PrivateAttr()
+    _matrix: np.ndarray | None = PrivateAttr()
+    _alive: np.ndarray = PrivateAttr()
+    _ivf: _IVFIndex | None = PrivateAttr()
+
+    def __init__(self, path: Path, **kwargs: Any) -> None:
+        super().__init__(path=str(path), **kwargs)
+        path.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._lock_path = path / "store.lock"
+        self._connection = sqlite3.connect(
+            str(path / "store.sqlite3"),
+            timeout=30,
+            check_same_thread=False,
+            isolation_level=None,
+        )
+        # Truncating the uncommitted vectors is only safe if no other process
+        # is appending
+        with self._exclusive():
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS meta "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+            )
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS rows (row INTEGER PRIMARY KEY, "
+                "node_id TEXT NOT NULL, doc_id TEXT, metadata TEXT NOT NULL, "
+                "deleted INTEGER NOT NULL DEFAULT 0)"
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS rows_doc_id ON rows (doc_id)"
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS rows_node_id ON rows (node_id)"
+            )
+            meta = dict(self._connection.execute("SELECT key, value FROM meta"))
+            if meta.get("dtype", self.dtype) != self.dtype:
+                raise ValueError(
+                    f"The vector store at {path} stores {meta['dtype']} vectors"
+                )
+            self._version = int(meta.get("version", 0))
+            self._generation = int(meta.get("generation", 0))
+            self._dim = int(meta["dim"]) if "dim" in meta else None
+            self._open_matrix()
+        self._ivf = None
+        if self.ivf_threshold and len(self._alive) >= self.ivf_threshold:
+            self._ivf = _IVFIndex.build(self._matrix, self._alive)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "LocalVectorStore"
+
+    @property
+    def client(self) -> "LocalVectorStore":
+        return self
+
+    @property
+    def _row_bytes(self) -> int:
+        return (self._dim or 0) * np.dtype(self.dtype).itemsize
+
+    def _matrix_path(self, generation: int) -> Path:
+        return Path(self.path) / f"vectors.{generation}.{self.dtype}"
+
+    @contextlib.contextmanager
+    def _exclusive(self) -> Iterator[None]:
+        """Hold the lock of the store against the other processes."""
+        # Closing the file releases the lock
+        with self._lock_path.open("a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    def _load_alive(self) -> np.ndarray:
+        rows = self._connection.execute(
+            "SELECT row, deleted FROM rows ORDER BY row"
+        ).fetchall()
+        assert not rows or rows[-1][0] == len(rows) - 1, "rows must be contiguous"
+        return np.array([not deleted for _, deleted in rows], dtype=bool)
+
+    def _open_matrix(self) -> None:
+        """Open the current matrix file, dropping what wasn't committed."""
+        for stale_file in Path(self.path).glob("vectors.*"):
+            if stale_file != self._matrix_path(self._generation):
+                # Left by an interrupted compaction
+                stale_file.unlink()
+        self._alive = self._load_alive()
+        count = len(self._alive)
+
+        matrix_path = self._matrix_path(self._generation)
+        matrix_path.touch()
+        self._file = matrix_path.open("r+b")
+        committed_bytes = count * self._row_bytes
+        file_bytes = os.fstat(self._file.fileno()).st_size
+        if file_bytes < committed_bytes:
+            raise RuntimeError(f"The vector file {matrix_path} is truncated")
+        if file_bytes > committed_bytes:
+            logger.warning(
+                "Dropping count=%s uncommitted vectors",
+                (file_bytes - committed_bytes) // max(self._row_bytes, 1),
+            )
+            self._file.truncate(committed_bytes)
+        self._map(count)
+
+    def _map(self, count: int) -> None:
+        if count == 0:
+            self._matrix = None
+            return
+        self._matrix = np.memmap(
+            self._file, dtype=self.dtype, mode="r", shape=(count, self._dim)
+        )
+
+    def _refresh(self) -> None:
+        """Load the changes committed by the other processes, if any."""
+        # In one read transaction, for the rows to match the generation
+        self._connection.execute("BEGIN")
+        try:
+            meta = dict(self._connection.execute("SELECT key, value FROM meta"))
+            version = int(meta.get("version", 0))
+            if version == self._version:
+                return
+            generation = int(meta.get("generation", 0))
+            alive = self._load_alive()
+        finally:
+            self._connection.execute("COMMIT")
+        logger.debug("Reloading the vector store changed by another process")
+        self._version = version
+        self._dim = int(meta["dim"]) if "dim" in meta else None
+        count = len(self._alive)
+        if generation != self._generation:
+            # Compacted: the rows were renumbered, the old file is deleted
+            self._file.close()
+            self._generation = generation
+            self._file = self._matrix_path(generation).open("r+b")
+            self._ivf = None
+            count = 0
+        self._alive = alive
+        self._map(len(alive))
+        if len(alive) > count:
+            self._update_ivf(self._matrix[count:])
+
+    def _bump_version(self) -> None:
+        # In the transaction of a change, `_version` is set after the commit
+        self._connection.execute(
+            "INSERT OR REPLACE INTO meta VALUES ('version', ?)",
+            (str(self._version + 1),),
+        )
+
+    def add(self, nodes: list[BaseNode], **add_kwargs: Any) -> list[str]:
+        if not nodes:
+            return []
+        vectors = _normalize(
+            np.asarray([node.get_embedding() for node in nodes], dtype=np.float32)
+        )
+        with self._lock, self._exclusive():
+            self._refresh()
+            if self._dim is None:
+                self._dim = vectors.shape[1]
+                self._connection.execute(
+                    "INSERT INTO meta VALUES ('dim', ?), ('dtype', ?)",
+                    (str(self._dim), self.dtype),
+                )
+            elif vectors.shape[1] != self._dim:
+                raise ValueError(
+                    f"Vectors of dimension {vectors.shape[1]}, the store has {self._dim}"
+                )
+            count = len(self._alive)
+            self._file.seek(count * self._row_bytes)
+            self._file.write(vectors.astype(self.dtype).tobytes())
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+            node_ids = [node.node_id for node in nodes]
+            # Added again: the previous vectors of the nodes are replaced
+            replaced_rows = self._select_rows("node_id", node_ids)
+            self._connection.execute("BEGIN")
+            try:
+                self._mark_deleted(replaced_rows)
+                self._connection.executemany(
+                    "INSERT INTO rows (row, node_id, doc_id, metadata) "
+                    "VALUES (?, ?, ?, ?)",
+                    [
+                        (
+                            count + i,
+                            node.node_id,
+                            node.ref_doc_id,
+                            self._serialize(node),
+                        )
+                        for i, node in enumerate(nodes)
+                    ],
+                )
+                self._bump_version()
+                self._connection.execute("COMMIT")
+            except Exception:
+                self._connection.execute("ROLLBACK")
+                raise
+            self._version += 1
+            self._alive = np.concatenate([self._alive, np.ones(len(nodes), dtype=bool)])
+            self._alive[replaced_rows] = False
+            self._map(len(self._alive))
+            self._update_ivf(vectors)
+        return node_ids
+
+    def _serialize(self, node: BaseNode) -> str:
+        # Without its embedding, which pydantic serializes value by value
+        node = node.copy(update={"embedding": None})
+        return json.dumps(
+            node_to_metadata_dict(
+                node, remove_text=False, flat_metadata=self.flat_metadata
+            )
+        )
+
+    def _select_rows(self, column: str, values: Sequence[str]) -> np.ndarray:
+        """Rows not deleted whose `column` is one of the values."""
+        rows: list[int] = []
+        for batch in _batched(list(values)):
+            placeholders = ",".join("?" * len(batch))
+            rows.extend(
+                row
+                for (row,) in self._connection.execute(
+                    f"SELECT row FROM rows WHERE {column} IN ({placeholders}) "
+                    "AND deleted = 0",
+                    batch,
+                )
+            )
+        return np.array(sorted(rows), dtype=np.int64)
+
+    def _mark_deleted(self, rows: np.ndarray) -> None:
+        self._connection.executemany(
+            "UPDATE rows SET deleted = 1 WHERE row = ?", [(int(r),) for r in rows]
+        )
+
+    def _update_ivf(self, vectors: np.ndarray) -> None:
+        count = len(self._alive)
+        if not self.ivf_threshold or count < self.ivf_threshold:
+            self._ivf = None
+        elif self._ivf is None or count >= 2 * self._ivf.built_rows:
+            logger.info("Building the IVF index of count=%s vectors", count)
+            self._ivf = _IVFIndex.build(self._matrix, self._alive)
+        else:
+            self._ivf.add(vectors)
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        self.delete_many([ref_doc_id])
+
+    def delete_many(self, ref_doc_ids: Sequence[str]) -> None:
+        """Delete the vectors of many documents in one transaction."""
+        with self._lock, self._exclusive():
+            self._refresh()
+            rows = self._select_rows("doc_id", ref_doc_ids)
+            if not len(rows):
+                return
+            self._connection.execute("BEGIN")
+            try:
+                self._mark_deleted(rows)
+                self._bump_version()
+                self._connection.execute("COMMIT")
+            except Exception:
+                self._connection.execute("ROLLBACK")
+                raise
+            self._version += 1
+            self._alive[rows] = False
+            if np.count_nonzero(~self._alive) * 2 > len(self._alive):
+                self._compact()
+
+    def _compact(self) -> None:
+        """Copy the live vectors to a new matrix file, renumbering the rows."""
+        alive_rows = np.flatnonzero(self._alive)
+        logger.info(
+            "Compacting the vector store, keeping count=%s of count=%s vectors",
+            len(alive_rows),
+            len(self._alive),
+        )
+        generation = self._generation + 1
+        with self._matrix_path(generation).open("wb") as new_file:
+            for batch in np.array_split(
+                alive_rows, max(1, len(alive_rows) // _SEARCH_CHUNK_ROWS)
+            ):
+                if self._matrix is not None and len(batch):
+                    new_file.write(np.asarray(self._matrix[batch]).tobytes())
+            new_file.flush()
+            os.fsync(new_file.fileno())
+        self._connection.execute("BEGIN")
+        try:
+            self._connection.execute("DELETE FROM rows WHERE deleted = 1")
+            # In increasing order, the new row number is always free
+            self._connection.executemany(
+                "UPDATE rows SET row = ? WHERE row = ?",
+                [
+                    (new_row, int(row))
+                    for new_row, row in enumerate(alive_rows)
+                    if new_row != row
+                ],
+            )
+            self._connection.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('generation', ?)",
+                (str(generation),),
+            )
+            self._bump_version()
+            self._connection.execute("COMMIT")
+        except Exception:
+            self._connection.execute("ROLLBACK")
+            self._matrix_path(generation).unlink()
+            raise
+        self._version += 1
+        self._file.close()
+        self._matrix_path(self._generation).unlink()
+        self._generation = generation
+        self._file = self._matrix_path(generation).open("r+b")
+        self._alive = np.ones(len(alive_rows), dtype=bool)
+        self._map(len(alive_rows))
+        if self._ivf is not None:
+            self._ivf.keep(alive_rows)
+
+    def _filtered_doc_ids(self, query: VectorStoreQuery) -> set[str] | None:
+        """Document IDs the query is restricted to, None if not restricted."""
+        doc_ids = set(query.doc_ids) if query.doc_ids else None
+        filters: MetadataFilters | None = query.filters
+        if filters is None or not filters.filters:
+            return doc_ids
+        filter_doc_ids = []
+        for metadata_filter in filters.filters:
+            if (
+                not hasattr(metadata_filter, "key")
+                or metadata_filter.key not in ("doc_id", "ref_doc_id")
+                or metadata_filter.operator
+                not in (FilterOperator.EQ, FilterOperator.IN)
+            ):
+                raise NotImplementedError(
+                    "The local vector store only filters on the document ID"
+                )
+            value = metadata_filter.value
+            filter_doc_ids.append(set(value) if isinstance(value, list) else {value})
+        if filters.condition == FilterCondition.AND:
+            matched = set.intersection(*filter_doc_ids)
+        else:
+            matched = set.union(*filter_doc_ids)
+        return matched if doc_ids is None else doc_ids & matched
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        if query.mode != VectorStoreQueryMode.DEFAULT:
+            raise NotImplementedError(f"Query mode {query.mode} is not supported")
+        if query.query_embedding is None:
+            raise ValueError("The local vector store needs a query embedding")
+        query_vector = _normalize(np.asarray(query.query_embedding, dtype=np.float32))
+        doc_ids = self._filtered_doc_ids(query)
+        while True:
+            with self._lock:
+                self._refresh()
+                generation, matrix, ivf = self._generation, self._matrix, self._ivf
+                alive = self._alive.copy()
+                if matrix is None or (doc_ids is not None and not doc_ids):
+                    return VectorStoreQueryResult(nodes=[], similarities=[], ids=[])
+                candidates = None
+                if doc_ids is not None:
+                    candidates = self._select_rows("doc_id", sorted(doc_ids))
+                if query.node_ids:
+                    node_rows = self._select_rows("node_id", query.node_ids)
+                    candidates = (
+                        node_rows
+                        if candidates is None
+                        else np.intersect1d(candidates, node_rows)
+                    )
+            if candidates is None and ivf is not None:
+                candidates = ivf.candidates(query_vector, self.ivf_nprobe)
+            if candidates is not None:
+                # Vectors added since the snapshot, by this or another process
+                candidates = candidates[candidates < len(matrix)]
+
+            rows, scores = self._search(
+                matrix, alive, query_vector, query.similarity_top_k, candidates
+            )
+            result = self._result(generation, rows, scores)
+            if result is not None:
+                return result
+            # The rows were renumbered by a compaction during the search
+
+    @staticmethod
+    def _search(
+        matrix: np.ndarray,
+        alive: np.ndarray,
+        query_vector: np.ndarray,
+        top_k: int,
+        candidates: np.ndarray | None,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Top `top_k` rows by similarity, among the candidates if given."""
+        best_rows = np.empty(0, dtype=np.int64)
+        best_scores = np.empty(0, dtype=np.float32)
+        count = len(matrix) if candidates is None else len(candidates)
+        for start in range(0, count, _SEARCH_CHUNK_ROWS):
+            if candidates is None:
+                rows = np.arange(start, min(start + _SEARCH_CHUNK_ROWS, count))
+                block = matrix[start : start + _SEARCH_CHUNK_ROWS]
+            else:
+                rows = candidates[start : start + _SEARCH_CHUNK_ROWS]
+                block = matrix[rows]
+            scores = np.asarray(block, dtype=np.float32) @ query_vector
+            scores[~alive[rows]] = -np.inf
+            if len(scores) > top_k:
+                top = np.argpartition(scores, -top_k)[-top_k:]
+                rows, scores = rows[top], scores[top]
+            best_rows = np.concatenate([best_rows, rows])
+            best_scores = np.concatenate([best_scores, scores])
+        keep = np.isfinite(best_scores)
+        best_rows, best_scores = best_rows[keep], best_scores[keep]
+        order = np.argsort(best_scores)[::-1][:top_k]
+        return best_rows[order], best_scores[order]
+
+    def _result(
+        self, generation: int, rows: np.ndarray, scores: np.ndarray
+    ) -> VectorStoreQueryResult | None:
+        """Nodes of the rows found, None if the rows were renumbered since."""
+        with self._lock:
+            if generation != self._generation:
+                return None
+            placeholders = ",".join("?" * len(rows))
+            # In one read transaction, to see a compaction of another process
+            self._connection.execute("BEGIN")
+            try:
+                (stored_generation,) = self._connection.execute(
+                    "SELECT value FROM meta WHERE key = 'generation'"
+                ).fetchone() or ("0",)
+                if int(stored_generation) != generation:
+                    return None
+                metadata_by_row = {
+                    row: (node_id, metadata)
+                    for row, node_id, metadata in self._connection.execute(
+                        "SELECT row, node_id, metadata FROM rows "
+                        f"WHERE row IN ({placeholders})",
+                        [int(row) for row in rows],
+                    )
+                }
+            finally:
+                self._connection.execute("COMMIT")
+        nodes, similarities, ids = [], [], []
+        for row, score in zip(rows, scores):
+            node_id, metadata = metadata_by_row[int(row)]
+            nodes.append(metadata_dict_to_node(json.loads(metadata)))
+            similarities.append(float(score))
+            ids.append(node_id)
+        return VectorStoreQueryResult(nodes=nodes, similarities=similarities, ids=ids)
+
+    def close(self) -> None:
+        with self._lock:
+            self._matrix = None
+            self._file.close()
+            self._connection.close()
@@ -1,25 +1,284 @@
+import dataclasses
+import json
+import threading
+from collections.abc import Sequence
 from functools import lru_cache
 
 import structlog.stdlib
+from llama_index.core.data_structs.data_structs import IndexDict, IndexStruct
+from llama_index.core.schema import BaseNode
 from llama_index.core.storage.docstore import BaseDocumentStore, SimpleDocumentStore
+from llama_index.core.storage.docstore.keyval_docstore import KVDocumentStore
+from llama_index.core.storage.docstore.types import RefDocInfo
+from llama_index.core.storage.docstore.utils import json_to_doc
 from llama_index.core.storage.index_store import SimpleIndexStore
 from llama_index.core.storage.index_store.types import BaseIndexStore
+from llama_index.core.storage.index_store.utils import (
+    index_struct_to_json,
+    json_to_index_struct,
+)
 from llama_index.storage.docstore.redis import RedisDocumentStore
 from llama_index.storage.index_store.redis import RedisIndexStore
+from llama_index.storage.kvstore.redis import RedisKVStore
 
 from app.config.settings import RedisSettings, get_redis_settings
 
 logger = structlog.stdlib.get_logger(__name__)
 
 
+def _is_redis_doc_store(doc_store: BaseDocumentStore) -> bool:
+    return isinstance(doc_store, KVDocumentStore) and isinstance(
+        doc_store._kvstore, RedisKVStore
+    )
+
+
+def get_nodes(
+    doc_store: BaseDocumentStore, node_ids: Sequence[str]
+) -> dict[str, BaseNode]:
+    """Fetch many nodes at once, by node ID. Missing nodes are left out.
+
+    With Redis, all the nodes are read with a single HMGET.
+    """
+    if not node_ids:
+        return {}
+    if _is_redis_doc_store(doc_store):
+        redis_client = doc_store._kvstore._redis_client  # type: ignore[attr-defined]
+        raw_nodes = redis_client.hmget(
+            doc_store._node_collection, list(node_ids)  # type: ignore[attr-defined]
+        )
+        return {
+            node_id: json_to_doc(json.loads(raw_node))
+            for node_id, raw_node in zip(node_ids, raw_nodes)
+            if raw_node is not None
+        }
+
+    nodes = {}
+    for node_id in node_ids:
+        # `get_node` raises on a missing node, even with `raise_error=False`
+        node = doc_store.get_document(node_id, raise_error=False)
+        if isinstance(node, BaseNode):
+            nodes[node_id] = node
+    return nodes
+
+
+def walk_neighbors(
+    doc_store: BaseDocumentStore, nodes: Sequence[BaseNode], depth: int
+) -> dict[str, tuple[list[BaseNode], list[BaseNode]]]:
+    """The `depth` previous and next nodes of each node, nearest first.
+
+    The neighbors of all the nodes are fetched level by level, with one
+    `get_nodes` batch per level. The nodes already known (given, or fetched
+    at a previous level) are not fetched again, so overlapping windows cost
+    nothing. A walk stops at a missing node and at the boundaries of the
+    document.
+    """
+    previous: dict[str, list[BaseNode]] = {node.node_id: [] for node in nodes}
+    following: dict[str, list[BaseNode]] = {node.node_id: [] for node in nodes}
+    known: dict[str, BaseNode] = {node.node_id: node for node in nodes}
+    # Walk from each node in both directions: (origin, current, forward)
+    walks = [(node, node, forward) for node in nodes for forward in (False, True)]
+    for _ in range(depth):
+        wanted = []
+        for origin, current, forward in walks:
+            related = current.next_node if forward else current.prev_node
+            if related is not None:
+                wanted.append((origin, related.node_id, forward))
+        if not wanted:
+            break
+        missing = [node_id for _, node_id, _ in wanted if node_id not in known]
+        known.update(get_nodes(doc_store, list(dict.fromkeys(missing))))
+
+        walks = []
+        for origin, node_id, forward in wanted:
+            neighbor = known.get(node_id)
+            if neighbor is None or neighbor.ref_doc_id != origin.ref_doc_id:
+                continue
+            (following if forward else previous)[origin.node_id].append(neighbor)
+            walks.append((origin, neighbor, forward))
+
+    return {
+        node.node_id: (previous[node.node_id], following[node.node_id])
+        for node in nodes
+    }
+
+
+def delete_ref_docs(
+    doc_store: BaseDocumentStore, ref_doc_ids: Sequence[str]
+) -> dict[str, RefDocInfo]:
+    """Delete many documents and their nodes, return the deleted ones.
+
+    With Redis, the documents are read in one pipelined batch, and all their
+    keys are deleted in a second one, instead of several round trips per node.
+    The document hashes are deleted too, so that a deleted document is not
+    skipped by an incremental ingestion.
+    """
+    if _is_redis_doc_store(doc_store):
+        return _delete_ref_docs_redis(doc_store, ref_doc_ids)  # type: ignore[arg-type]
+
+    deleted: dict[str, RefDocInfo] = {}
+    for ref_doc_id in ref_doc_ids:
+        ref_doc_info = doc_store.get_ref_doc_info(ref_doc_id)
+        if ref_doc_info is None:
+            continue
+        doc_store.delete_ref_doc(ref_doc_id, raise_error=False)
+        if isinstance(doc_store, KVDocumentStore):
+            doc_store._kvstore.delete(
+                ref_doc_id, collection=doc_store._metadata_collection
+            )
+        deleted[ref_doc_id] = ref_doc_info
+    return deleted
+
+
+def _delete_ref_docs_redis(
+    doc_store: KVDocumentStore, ref_doc_ids: Sequence[str]
+) -> dict[str, RefDocInfo]:
+    redis_client = doc_store._kvstore._redis_client
+    with redis_client.pipeline(transaction=False) as pipe:
+        for ref_doc_id in ref_doc_ids:
+            pipe.hget(doc_store._ref_doc_collection, ref_doc_id)
+        raw_ref_doc_infos = pipe.execute()
+
+    deleted: dict[str, RefDocInfo] = {}
+    for ref_doc_id, raw_ref_doc_info in zip(ref_doc_ids, raw_ref_doc_infos):
+        if raw_ref_doc_info is not None:
+            deleted[ref_doc_id] = doc_store._remove_legacy_info(
+                json.loads(raw_ref_doc_info)
+            )
+    if not deleted:
+        return deleted
+
+    node_ids = [
+        node_id
+        for ref_doc_info in deleted.values()
+        for node_id in ref_doc_info.node_ids
+    ]
+    with redis_client.pipeline(transaction=True) as pipe:
+        if node_ids:
+            pipe.hdel(doc_store._node_collection, *node_ids)
+        pipe.hdel(doc_store._metadata_collection, *node_ids, *deleted)
+        pipe.hdel(doc_store._ref_doc_collection, *deleted)
+        pipe.execute()
+    logger.debug(
+        "Deleted count=%s documents and count=%s nodes", len(deleted), len(node_ids)
+    )
+    return deleted
+
+
+class RedisDeltaIndexStore(RedisIndexStore):
+    """Redis index store writing only the nodes that changed.
+
+    `RedisIndexStore` stores a whole index struct as one value, so every
+    `add_index_struct` (called by each insert and delete of a
+    `VectorStoreIndex`) re-serializes the `nodes_dict` of all the nodes of
+    the index. Here, the `nodes_dict` of an `IndexDict` is kept in a Redis
+    hash of its own, and `update_nodes` writes the changed nodes only.
+    `add_index_struct` writes the rest of the struct, and the `nodes_dict`
+    only the first time the process sees the index.
+
+    The index structs written by `RedisIndexStore` are migrated when read.
+    """
+
+    def __init__(self, redis_kvstore: RedisKVStore, namespace: str | None = None):
+        super().__init__(redis_kvstore, namespace=namespace)
+        self._redis_client = redis_kvstore._redis_client
+        # Indices whose `nodes_dict` hash is known to be complete
+        self._synced_index_ids: set[str] = set()
+        self._lock = threading.Lock()
+
+    def _nodes_key(self, index_id: str) -> str:
+        return f"{self._namespace}/nodes/{index_id}"
+
+    def _write(self, index_struct: IndexDict, all_nodes: bool) -> None:
+        base = dataclasses.replace(index_struct, nodes_dict={})
+        with self._redis_client.pipeline(transaction=True) as pipe:
+            pipe.hset(
+                self._collection,
+                index_struct.index_id,
+                json.dumps(index_struct_to_json(base)),
+            )
+            if all_nodes:
+                nodes_key = self._nodes_key(index_struct.index_id)
+                pipe.delete(nodes_key)
+                if index_struct.nodes_dict:
+                    pipe.hset(nodes_key, mapping=index_struct.nodes_dict)
+            pipe.execute()
+        with self._lock:
+            self._synced_index_ids.add(index_struct.index_id)
+
+    def add_index_struct(self, index_struct: IndexStruct) -> None:
+        if not isinstance(index_struct, IndexDict):
+            super().add_index_struct(index_struct)
+            return
+        with self._lock:
+            synced = index_struct.index_id in self._synced_index_ids
+        self._write(index_struct, all_nodes=not synced)
+
+    def update_nodes(self, index_struct: IndexDict, node_ids: Sequence[str]) -> None:
+        """Write the given nodes of the index: the ones still in its
+        `nodes_dict` are (re-)added, the others are deleted."""
+        if not node_ids:
+            return
+        with self._lock:
+            synced = index_struct.index_id in self._synced_index_ids
+        if not synced:
+            self._write(index_struct, all_nodes=True)
+            return
+        added = {
+            node_id: index_struct.nodes_dict[node_id]
+            for node_id in node_ids
+            if node_id in index_struct.nodes_dict
+        }
+        deleted = [
+            node_id for node_id in node_ids if node_id not in index_struct.nodes_dict
+        ]
+        nodes_key = self._nodes_key(index_struct.index_id)
+        with self._redis_client.pipeline(transaction=True) as pipe:
+            if added:
+                pipe.hset(nodes_key, mapping=added)
+            if deleted:
+                pipe.hdel(nodes_key, *deleted)
+            pipe.execute()
+
+    def _load(self, data: dict) -> IndexStruct:
+        index_struct = json_to_index_struct(data)
+        if not isinstance(index_struct, IndexDict):
+            return index_struct
+        if index_struct.nodes_dict:
+            # Written by `RedisIndexStore`, move its nodes to their own hash
+            logger.info(
+                "Migrating the nodes of index_id=%s to a hash", index_struct.index_id
+            )
+            self._write(index_struct, all_nodes=True)
+            return index_struct
+        raw_nodes = self._redis_client.hgetall(self._nodes_key(index_struct.index_id))
+        index_struct.nodes_dict = {
+            key.decode(): value.decode() for key, value in raw_nodes.items()
+        }
+        with self._lock:
+            self._synced_index_ids.add(index_struct.index_id)
+        return index_struct
+
+    def get_index_struct(self, struct_id: str | None = None) -> IndexStruct | None:
+        if struct_id is None:
+            return super().get_index_struct(struct_id)
+        data = self._kvstore.get(struct_id, collection=self._collection)
+        return None if data is None else self._load(data)
+
+    def index_structs(self) -> list[IndexStruct]:
+        return [
+            self._load(data)
+            for data in self._kvstore.get_all(collection=self._collection).values()
+        ]
+
+
 class NodeStoreComponent:
     index_store: BaseIndexStore
     doc_store: BaseDocumentStore
 
     def __init__(self, settings: RedisSettings = get_redis_settings()) -> None:
         try:
-            self.index_store = RedisIndexStore.from_host_and_port(
-                host=settings.host, port=settings.port
+            self.index_store = RedisDeltaIndexStore(
+                RedisKVStore.from_host_and_port(host=settings.host, port=settings.port)
             )
         except FileNotFoundError:
             logger.debug("Local index store not found, creating a new one")
@@ -0,0 +1,189 @@
+import json
+from pathlib import Path
+from typing import Any, Literal
+
+import numpy as np
+import structlog
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.embeddings import BaseEmbedding
+
+logger = structlog.stdlib.get_logger(__name__)
+
+ONNX_MODEL_FILE = "model.onnx"
+ONNX_QUANTIZED_MODEL_FILE = "model_quantized.onnx"
+# Written by sentence-transformers, thus used by `HuggingFaceEmbedding`
+POOLING_CONFIG_FILE = "1_Pooling/config.json"
+
+
+def _default_instructions(model_name: str) -> tuple[str | None, str | None]:
+    # Use the same instructions as the PyTorch path, so the vectors match
+    try:
+        from llama_index.embeddings.huggingface.utils import (  # type: ignore
+            get_query_instruct_for_model_name,
+            get_text_instruct_for_model_name,
+        )
+    except ImportError:
+        return None, None
+    return (
+        get_query_instruct_for_model_name(model_name),
+        get_text_instruct_for_model_name(model_name),
+    )
+
+
+def read_pooling(model_path: Path) -> Literal["cls", "mean"]:
+    """Pooling mode of an exported model, from its sentence-transformers config."""
+    config_file = Path(model_path) / POOLING_CONFIG_FILE
+    if not config_file.exists():
+        # Exported before the config was copied, the models were CLS pooled
+        logger.warning(
+            "No pooling config in model_path=%s, using CLS pooling: "
+            "export the model again with `python -m development.export_onnx`",
+            model_path,
+        )
+        return "cls"
+    config = json.loads(config_file.read_text())
+    if config.get("pooling_mode_cls_token"):
+        return "cls"
+    if config.get("pooling_mode_mean_tokens"):
+        return "mean"
+    raise ValueError(f"Unsupported pooling in {config_file}, only CLS and mean are")
+
+
+class OnnxEmbedding(BaseEmbedding):
+    """Run an exported (and optionally int8 quantized) model with ONNX Runtime.
+
+    The model directory holds `model.onnx` and/or `model_quantized.onnx` with
+    the files of the tokenizer and the pooling config of the model, as written
+    by `development/export_onnx.py`. The pooling (read from the config) and the
+    normalization are the ones of `HuggingFaceEmbedding`, so the vectors are
+    interchangeable with the PyTorch ones, up to the quantization error.
+    """
+
+    model_path: str = Field(description="Directory of the exported model.")
+    quantized: bool = Field(default=True, description="Run the int8 model.")
+    max_length: int = Field(default=512, description="Maximum tokens per text.")
+    pooling: Literal["cls", "mean"] = Field(
+        default="cls", description="Read from the pooling config of the model."
+    )
+    normalize: bool = Field(default=True)
+    query_instruction: str | None = Field(default=None)
+    text_instruction: str | None = Field(default=None)
+
+    _session: Any = PrivateAttr()
+    _tokenizer: Any = PrivateAttr()
+    _input_names: set[str] = PrivateAttr()
+
+    def __init__(
+        self,
+        model_path: Path,
+        model_name: str,
+        quantized: bool = True,
+        intra_op_threads: int = 0,
+        inter_op_threads: int = 1,
+        max_length: int = 512,
+        **kwargs: Any,
+    ) -> None:
+        try:
+            import onnxruntime  # type: ignore
+            from transformers import AutoTokenizer  # type: ignore
+        except ImportError as e:
+            raise ImportError(
+                "ONNX dependencies not found, install with "
+                "`pip install onnxruntime transformers`"
+            ) from e
+
+        model_file = Path(model_path) / (
+            ONNX_QUANTIZED_MODEL_FILE if quantized else ONNX_MODEL_FILE
+        )
+        if not model_file.exists():
+            raise FileNotFoundError(
+                f"ONNX model {model_file} not found, "
+                "export it with `python -m development.export_onnx`"
+            )
+
+        if "pooling" not in kwargs:
+            kwargs["pooling"] = read_pooling(model_path)
+        if "query_instruction" not in kwargs and "text_instruction" not in kwargs:
+            kwargs["query_instruction"], kwargs["text_instruction"] = (
+                _default_instructions(model_name)
+            )
+        super().__init__(
+            model_path=str(model_path),
+            # Quantized vectors differ slightly, they must not share a cache
+            model_name=f"{model_name}:onnx{'-int8' if quantized else ''}",
+            quantized=quantized,
+            max_length=max_length,
+            **kwargs,
+        )
+
+        session_options = onnxruntime.SessionOptions()
+        session_options.intra_op_num_threads = intra_op_threads
+        session_options.inter_op_num_threads = inter_op_threads
+        session_options.graph_optimization_level = (
+            onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        )
+        logger.debug(
+            "Loading ONNX model=%s with intra_op_threads=%s inter_op_threads=%s",
+            model_file,
+            intra_op_threads,
+            inter_op_threads,
+        )
+        self._session = onnxruntime.InferenceSession(
+            str(model_file),
+            sess_options=session_options,
+            providers=["CPUExecutionProvider"],
+        )
+        self._input_names = {
+            model_input.name for model_input in self._session.get_inputs()
+        }
+        self._tokenizer = AutoTokenizer.from_pretrained(model_path)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "OnnxEmbedding"
+
+    def _embed(self, texts: list[str]) -> list[list[float]]:
+        encoded = self._tokenizer(
+            texts,
+            padding=True,
+            truncation=True,
+            max_length=self.max_length,
+            return_tensors="np",
+        )
+        # Exports of models without token types have no `token_type_ids` input
+        inputs = {
+            name: value.astype(np.int64)
+            for name, value in encoded.items()
+            if name in self._input_names
+        }
+        last_hidden_state = self._session.run(None, inputs)[0]
+
+        if self.pooling == "cls":
+            embeddings = last_hidden_state[:, 0]
+        else:
+            mask = encoded["attention_mask"][..., np.newaxis].astype(np.float32)
+            embeddings = (last_hidden_state * mask).sum(axis=1) / np.clip(
+                mask.sum(axis=1), 1e-9, None
+            )
+        if self.normalize:
+            embeddings = embeddings / np.clip(
+                np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None
+            )
+        return embeddings.tolist()
+
+    def _format(self, text: str, instruction: str | None) -> str:
+        return f"{instruction} {text}".strip() if instruction else text
+
+    def _get_query_embedding(self, query: str) -> list[float]:
+        return self._embed([self._format(query, self.query_instruction)])[0]
+
+    async def _aget_query_embedding(self, query: str) -> list[float]:
+        return self._get_query_embedding(query)
+
+    def _get_text_embedding(self, text: str) -> list[float]:
+        return self._embed([self._format(text, self.text_instruction)])[0]
+
+    def _get_text_embeddings(self, texts: list[str]) -> list[list[float]]:
+        return self._embed(
+            [self._format(text, self.text_instruction) for text in texts]
+        )
@@ -0,0 +1,298 @@
+import contextlib
+import itertools
+import math
+import multiprocessing
+import os
+import threading
+import time
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.connection import Connection
+from pathlib import Path
+from typing import Any, Literal
+
+import structlog
+from llama_index.core.schema import Document
+
+from app.config.settings import EmbeddingSettings
+from app.dependencies.components.ingest_helper import (
+    FILE_READER_CLS,
+    PAGED_FILE_EXTENSIONS,
+    IngestionHelper,
+)
+from app.dependencies.components.metrics import get_metrics_registry
+
+logger = structlog.stdlib.get_logger(__name__)
+
+ParseFailureReason = Literal["timeout", "memory", "crash", "error"]
+
+BUSY_WORKERS = get_metrics_registry().gauge(
+    "ingest_busy_workers",
+    "Number of workers currently parsing or embedding.",
+    labels=["stage"],
+)
+
+
+class FileParseError(Exception):
+    """A file could not be parsed into documents.
+
+    `reason` is `timeout` or `memory` when the parser exceeded a limit and was
+    killed, `crash` when the parser process died, and `error` when the reader
+    raised an exception.
+    """
+
+    def __init__(self, file_name: str, reason: ParseFailureReason, detail: str) -> None:
+        super().__init__(f"Failed to parse file={file_name} ({reason}): {detail}")
+        self.file_name = file_name
+        self.reason = reason
+        self.detail = detail
+
+
+_JOBS: dict[str, Callable[..., Any]] = {
+    "parse": IngestionHelper.transform_file_into_documents,
+    "parse_pages": IngestionHelper.transform_file_pages_into_documents,
+    "count_pages": IngestionHelper.count_pages,
+}
+
+
+def _parse_worker(connection: Connection) -> None:
+    # Runs in the worker process, running one job at a time until told to stop
+    while True:
+        try:
+            job = connection.recv()
+        except EOFError:
+            return
+        if job is None:
+            return
+        kind, args = job
+        start = time.perf_counter()
+        try:
+            result = _JOBS[kind](*args)
+            connection.send(("ok", (result, time.perf_counter() - start)))
+        except Exception as e:
+            connection.send(("error", f"{type(e).__name__}: {e}"))
+
+
+class _ParserWorker:
+    PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+    def __init__(self, context: multiprocessing.context.BaseContext) -> None:
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(  # type: ignore[attr-defined]
+            target=_parse_worker, args=(child_connection,), daemon=True
+        )
+        self.process.start()
+        child_connection.close()
+        self.count_files = 0
+        self.killed = False
+
+    def rss_bytes(self) -> int | None:
+        """Resident memory of the worker, None if it can't be measured."""
+        try:
+            with open(f"/proc/{self.process.pid}/statm") as statm:
+                resident_pages = int(statm.read().split()[1])
+        except (OSError, ValueError, IndexError):
+            return None
+        return resident_pages * self.PAGE_SIZE
+
+    def stop(self) -> None:
+        try:
+            self.connection.send(None)
+        except OSError:
+            pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.kill()
+        self.connection.close()
+
+    def kill(self) -> None:
+        self.killed = True
+        self.process.kill()
+        self.process.join()
+        self.connection.close()
+
+
+class ParserPool:
+    """Supervised pool of processes parsing files into documents.
+
+    Each file is parsed in a worker process, which is killed if it runs longer
+    than `timeout` seconds or if its resident memory grows above
+    `max_rss_bytes`. Workers are recycled after `max_files_per_worker` files,
+    to release the memory leaked by the readers. `format_concurrency` limits
+    the number of files of a given extension parsed at the same time (e.g. to
+    parse a single audio file at once), on top of the global `max_workers`.
+
+    Files of a paged format (PDF) with more than `split_pages` pages are
+    split into ranges of pages, parsed on all the workers and merged back in
+    order, so a single big file doesn't run on one core while the others wait.
+
+    `parse` is blocking and thread-safe: the callers wait for a worker from
+    their own threads.
+    """
+
+    POLL_INTERVAL = 0.1
+
+    def __init__(
+        self,
+        max_workers: int,
+        timeout: float,
+        max_rss_bytes: int,
+        max_files_per_worker: int,
+        format_concurrency: dict[str, int] | None = None,
+        split_pages: int = 0,
+    ) -> None:
+        assert max_workers > 0, "max_workers must be > 0"
+        self.max_workers = max_workers
+        self.split_pages = split_pages
+        self.timeout = timeout
+        self.max_rss_bytes = max_rss_bytes
+        self.max_files_per_worker = max_files_per_worker
+        # Forking a process with running threads (the API, the ingest pipeline)
+        # can copy locks held by other threads, the workers are spawned instead
+        self._context = multiprocessing.get_context("spawn")
+        self._worker_slots = threading.BoundedSemaphore(max_workers)
+        self._format_slots = {
+            extension.lower(): threading.BoundedSemaphore(count)
+            for extension, count in (format_concurrency or {}).items()
+        }
+        self._lock = threading.Lock()
+        self._idle_workers: list[_ParserWorker] = []
+        self._closed = False
+        # Threads waiting for the workers parsing the page ranges of a file
+        self._page_ranges_executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="parser-pages"
+        )
+
+    @classmethod
+    def from_settings(cls, embed_settings: EmbeddingSettings) -> "ParserPool":
+        return cls(
+            max_workers=embed_settings.count_workers,
+            timeout=embed_settings.parser_timeout,
+            max_rss_bytes=embed_settings.parser_max_rss_mb * 1024 * 1024,
+            max_files_per_worker=embed_settings.parser_max_files_per_worker,
+            format_concurrency=embed_settings.parser_format_concurrency,
+            split_pages=embed_settings.parser_split_pages,
+        )
+
+    def parse(self, file_name: str, file_data: Path) -> tuple[list[Document], float]:
+        """Parse a file into documents, return them with the parsing time.
+
+        :raises FileParseError: if the file could not be parsed
+        """
+        if self._closed:
+            raise RuntimeError("The parser pool is closed")
+        extension = Path(file_name).suffix.lower()
+        if (
+            self.split_pages > 0
+            and extension in PAGED_FILE_EXTENSIONS
+            and FILE_READER_CLS.is_allowed(extension)
+        ):
+            count_pages, _ = self._run(file_name, "count_pages", (file_name, file_data))
+            if count_pages > self.split_pages:
+                return self._parse_page_ranges(file_name, file_data, count_pages)
+        return self._run(file_name, "parse", (file_name, file_data))
+
+    def _parse_page_ranges(
+        self, file_name: str, file_data: Path, count_pages: int
+    ) -> tuple[list[Document], float]:
+        start = time.perf_counter()
+        range_size = max(self.split_pages, math.ceil(count_pages / self.max_workers))
+        page_ranges = [
+            (first_page, min(first_page + range_size, count_pages))
+            for first_page in range(0, count_pages, range_size)
+        ]
+        logger.debug(
+            "Parsing count=%s pages of file=%s in count=%s ranges",
+            count_pages,
+            file_name,
+            len(page_ranges),
+        )
+        results = self._page_ranges_executor.map(
+            lambda page_range: self._run(
+                file_name, "parse_pages", (file_name, file_data, *page_range)
+            ),
+            page_ranges,
+        )
+        documents = list(
+            itertools.chain.from_iterable(documents for documents, _ in results)
+        )
+        return documents, time.perf_counter() - start
+
+    def _run(self, file_name: str, kind: str, args: tuple) -> tuple[Any, float]:
+        format_slot = self._format_slots.get(
+            Path(file_name).suffix.lower(), contextlib.nullcontext()
+        )
+        # Wait for the format slot first, not to hold a worker slot meanwhile
+        with format_slot, self._worker_slots:
+            worker = self._acquire_worker()
+            BUSY_WORKERS.inc(stage="parse")
+            try:
+                return self._run_in_worker(worker, file_name, (kind, args))
+            finally:
+                BUSY_WORKERS.dec(stage="parse")
+                self._release_worker(worker)
+
+    def _acquire_worker(self) -> _ParserWorker:
+        with self._lock:
+            if self._idle_workers:
+                return self._idle_workers.pop()
+        logger.debug("Starting a parser worker")
+        return _ParserWorker(self._context)
+
+    def _release_worker(self, worker: _ParserWorker) -> None:
+        if worker.killed:
+            return
+        worker.count_files += 1
+        with self._lock:
+            if not self._closed and worker.count_files < self.max_files_per_worker:
+                self._idle_workers.append(worker)
+                return
+        logger.debug("Recycling parser worker pid=%s", worker.process.pid)
+        worker.stop()
+
+    def _run_in_worker(
+        self, worker: _ParserWorker, file_name: str, job: tuple[str, tuple]
+    ) -> tuple[Any, float]:
+        deadline = time.monotonic() + self.timeout
+        try:
+            worker.connection.send(job)
+        except OSError as e:
+            # E.g. an idle worker killed by the OOM killer, it's not reused
+            worker.kill()
+            raise FileParseError(file_name, "crash", "worker exited") from e
+        while not worker.connection.poll(self.POLL_INTERVAL):
+            failure: tuple[ParseFailureReason, str] | None = None
+            rss_bytes = worker.rss_bytes()
+            if not worker.process.is_alive():
+                failure = ("crash", f"exit code {worker.process.exitcode}")
+            elif rss_bytes is not None and rss_bytes > self.max_rss_bytes:
+                failure = ("memory", f"used {rss_bytes // (1024 * 1024)} MB")
+            elif time.monotonic() > deadline:
+                failure = ("timeout", f"still running after {self.timeout}s")
+            if failure is not None:
+                logger.warning(
+                    "Killing parser worker pid=%s on file=%s, reason=%s",
+                    worker.process.pid,
+                    file_name,
+                    failure[0],
+                )
+                worker.kill()
+                raise FileParseError(file_name, *failure)
+
+        try:
+            status, result = worker.connection.recv()
+        except (EOFError, OSError) as e:
+            worker.kill()
+            raise FileParseError(file_name, "crash", "worker exited") from e
+        if status == "error":
+            raise FileParseError(file_name, "error", result)
+        return result
+
+    def close(self) -> None:
+        """Stop the idle workers, busy ones are stopped when they finish."""
+        with self._lock:
+            self._closed = True
+            idle_workers, self._idle_workers = self._idle_workers, []
+        for worker in idle_workers:
+            worker.stop()
+        self._page_ranges_executor.shutdown(wait=False)
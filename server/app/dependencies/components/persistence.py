@@ -0,0 +1,182 @@
+import json
+import logging
+import os
+import threading
+from collections.abc import Sequence
+from pathlib import Path
+
+from llama_index.core.constants import DATA_KEY
+from llama_index.core.data_structs import IndexDict
+from llama_index.core.indices.base import BaseIndex
+from llama_index.core.schema import BaseNode, Document
+from llama_index.core.storage.docstore import SimpleDocumentStore
+from llama_index.core.storage.docstore.utils import doc_to_json, json_to_doc
+from llama_index.core.storage.index_store import SimpleIndexStore
+
+from app.dependencies.components.node_store import (
+    RedisDeltaIndexStore,
+    delete_ref_docs,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class DeltaPersister:
+    """Persist the changes made to an index as an append-only change log.
+
+    `StorageContext.persist` re-serializes every store, so its cost grows with
+    the size of the index. Instead, every insert and delete appends one record
+    to a change log, which costs the same whatever the size of the index.
+    A background thread compacts the log into a full snapshot of the storage
+    context every `compaction_interval` seconds, or as soon as the log grows
+    above `compaction_log_bytes`.
+
+    Only the file-backed stores (`SimpleDocumentStore`, `SimpleIndexStore`)
+    need the change log; remote stores (Redis, Milvus) are durable on write.
+    With the Redis index store, the changed nodes of the index are written
+    one by one (see `RedisDeltaIndexStore`), instead of the whole index.
+    On start, the changes logged since the last snapshot are replayed.
+    """
+
+    CHANGE_LOG_FNAME = "changes.jsonl"
+
+    def __init__(
+        self,
+        index: BaseIndex[IndexDict],
+        index_lock: threading.Lock,
+        persist_dir: Path,
+        compaction_interval: float,
+        compaction_log_bytes: int,
+    ) -> None:
+        self._index = index
+        self._index_lock = index_lock
+        self.persist_dir = persist_dir
+        self.compaction_interval = compaction_interval
+        self.compaction_log_bytes = compaction_log_bytes
+        self._change_log_path = persist_dir / self.CHANGE_LOG_FNAME
+        self._file_backed = isinstance(
+            index.storage_context.docstore, SimpleDocumentStore
+        ) or isinstance(index.storage_context.index_store, SimpleIndexStore)
+        self._dirty = False
+        self._compact_event = threading.Event()
+
+        self.persist_dir.mkdir(parents=True, exist_ok=True)
+        self.replay()
+        threading.Thread(target=self._compaction_loop, daemon=True).start()
+
+    def record(
+        self,
+        nodes: Sequence[BaseNode] = (),
+        documents: Sequence[Document] = (),
+        deleted_doc_ids: Sequence[str] = (),
+        deleted_node_ids: Sequence[str] = (),
+    ) -> None:
+        """Record a change made to the index.
+
+        Must be called while holding the index lock, right after the change.
+        """
+        self._dirty = True
+        index_store = self._index.storage_context.index_store
+        if isinstance(index_store, RedisDeltaIndexStore):
+            index_store.update_nodes(
+                self._index.index_struct,
+                [node.node_id for node in nodes] + list(deleted_node_ids),
+            )
+        if not self._file_backed:
+            return
+
+        changes = []
+        if deleted_doc_ids:
+            changes.append({"op": "delete", "doc_ids": list(deleted_doc_ids)})
+        if nodes or documents:
+            changes.append(
+                {
+                    "op": "insert",
+                    "nodes": [self._node_to_json(node) for node in nodes],
+                    "hashes": {d.get_doc_id(): d.hash for d in documents},
+                }
+            )
+        if not changes:
+            return
+
+        with self._change_log_path.open("a") as change_log:
+            for change in changes:
+                change_log.write(json.dumps(change) + "\n")
+            change_log.flush()
+            os.fsync(change_log.fileno())
+            log_size = change_log.tell()
+        if log_size >= self.compaction_log_bytes:
+            self._compact_event.set()
+
+    @staticmethod
+    def _node_to_json(node: BaseNode) -> dict:
+        node_json = doc_to_json(node)
+        # Embeddings live in the vector store, the docstore keeps the text only
+        node_json[DATA_KEY]["embedding"] = None
+        return node_json
+
+    def replay(self) -> int:
+        """Apply the changes logged since the last snapshot. Return their count."""
+        if not self._file_backed or not self._change_log_path.exists():
+            return 0
+
+        count_changes = 0
+        with self._change_log_path.open() as change_log:
+            for line in change_log:
+                try:
+                    change = json.loads(line)
+                except json.JSONDecodeError:
+                    # Torn write of the last record, the change was never acknowledged
+                    logger.warning("Ignoring a truncated change log record")
+                    break
+                if change["op"] == "insert":
+                    self._replay_insert(change)
+                elif change["op"] == "delete":
+                    self._replay_delete(change)
+                count_changes += 1
+
+        if count_changes:
+            logger.info("Replayed count=%s changes from the change log", count_changes)
+            self._dirty = True
+            self._compact_event.set()
+        return count_changes
+
+    def _replay_insert(self, change: dict) -> None:
+        docstore = self._index.docstore
+        index_struct = self._index.index_struct
+        nodes = [json_to_doc(node_json) for node_json in change["nodes"]]
+        docstore.add_documents(nodes, allow_update=True)
+        for node in nodes:
+            index_struct.add_node(node, text_id=node.node_id)
+        for doc_id, doc_hash in change["hashes"].items():
+            docstore.set_document_hash(doc_id, doc_hash)
+        self._index.storage_context.index_store.add_index_struct(index_struct)
+
+    def _replay_delete(self, change: dict) -> None:
+        index_struct = self._index.index_struct
+        deleted = delete_ref_docs(self._index.docstore, change["doc_ids"])
+        for ref_doc_info in deleted.values():
+            for node_id in ref_doc_info.node_ids:
+                index_struct.nodes_dict.pop(node_id, None)
+        self._index.storage_context.index_store.add_index_struct(index_struct)
+
+    def compact(self) -> None:
+        """Write a full snapshot of the storage context and reset the change log."""
+        with self._index_lock:
+            if not self._dirty:
+                return
+            logger.debug("Compacting the change log into a snapshot")
+            self._index.storage_context.persist(persist_dir=self.persist_dir)
+            # A crash before the truncation only replays idempotent changes again
+            self._change_log_path.unlink(missing_ok=True)
+            self._dirty = False
+            logger.debug("Compacted the change log into a snapshot")
+
+    def _compaction_loop(self) -> None:
+        while True:
+            self._compact_event.wait(timeout=self.compaction_interval)
+            self._compact_event.clear()
+            try:
+                self.compact()
+            except Exception:
+                logger.exception("Failed to compact the change log")
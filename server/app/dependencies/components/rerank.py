@@ -0,0 +1,251 @@
+import collections
+import hashlib
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any
+
+import structlog
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.callbacks import CBEventType, EventPayload
+from llama_index.core.postprocessor.types import BaseNodePostprocessor
+from llama_index.core.schema import MetadataMode, NodeWithScore, QueryBundle
+from llama_index.core.utils import infer_torch_device
+
+from app.config.settings import RerankSettings, get_rag_settings
+
+logger = structlog.stdlib.get_logger(__name__)
+
+# Max count of tokens of a (query, passage) pair, as SentenceTransformerRerank
+_MAX_LENGTH = 512
+
+# A query and a passage to score together
+Pair = tuple[str, str]
+
+
+@dataclass
+class _ScoreRequest:
+    pairs: list[Pair]
+    future: Future
+
+
+def _pair_key(pair: Pair) -> bytes:
+    query, passage = pair
+    return hashlib.blake2b(
+        query.encode() + b"\0" + passage.encode(), digest_size=16
+    ).digest()
+
+
+class CrossEncoderBatcher:
+    """Score (query, passage) pairs with a cross-encoder shared by all threads.
+
+    The pairs of the concurrent callers are scored together: the scoring
+    thread takes the first waiting request, then the ones arriving within
+    `batch_window` seconds, up to `max_batch_size` pairs, and runs them in one
+    forward pass instead of one per request. The scores of the last
+    `cache_size` pairs are kept, so a query asked again (or the same passages
+    retrieved for it) is not scored again.
+    """
+
+    def __init__(
+        self,
+        model: Any,
+        batch_window: float = 0.005,
+        max_batch_size: int = 64,
+        cache_size: int = 4096,
+    ) -> None:
+        self.model = model
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self.cache_size = cache_size
+        self._cache: collections.OrderedDict[bytes, float] = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._queue: queue.Queue[_ScoreRequest | None] = queue.Queue()
+        self._thread = threading.Thread(
+            target=self._run, name="rerank-batcher", daemon=True
+        )
+        self._thread.start()
+
+    def score(self, pairs: list[Pair]) -> list[float]:
+        keys = [_pair_key(pair) for pair in pairs]
+        scores: dict[bytes, float] = {}
+        with self._lock:
+            for key in keys:
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    scores[key] = self._cache[key]
+        missing = {key: pair for key, pair in zip(keys, pairs) if key not in scores}
+        if missing:
+            future: Future = Future()
+            self._queue.put(_ScoreRequest(list(missing.values()), future))
+            scores.update(zip(missing, future.result()))
+            with self._lock:
+                for key in missing:
+                    self._cache[key] = scores[key]
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return [scores[key] for key in keys]
+
+    def _next_batch(self) -> list[_ScoreRequest] | None:
+        """Wait for a request, and take the ones arriving within the window."""
+        request = self._queue.get()
+        if request is None:
+            return None
+        batch = [request]
+        count_pairs = len(request.pairs)
+        deadline = time.monotonic() + self.batch_window
+        while count_pairs < self.max_batch_size:
+            try:
+                request = self._queue.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if request is None:
+                # Stop once this batch is scored
+                self._queue.put(None)
+                break
+            batch.append(request)
+            count_pairs += len(request.pairs)
+        return batch
+
+    def _run(self) -> None:
+        while (batch := self._next_batch()) is not None:
+            # Concurrent requests for the same query share their pairs
+            unique_pairs = list(
+                dict.fromkeys(pair for request in batch for pair in request.pairs)
+            )
+            try:
+                scores = self.model.predict(
+                    unique_pairs,
+                    batch_size=self.max_batch_size,
+                    show_progress_bar=False,
+                )
+            except Exception as e:
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+            score_by_pair = dict(zip(unique_pairs, (float(s) for s in scores)))
+            logger.debug(
+                "Reranked count=%s pairs of count=%s requests",
+                len(unique_pairs),
+                len(batch),
+            )
+            for request in batch:
+                request.future.set_result(
+                    [score_by_pair[pair] for pair in request.pairs]
+                )
+
+    def close(self) -> None:
+        self._queue.put(None)
+        self._thread.join()
+
+
+class BatchedCrossEncoderRerank(BaseNodePostprocessor):
+    """Same as `SentenceTransformerRerank`, but scores with a shared batcher.
+
+    The cross-encoder is loaded once by the rerank component instead of by
+    each request, and the scoring of concurrent requests is batched.
+    """
+
+    model: str = Field(description="Cross-encoder model name.")
+    top_n: int = Field(description="Number of nodes to return sorted by score.")
+    keep_retrieval_score: bool = Field(
+        default=False,
+        description="Whether to keep the retrieval score in metadata.",
+    )
+
+    _batcher: CrossEncoderBatcher = PrivateAttr()
+
+    def __init__(self, batcher: CrossEncoderBatcher, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self._batcher = batcher
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "BatchedCrossEncoderRerank"
+
+    def _postprocess_nodes(
+        self,
+        nodes: list[NodeWithScore],
+        query_bundle: QueryBundle | None = None,
+    ) -> list[NodeWithScore]:
+        if query_bundle is None:
+            raise ValueError("Missing query bundle in extra info.")
+        if not nodes:
+            return []
+
+        with self.callback_manager.event(
+            CBEventType.RERANKING,
+            payload={
+                EventPayload.NODES: nodes,
+                EventPayload.MODEL_NAME: self.model,
+                EventPayload.QUERY_STR: query_bundle.query_str,
+                EventPayload.TOP_K: self.top_n,
+            },
+        ) as event:
+            scores = self._batcher.score(
+                [
+                    (
+                        query_bundle.query_str,
+                        node.node.get_content(metadata_mode=MetadataMode.EMBED),
+                    )
+                    for node in nodes
+                ]
+            )
+            for node, score in zip(nodes, scores):
+                if self.keep_retrieval_score:
+                    node.node.metadata["retrieval_score"] = node.score
+                node.score = score
+            reranked = sorted(nodes, key=lambda node: -(node.score or 0.0))
+            reranked = reranked[: self.top_n]
+            event.on_end(payload={EventPayload.NODES: reranked})
+        return reranked
+
+
+class RerankComponent:
+    """Cross-encoder reranker of the process, None when reranking is disabled."""
+
+    reranker: BatchedCrossEncoderRerank | None
+
+    def __init__(
+        self, rerank_settings: RerankSettings = get_rag_settings().rerank
+    ) -> None:
+        self.reranker = None
+        self._batcher: CrossEncoderBatcher | None = None
+        if not rerank_settings.enabled:
+            return
+        try:
+            from sentence_transformers import CrossEncoder  # type: ignore
+        except ImportError as e:
+            raise ImportError(
+                "Rerank dependencies not found, install with "
+                "`pip install sentence-transformers`"
+            ) from e
+
+        logger.info("Loading the rerank model=%s", rerank_settings.model)
+        self._batcher = CrossEncoderBatcher(
+            CrossEncoder(
+                rerank_settings.model,
+                max_length=_MAX_LENGTH,
+                device=infer_torch_device(),
+            ),
+            batch_window=rerank_settings.batch_window_ms / 1000,
+            max_batch_size=rerank_settings.max_batch_size,
+            cache_size=rerank_settings.cache_size,
+        )
+        self.reranker = BatchedCrossEncoderRerank(
+            self._batcher,
+            model=rerank_settings.model,
+            top_n=rerank_settings.top_n,
+        )
+
+    def close(self) -> None:
+        if self._batcher is not None:
+            self._batcher.close()
+
+
+@lru_cache
+def get_rerank_component() -> RerankComponent:
+    return RerankComponent()
@@ -0,0 +1,144 @@
+import time
+from functools import lru_cache
+
+import structlog.stdlib
+from llama_index.core.indices import VectorStoreIndex
+from llama_index.core.base.base_retriever import BaseRetriever
+from llama_index.core.postprocessor import SimilarityPostprocessor
+from llama_index.core.postprocessor.types import BaseNodePostprocessor
+from llama_index.core.schema import NodeWithScore
+from llama_index.core.storage import StorageContext
+
+from app.config.settings import RagSettings, get_rag_settings
+from app.dependencies.base import ContextFilter
+from app.dependencies.components.dedup import NearDuplicateCollapser
+from app.dependencies.components.embedding import (
+    EmbeddingComponent,
+    get_embeddings_component,
+)
+from app.dependencies.components.llm import LLMComponent, get_llm_component
+from app.dependencies.components.node_store import (
+    NodeStoreComponent,
+    get_node_store_component,
+)
+from app.dependencies.components.rerank import (
+    RerankComponent,
+    get_rerank_component,
+)
+from app.dependencies.components.retrieval_cache import (
+    CachedRetriever,
+    RetrievalCache,
+    get_retrieval_cache,
+)
+from app.dependencies.components.sentence_window import SentenceWindowReconstructor
+from app.dependencies.components.vector_store import (
+    VectorStoreComponent,
+    get_vector_store_component,
+)
+
+logger = structlog.stdlib.get_logger(__name__)
+
+
+class RetrievalComponent:
+    """Index and node postprocessors shared by all the retrieval requests.
+
+    The storage context, the index over the vector store and the
+    postprocessors (with the shared reranker) are built once, and are
+    only read afterwards: they are safe to share between concurrent requests.
+    A request only creates a retriever, with its own context filter and top k,
+    which reads through the retrieval caches.
+    """
+
+    def __init__(
+        self,
+        llm_component: LLMComponent,
+        vector_store_component: VectorStoreComponent,
+        embedding_component: EmbeddingComponent,
+        node_store_component: NodeStoreComponent,
+        rerank_component: RerankComponent,
+        retrieval_cache: RetrievalCache,
+        rag_settings: RagSettings = get_rag_settings(),
+    ) -> None:
+        self.rag_settings = rag_settings
+        self.vector_store_component = vector_store_component
+        self.rerank_component = rerank_component
+        self.retrieval_cache = retrieval_cache
+        self.embed_model = embedding_component.embedding_model
+        self.storage_context = StorageContext.from_defaults(
+            vector_store=vector_store_component.vector_store,
+            docstore=node_store_component.doc_store,
+            index_store=node_store_component.index_store,
+        )
+        self.index = VectorStoreIndex.from_vector_store(
+            vector_store_component.vector_store,
+            storage_context=self.storage_context,
+            llm=llm_component.llm,
+            embed_model=self.embed_model,
+            show_progress=True,
+        )
+        self.node_postprocessors = self._node_postprocessors()
+
+    def _node_postprocessors(self) -> list[BaseNodePostprocessor]:
+        node_postprocessors: list[BaseNodePostprocessor] = [
+            SentenceWindowReconstructor(
+                docstore=self.storage_context.docstore,
+                window_size=self.rag_settings.sentence_window_size,
+            ),
+            SimilarityPostprocessor(
+                similarity_cutoff=self.rag_settings.similarity_value
+            ),
+        ]
+        if self.rerank_component.reranker is not None:
+            node_postprocessors.append(self.rerank_component.reranker)
+        # After the reranker, which reorders the nodes
+        node_postprocessors.append(NearDuplicateCollapser())
+        return node_postprocessors
+
+    def get_retriever(
+        self,
+        context_filter: ContextFilter | None = None,
+        similarity_top_k: int | None = None,
+    ) -> BaseRetriever:
+        similarity_top_k = similarity_top_k or self.rag_settings.similarity_top_k
+        return CachedRetriever(
+            self.vector_store_component.get_retriever(
+                index=self.index,
+                context_filter=context_filter,
+                similarity_top_k=similarity_top_k,
+            ),
+            cache=self.retrieval_cache,
+            embed_model=self.embed_model,
+            context_filter=context_filter,
+            similarity_top_k=similarity_top_k,
+        )
+
+    def retrieve(
+        self,
+        text: str,
+        context_filter: ContextFilter | None = None,
+        similarity_top_k: int | None = None,
+    ) -> list[NodeWithScore]:
+        return self.get_retriever(context_filter, similarity_top_k).retrieve(text)
+
+    def warm_up(self) -> None:
+        """Run a first retrieval, so that no request waits for the lazy
+        initializations (model loading, connections, page cache)."""
+        start = time.perf_counter()
+        try:
+            self.retrieve("warm-up", similarity_top_k=1)
+        except Exception:
+            logger.exception("Failed to warm up the retrieval")
+            return
+        logger.info("Warmed up the retrieval in %.2fs", time.perf_counter() - start)
+
+
+@lru_cache
+def get_retrieval_component() -> RetrievalComponent:
+    return RetrievalComponent(
+        llm_component=get_llm_component(),
+        vector_store_component=get_vector_store_component(),
+        embedding_component=get_embeddings_component(),
+        node_store_component=get_node_store_component(),
+        rerank_component=get_rerank_component(),
+        retrieval_cache=get_retrieval_cache(),
+    )
@@ -0,0 +1,242 @@
+import collections
+import hashlib
+import json
+import threading
+from collections.abc import Callable, Hashable
+from functools import lru_cache
+from typing import Any
+
+import structlog
+from llama_index.core.base.base_retriever import BaseRetriever
+from llama_index.core.base.embeddings.base import BaseEmbedding, Embedding
+from llama_index.core.schema import NodeWithScore, QueryBundle
+from llama_index.core.storage.docstore.utils import doc_to_json, json_to_doc
+from redis import Redis, RedisError
+
+from app.config.settings import (
+    RedisSettings,
+    RetrievalCacheSettings,
+    get_redis_settings,
+    get_retrieval_cache_settings,
+)
+from app.dependencies.base import ContextFilter
+from app.dependencies.components.metrics import get_metrics_registry
+
+logger = structlog.stdlib.get_logger(__name__)
+
+RETRIEVAL_CACHE_REQUESTS = get_metrics_registry().counter(
+    "retrieval_cache_requests_total",
+    "Lookups in the retrieval caches, by cache (query embedding or result) "
+    "and outcome (hit or miss).",
+    labels=("cache", "outcome"),
+)
+
+_GENERATION_KEY = "retrieval:generation"
+_RESULT_KEY_PREFIX = "retrieval:result:"
+
+
+class _LRUCache:
+    def __init__(self, max_entries: int) -> None:
+        self.max_entries = max_entries
+        self._entries: collections.OrderedDict[Hashable, Any] = (
+            collections.OrderedDict()
+        )
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Any | None:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+def _dump_nodes(nodes: list[NodeWithScore]) -> str:
+    return json.dumps(
+        [{"node": doc_to_json(node.node), "score": node.score} for node in nodes]
+    )
+
+
+def _load_nodes(data: str | bytes) -> list[NodeWithScore]:
+    # New node objects on every hit, the postprocessors modify them
+    return [
+        NodeWithScore(node=json_to_doc(item["node"]), score=item["score"])
+        for item in json.loads(data)
+    ]
+
+
+class RetrievalCache:
+    """Caches of the query embeddings and of the retrieved nodes.
+
+    The query embeddings are kept in an LRU of the process: they only depend
+    on the query and on the embedding model. The retrieved nodes depend on
+    the content of the index too, their key includes the generation of the
+    index, a counter bumped by every ingestion and deletion: the results of
+    the previous generations are never read again (and are evicted from the
+    LRU, or expire from Redis).
+
+    In `redis` mode, the generation is a Redis counter and the results are
+    stored in Redis as well, so all the API workers see the invalidations
+    and share the results. If Redis fails, the results are not cached.
+    """
+
+    def __init__(
+        self,
+        settings: RetrievalCacheSettings = get_retrieval_cache_settings(),
+        redis_settings: RedisSettings = get_redis_settings(),
+    ) -> None:
+        self.settings = settings
+        self._query_embeddings = _LRUCache(settings.query_embedding_cache_size)
+        self._results = _LRUCache(settings.max_entries)
+        self._generation = 0
+        self._generation_lock = threading.Lock()
+        self._redis: Redis | None = None
+        if settings.mode == "redis":
+            self._redis = Redis.from_url(str(redis_settings.dsn))
+
+    @property
+    def enabled(self) -> bool:
+        return self.settings.mode != "off"
+
+    def generation(self) -> int | None:
+        """Current generation of the index, None if it can't be read."""
+        if self._redis is None:
+            return self._generation
+        try:
+            return int(self._redis.get(_GENERATION_KEY) or 0)
+        except RedisError:
+            logger.warning("Cannot read the index generation from Redis")
+            return None
+
+    def bump_generation(self) -> None:
+        """Invalidate the retrieval results, after a change of the index."""
+        with self._generation_lock:
+            self._generation += 1
+        self._results.clear()
+        if self._redis is not None:
+            try:
+                self._redis.incr(_GENERATION_KEY)
+            except RedisError:
+                logger.exception(
+                    "Cannot bump the index generation in Redis, the other "
+                    "workers may return stale results for ttl=%ss",
+                    self.settings.ttl,
+                )
+
+    def query_embedding(
+        self, model_name: str, queries: list[str], embed: Callable[[], Embedding]
+    ) -> Embedding:
+        key = (model_name, *queries)
+        embedding = self._query_embeddings.get(key)
+        RETRIEVAL_CACHE_REQUESTS.inc(
+            cache="query_embedding", outcome="miss" if embedding is None else "hit"
+        )
+        if embedding is None:
+            embedding = embed()
+            self._query_embeddings.put(key, embedding)
+        return embedding
+
+    @staticmethod
+    def result_key(
+        generation: int,
+        model_name: str,
+        query: str,
+        doc_ids: list[str] | None,
+        top_k: int,
+    ) -> str:
+        payload = json.dumps(
+            [generation, model_name, query, sorted(doc_ids or []), top_k]
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get_result(self, key: str) -> list[NodeWithScore] | None:
+        data = self._results.get(key)
+        if data is None and self._redis is not None:
+            try:
+                data = self._redis.get(_RESULT_KEY_PREFIX + key)
+            except RedisError:
+                logger.warning("Cannot read a retrieval result from Redis")
+            if data is not None:
+                self._results.put(key, data)
+        RETRIEVAL_CACHE_REQUESTS.inc(
+            cache="result", outcome="miss" if data is None else "hit"
+        )
+        return None if data is None else _load_nodes(data)
+
+    def put_result(self, key: str, nodes: list[NodeWithScore]) -> None:
+        data = _dump_nodes(nodes)
+        self._results.put(key, data)
+        if self._redis is not None:
+            try:
+                self._redis.set(_RESULT_KEY_PREFIX + key, data, ex=self.settings.ttl)
+            except RedisError:
+                logger.warning("Cannot write a retrieval result to Redis")
+
+
+class CachedRetriever(BaseRetriever):
+    """Retriever reading through the retrieval caches.
+
+    The generation is read before retrieving: a result computed while the
+    index changes is stored under the previous generation, and never served.
+    """
+
+    def __init__(
+        self,
+        retriever: BaseRetriever,
+        cache: RetrievalCache,
+        embed_model: BaseEmbedding,
+        context_filter: ContextFilter | None,
+        similarity_top_k: int,
+    ) -> None:
+        super().__init__(callback_manager=retriever.callback_manager)
+        self._retriever = retriever
+        self._cache = cache
+        self._embed_model = embed_model
+        self._doc_ids = context_filter.docs_ids if context_filter else None
+        self._similarity_top_k = similarity_top_k
+
+    def _retrieve(self, query_bundle: QueryBundle) -> list[NodeWithScore]:
+        key = None
+        generation = self._cache.generation() if self._cache.enabled else None
+        if generation is not None:
+            key = RetrievalCache.result_key(
+                generation,
+                self._embed_model.model_name,
+                query_bundle.query_str,
+                self._doc_ids,
+                self._similarity_top_k,
+            )
+            nodes = self._cache.get_result(key)
+            if nodes is not None:
+                return nodes
+
+        if query_bundle.embedding is None and query_bundle.embedding_strs:
+            query_bundle.embedding = self._cache.query_embedding(
+                self._embed_model.model_name,
+                query_bundle.embedding_strs,
+                lambda: self._embed_model.get_agg_embedding_from_queries(
+                    query_bundle.embedding_strs
+                ),
+            )
+        nodes = self._retriever.retrieve(query_bundle)
+        if key is not None:
+            self._cache.put_result(key, nodes)
+        return nodes
+
+
+@lru_cache
+def get_retrieval_cache() -> RetrievalCache:
+    return RetrievalCache()
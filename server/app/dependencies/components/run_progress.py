@@ -0,0 +1,101 @@
+import dataclasses
+import json
+from dataclasses import dataclass
+from functools import lru_cache
+
+import structlog
+from redis import Redis, RedisError
+
+from app.config.settings import RedisSettings, get_redis_settings
+from app.dependencies.components.eta import ProgressTracker, StageProgress
+
+logger = structlog.stdlib.get_logger(__name__)
+
+_RUN_KEY_PREFIX = "ingest:run:"
+# Sorted set of the IDs of the runs, by start time
+_RUNS_KEY = "ingest:runs"
+
+
+@dataclass(frozen=True)
+class RunProgress:
+    started_at: float
+    stages: dict[str, StageProgress]
+
+
+class RunProgressStore:
+    """Progress of the bulk ingestions running, shared by the API processes.
+
+    A run is ingested by a single process, which publishes a snapshot of its
+    progress to Redis on every change, so that any process can report it.
+    A snapshot expires `ttl` seconds after the last change: the runs of a
+    process which died are not reported forever. If Redis fails, the
+    ingestion goes on, only its progress is not published.
+    """
+
+    def __init__(
+        self,
+        redis_settings: RedisSettings = get_redis_settings(),
+        redis_client: Redis | None = None,
+        ttl: int = 3600,
+    ) -> None:
+        self.ttl = ttl
+        self._redis = (
+            redis_client
+            if redis_client is not None
+            else Redis.from_url(str(redis_settings.dsn))
+        )
+
+    def publish(self, run_id: str, progress: ProgressTracker) -> None:
+        data = json.dumps(
+            {
+                "started_at": progress.started_at,
+                "stages": {
+                    stage: dataclasses.asdict(stage_progress)
+                    for stage, stage_progress in progress.snapshot().items()
+                },
+            }
+        )
+        try:
+            pipeline = self._redis.pipeline()
+            pipeline.set(_RUN_KEY_PREFIX + run_id, data, ex=self.ttl)
+            pipeline.zadd(_RUNS_KEY, {run_id: progress.started_at})
+            pipeline.execute()
+        except RedisError:
+            logger.warning("Cannot publish the progress of run=%s to Redis", run_id)
+
+    def remove(self, run_id: str) -> None:
+        try:
+            pipeline = self._redis.pipeline()
+            pipeline.delete(_RUN_KEY_PREFIX + run_id)
+            pipeline.zrem(_RUNS_KEY, run_id)
+            pipeline.execute()
+        except RedisError:
+            logger.warning("Cannot remove the progress of run=%s from Redis", run_id)
+
+    def running(self) -> dict[str, RunProgress]:
+        """Progress of the runs of all the processes, by run ID."""
+        run_ids = [run_id.decode() for run_id in self._redis.zrange(_RUNS_KEY, 0, -1)]
+        if not run_ids:
+            return {}
+        values = self._redis.mget([_RUN_KEY_PREFIX + run_id for run_id in run_ids])
+        expired = [run_id for run_id, value in zip(run_ids, values) if value is None]
+        if expired:
+            self._redis.zrem(_RUNS_KEY, *expired)
+        runs = {}
+        for run_id, value in zip(run_ids, values):
+            if value is None:
+                continue
+            data = json.loads(value)
+            runs[run_id] = RunProgress(
+                started_at=data["started_at"],
+                stages={
+                    stage: StageProgress(**stage_progress)
+                    for stage, stage_progress in data["stages"].items()
+                },
+            )
+        return runs
+
+
+@lru_cache
+def get_run_progress_store() -> RunProgressStore:
+    return RunProgressStore()
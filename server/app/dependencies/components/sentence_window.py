@@ -0,0 +1,128 @@
+from collections.abc import Sequence
+
+import structlog
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.node_parser import SentenceWindowNodeParser
+from llama_index.core.node_parser.node_utils import build_nodes_from_splits
+from llama_index.core.node_parser.text.sentence_window import (
+    DEFAULT_WINDOW_METADATA_KEY,
+    DEFAULT_WINDOW_SIZE,
+)
+from llama_index.core.postprocessor.types import BaseNodePostprocessor
+from llama_index.core.schema import (
+    BaseNode,
+    Document,
+    MetadataMode,
+    NodeWithScore,
+    QueryBundle,
+)
+from llama_index.core.storage.docstore import BaseDocumentStore
+
+from app.config.settings import RagSettings
+from app.dependencies.components.node_store import walk_neighbors
+
+logger = structlog.stdlib.get_logger(__name__)
+
+
+class CompactSentenceWindowNodeParser(SentenceWindowNodeParser):
+    """Sentence window node parser, without the window stored in the nodes.
+
+    `SentenceWindowNodeParser` copies the surrounding window of sentences, and
+    the original sentence, in the metadata of every node: the stored nodes are
+    about `2 * window_size + 2` times bigger than their sentence. Here a node
+    only keeps its own sentence and its previous / next node relationships,
+    which is enough for `SentenceWindowReconstructor` to rebuild the window at
+    retrieval time.
+    """
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CompactSentenceWindowNodeParser"
+
+    def build_window_nodes_from_documents(
+        self, documents: Sequence[Document]
+    ) -> list[BaseNode]:
+        all_nodes: list[BaseNode] = []
+        for doc in documents:
+            text_splits = self.sentence_splitter(doc.text)
+            all_nodes.extend(
+                build_nodes_from_splits(text_splits, doc, id_func=self.id_func)
+            )
+        return all_nodes
+
+
+class SentenceWindowReconstructor(BaseNodePostprocessor):
+    """Replace the content of the retrieved nodes by their sentence window.
+
+    Nodes parsed by `SentenceWindowNodeParser` have their window in the
+    metadata, it is used as is (like `MetadataReplacementPostProcessor`).
+    For the nodes parsed by `CompactSentenceWindowNodeParser`, the window is
+    rebuilt from the neighbor nodes of the same document. The neighbors of all
+    the nodes are fetched in one batch per hop, so rebuilding the windows
+    takes `window_size` round trips to the docstore, whatever the number of
+    nodes.
+    """
+
+    window_size: int = Field(default=DEFAULT_WINDOW_SIZE)
+    window_metadata_key: str = Field(default=DEFAULT_WINDOW_METADATA_KEY)
+
+    _docstore: BaseDocumentStore = PrivateAttr()
+
+    def __init__(
+        self,
+        docstore: BaseDocumentStore,
+        window_size: int = DEFAULT_WINDOW_SIZE,
+        window_metadata_key: str = DEFAULT_WINDOW_METADATA_KEY,
+    ) -> None:
+        super().__init__(
+            window_size=window_size, window_metadata_key=window_metadata_key
+        )
+        self._docstore = docstore
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "SentenceWindowReconstructor"
+
+    def _postprocess_nodes(
+        self,
+        nodes: list[NodeWithScore],
+        query_bundle: QueryBundle | None = None,
+    ) -> list[NodeWithScore]:
+        compact_nodes = []
+        for node_with_score in nodes:
+            node = node_with_score.node
+            if self.window_metadata_key in node.metadata:
+                node.set_content(node.metadata[self.window_metadata_key])
+            else:
+                compact_nodes.append(node)
+
+        windows = self._build_windows(compact_nodes)
+        for node in compact_nodes:
+            node.set_content(windows[node.node_id])
+        return nodes
+
+    def _build_windows(self, nodes: list[BaseNode]) -> dict[str, str]:
+        neighbors = walk_neighbors(self._docstore, nodes, self.window_size)
+        return {
+            node.node_id: " ".join(
+                window_node.get_content(metadata_mode=MetadataMode.NONE)
+                for window_node in [
+                    *reversed(neighbors[node.node_id][0]),
+                    node,
+                    *neighbors[node.node_id][1],
+                ]
+            )
+            for node in nodes
+        }
+
+
+def get_sentence_window_node_parser(
+    rag_settings: RagSettings,
+) -> SentenceWindowNodeParser:
+    if rag_settings.sentence_window_mode == "compact":
+        return CompactSentenceWindowNodeParser.from_defaults(
+            window_size=rag_settings.sentence_window_size
+        )
+    return SentenceWindowNodeParser.from_defaults(
+        window_size=rag_settings.sentence_window_size
+    )
@@ -1,4 +1,6 @@
+import json
 import typing
+from collections.abc import Sequence
 from functools import lru_cache
 
 import structlog.stdlib
@@ -12,8 +14,15 @@ from llama_index.core.vector_stores.types import (
 )
 from llama_index.vector_stores.milvus import MilvusVectorStore
 
-from app.config.settings import MilvusSettings, get_milvus_settings
+from app.config.settings import (
+    MilvusSettings,
+    VectorStoreSettings,
+    get_milvus_settings,
+    get_vector_store_settings,
+)
 from app.dependencies.base import ContextFilter
+from app.dependencies.components.local_vector_store import LocalVectorStore
+from app.paths import local_vector_store_path
 
 logger = structlog.stdlib.get_logger(__name__)
 
@@ -30,20 +39,59 @@ def _doc_id_metadata_filter(
     return filters
 
 
+def delete_ref_docs(vector_store: VectorStore, ref_doc_ids: Sequence[str]) -> None:
+    """Delete the vectors of many documents at once.
+
+    Milvus deletes all of them with a single filter expression, instead of
+    querying the primary keys of each document before deleting them. The
+    local store deletes them in a single transaction.
+    """
+    if not ref_doc_ids:
+        return
+    if isinstance(vector_store, MilvusVectorStore):
+        # JSON string literals are valid Milvus string literals
+        quoted_ids = ",".join(json.dumps(doc_id) for doc_id in ref_doc_ids)
+        vector_store.client.delete(
+            collection_name=vector_store.collection_name,
+            filter=f"{vector_store.doc_id_field} in [{quoted_ids}]",
+        )
+    elif isinstance(vector_store, LocalVectorStore):
+        vector_store.delete_many(ref_doc_ids)
+    else:
+        for ref_doc_id in ref_doc_ids:
+            vector_store.delete(ref_doc_id)
+    logger.debug("Deleted the vectors of count=%s documents", len(ref_doc_ids))
+
+
 class VectorStoreComponent:
     vector_store: VectorStore
 
     def __init__(
         self,
         milvus_settings: MilvusSettings = get_milvus_settings(),
+        vector_store_settings: VectorStoreSettings = get_vector_store_settings(),
     ) -> None:
-        self.vector_store = typing.cast(
-            VectorStore,
-            MilvusVectorStore(
-                uri=str(milvus_settings.uri),
-                **milvus_settings.model_dump(exclude_none=True, exclude={"uri"}),
-            ),
-        )
+        match vector_store_settings.mode:
+            case "local":
+                self.vector_store = typing.cast(
+                    VectorStore,
+                    LocalVectorStore(
+                        local_vector_store_path,
+                        dtype=vector_store_settings.local_dtype,
+                        ivf_threshold=vector_store_settings.local_ivf_threshold,
+                        ivf_nprobe=vector_store_settings.local_ivf_nprobe,
+                    ),
+                )
+            case "milvus":
+                self.vector_store = typing.cast(
+                    VectorStore,
+                    MilvusVectorStore(
+                        uri=str(milvus_settings.uri),
+                        **milvus_settings.model_dump(
+                            exclude_none=True, exclude={"uri"}
+                        ),
+                    ),
+                )
 
     @staticmethod
     def get_retriever(
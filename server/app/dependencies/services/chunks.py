@@ -1,27 +1,14 @@
-from typing import TYPE_CHECKING, Literal
+from functools import lru_cache
+from typing import Literal
 
-from llama_index.core.indices import VectorStoreIndex
-from llama_index.core.schema import NodeWithScore
-from llama_index.core.service_context import ServiceContext
-from llama_index.core.storage import StorageContext
+from llama_index.core.schema import BaseNode, NodeWithScore
 from pydantic import BaseModel, Field
 
 from app.dependencies.base import ContextFilter
-from app.dependencies.components import (
-    EmbeddingComponent,
-    LLMComponent,
-    NodeStoreComponent,
-    VectorStoreComponent,
-    get_embeddings_component,
-    get_llm_component,
-    get_node_store_component,
-    get_vector_store_component,
-)
+from app.dependencies.components import RetrievalComponent, get_retrieval_component
+from app.dependencies.components.node_store import walk_neighbors
 from app.dependencies.services.ingest import IngestedDoc
 
-if TYPE_CHECKING:
-    from llama_index.core.schema import RelatedNodeInfo
-
 
 class Chunk(BaseModel):
     object: Literal["context.chunk"]
@@ -60,43 +47,23 @@ class Chunk(BaseModel):
 class ChunksService:
     def __init__(
         self,
-        llm_component: LLMComponent = get_llm_component(),
-        vector_store_component: VectorStoreComponent = get_vector_store_component(),
-        embedding_component: EmbeddingComponent = get_embeddings_component(),
-        node_store_component: NodeStoreComponent = get_node_store_component(),
+        retrieval_component: RetrievalComponent = get_retrieval_component(),
     ) -> None:
-        self.vector_store_component = vector_store_component
-        self.llm_component = llm_component
-        self.embedding_component = embedding_component
-        self.storage_context = StorageContext.from_defaults(
-            vector_store=vector_store_component.vector_store,
-            docstore=node_store_component.doc_store,
-            index_store=node_store_component.index_store,
-        )
-        self.query_service_context = ServiceContext.from_defaults(
-            llm=llm_component.llm, embed_model=embedding_component.embedding_model
-        )
+        self.retrieval_component = retrieval_component
+        self.storage_context = retrieval_component.storage_context
 
-    def _get_sibling_nodes_text(
-        self, node_with_score: NodeWithScore, related_number: int, forward: bool = True
-    ) -> list[str]:
-        explored_nodes_texts = []
-        current_node = node_with_score.node
-        for _ in range(related_number):
-            explored_node_info: RelatedNodeInfo | None = (
-                current_node.next_node if forward else current_node.prev_node
+    def _get_sibling_nodes_texts(
+        self, nodes: list[BaseNode], related_number: int
+    ) -> dict[str, tuple[list[str], list[str]]]:
+        """Texts of the `related_number` previous and next nodes of each node."""
+        neighbors = walk_neighbors(self.storage_context.docstore, nodes, related_number)
+        return {
+            node_id: (
+                [neighbor.get_content() for neighbor in previous],
+                [neighbor.get_content() for neighbor in following],
             )
-            if explored_node_info is None:
-                break
-
-            explored_node = self.storage_context.docstore.get_node(
-                explored_node_info.node_id
-            )
-
-            explored_nodes_texts.append(explored_node.get_content())
-            current_node = explored_node
-
-        return explored_nodes_texts
+            for node_id, (previous, following) in neighbors.items()
+        }
 
     def retrieve_relevant(
         self,
@@ -105,26 +72,23 @@ class ChunksService:
         limit: int = 10,
         prev_next_chunks: int = 0,
     ) -> list[Chunk]:
-        index = VectorStoreIndex.from_vector_store(
-            self.vector_store_component.vector_store,
-            storage_context=self.storage_context,
-            llm=self.llm_component.llm,
-            embed_model=self.embedding_component.embedding_model,
-            show_progress=True,
-        )
-        vector_index_retriever = self.vector_store_component.get_retriever(
-            index=index, context_filter=context_filter, similarity_top_k=limit
+        nodes = self.retrieval_component.retrieve(
+            text, context_filter=context_filter, similarity_top_k=limit
         )
-        nodes = vector_index_retriever.retrieve(text)
         nodes.sort(key=lambda n: n.score or 0.0, reverse=True)
 
+        sibling_texts = self._get_sibling_nodes_texts(
+            [node.node for node in nodes], prev_next_chunks
+        )
         retrieved_nodes = []
         for node in nodes:
             chunk = Chunk.from_node(node)
-            chunk.previous_texts = self._get_sibling_nodes_text(
-                node, prev_next_chunks, False
-            )
-            chunk.next_texts = self._get_sibling_nodes_text(node, prev_next_chunks)
+            chunk.previous_texts, chunk.next_texts = sibling_texts[node.node.node_id]
             retrieved_nodes.append(chunk)
 
         return retrieved_nodes
+
+
+@lru_cache
+def get_chunks_service() -> ChunksService:
+    return ChunksService()
@@ -25,11 +25,11 @@ class EmbeddingsService:
         texts_embeddings = self.embedding_model.get_text_embedding_batch(texts)
         return [
             Embedding(
-                index=texts_embeddings.index(embedding),
+                index=index,
                 object="embedding",
                 embedding=embedding,
             )
-            for embedding in texts_embeddings
+            for index, embedding in enumerate(texts_embeddings)
         ]
 
 
@@ -0,0 +1,336 @@
+import hashlib
+import itertools
+import os
+import sqlite3
+import threading
+import time
+from collections.abc import Iterator
+from dataclasses import dataclass, field
+from functools import lru_cache
+from pathlib import Path
+from typing import IO
+
+import structlog.stdlib
+
+from app.config.settings import EmbeddingSettings, get_embeddings_settings
+from app.dependencies.components.ingest_helper import FILE_READER_CLS
+from app.dependencies.services.ingest import IngestService, get_ingest_service
+from app.paths import folder_sync_state_path
+
+try:
+    import fcntl
+except ImportError:  # Windows, which runs a single API process
+    fcntl = None  # type: ignore[assignment]
+
+logger = structlog.stdlib.get_logger(__name__)
+
+# Size and modification time of a file, compared to find the changed files
+FileStat = tuple[int, int]
+
+
+@dataclass
+class FolderSyncReport:
+    ingested: list[str] = field(default_factory=list)
+    deleted: list[str] = field(default_factory=list)
+    failed: list[str] = field(default_factory=list)
+    # Touched files with an unchanged content
+    unchanged: list[str] = field(default_factory=list)
+
+
+class _SyncState:
+    """Last synced size, mtime and content hash of each file, in SQLite."""
+
+    def __init__(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(
+            str(path), timeout=30, check_same_thread=False, isolation_level=None
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS files (folder TEXT NOT NULL, "
+            "file_name TEXT NOT NULL, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, "
+            "sha256 TEXT NOT NULL, PRIMARY KEY (folder, file_name))"
+        )
+
+    def load(self, folder: str) -> dict[str, tuple[FileStat, str]]:
+        return {
+            file_name: ((size, mtime_ns), sha256)
+            for file_name, size, mtime_ns, sha256 in self._connection.execute(
+                "SELECT file_name, size, mtime_ns, sha256 FROM files WHERE folder = ?",
+                (folder,),
+            )
+        }
+
+    def save(
+        self,
+        folder: str,
+        synced: dict[str, tuple[FileStat, str]],
+        deleted: list[str],
+    ) -> None:
+        self._connection.execute("BEGIN")
+        try:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)",
+                [
+                    (folder, file_name, size, mtime_ns, sha256)
+                    for file_name, ((size, mtime_ns), sha256) in synced.items()
+                ],
+            )
+            self._connection.executemany(
+                "DELETE FROM files WHERE folder = ? AND file_name = ?",
+                [(folder, file_name) for file_name in deleted],
+            )
+            self._connection.execute("COMMIT")
+        except Exception:
+            self._connection.execute("ROLLBACK")
+            raise
+
+
+def _sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as file:
+        while chunk := file.read(1024 * 1024):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class FolderSyncService:
+    """Keep the index in sync with the files of a folder.
+
+    The folder is scanned every `watch_interval` seconds (only the directory
+    entries are read, not the files), or as soon as a file changes when the
+    `watchfiles` package (inotify on Linux) is installed. A new, modified or
+    deleted file is synced once it is left unchanged for `watch_debounce`
+    seconds. The files ready at the same time are ingested in one
+    `bulk_ingest` call, checkpointed so that an interrupted sync resumes, and
+    the documents of the deleted files are deleted in one batch.
+
+    The size, mtime and content hash of the synced files are kept on disk: a
+    file whose mtime changed but not its content is not ingested again, and
+    a restarted API only syncs what changed while it was stopped.
+
+    When the API runs several worker processes, only one of them syncs the
+    folder: the one holding the lock file next to the sync state. The others
+    wait for the lock, to take over if that process stops.
+    """
+
+    def __init__(
+        self,
+        ingest_service: IngestService = get_ingest_service(),
+        embed_settings: EmbeddingSettings = get_embeddings_settings(),
+        state_path: Path = folder_sync_state_path,
+    ) -> None:
+        if embed_settings.watch_folder is None:
+            raise ValueError("No `watch_folder` configured")
+        self.ingest_service = ingest_service
+        self.folder = Path(embed_settings.watch_folder).resolve()
+        self.interval = embed_settings.watch_interval
+        self.debounce = embed_settings.watch_debounce
+        # Modified files are re-ingested in place, stale documents are deleted
+        self.incremental = embed_settings.incremental_ingest
+        self.run_id = f"folder-sync:{self.folder}"
+        self._lock_path = state_path.with_name(f"{state_path.name}.lock")
+        self._state = _SyncState(state_path)
+        self._synced = self._state.load(str(self.folder))
+        # Changed files waiting to be left unchanged for `debounce` seconds
+        self._pending: dict[str, tuple[FileStat | None, float]] = {}
+        # Files which failed to ingest, retried once modified (or on restart)
+        self._failed: dict[str, FileStat] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def _scan(self) -> dict[str, FileStat]:
+        """Size and mtime of the files to sync, by path relative to the folder."""
+        stats: dict[str, FileStat] = {}
+        directories = [self.folder]
+        while directories:
+            directory = directories.pop()
+            try:
+                entries: Iterator[os.DirEntry] = os.scandir(directory)
+            except OSError:
+                logger.warning("Cannot scan directory=%s", directory)
+                continue
+            with entries:
+                for entry in entries:
+                    if entry.name.startswith("."):
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        directories.append(Path(entry.path))
+                    elif entry.is_file() and FILE_READER_CLS.is_allowed(
+                        Path(entry.name).suffix
+                    ):
+                        stat = entry.stat()
+                        file_name = Path(entry.path).relative_to(self.folder)
+                        stats[file_name.as_posix()] = (stat.st_size, stat.st_mtime_ns)
+        return stats
+
+    def _ready_changes(self, stats: dict[str, FileStat]) -> list[str]:
+        """Changed files (deleted ones included) left unchanged long enough."""
+        now = time.monotonic()
+        changed = {
+            file_name: stat
+            for file_name, stat in stats.items()
+            if self._synced.get(file_name, (None,))[0] != stat
+            and self._failed.get(file_name) != stat
+        }
+        changed.update(
+            {file_name: None for file_name in self._synced if file_name not in stats}
+        )
+        ready = []
+        pending = {}
+        for file_name, stat in changed.items():
+            previous_stat, since = self._pending.get(file_name, (stat, now))
+            if previous_stat != stat:
+                since = now
+            if now - since >= self.debounce:
+                ready.append(file_name)
+            else:
+                pending[file_name] = (stat, since)
+        self._pending = pending
+        return ready
+
+    def sync_once(self) -> FolderSyncReport:
+        """Scan the folder and sync the changes that are ready."""
+        with self._lock:
+            report = FolderSyncReport()
+            stats = self._scan()
+            ready = self._ready_changes(stats)
+            if not ready:
+                return report
+
+            deleted = [file_name for file_name in ready if file_name not in stats]
+            to_ingest: list[tuple[str, Path]] = []
+            hashes: dict[str, str] = {}
+            for file_name in ready:
+                if file_name not in stats:
+                    continue
+                try:
+                    hashes[file_name] = _sha256(self.folder / file_name)
+                except OSError:
+                    # Deleted since the scan, synced by the next one
+                    continue
+                if self._synced.get(file_name, (None, None))[1] == hashes[file_name]:
+                    report.unchanged.append(file_name)
+                else:
+                    to_ingest.append((file_name, self.folder / file_name))
+
+            # Without stable document IDs, the documents of a modified file
+            # must be deleted before it is ingested again
+            modified = [
+                file_name
+                for file_name, _ in to_ingest
+                if file_name in self._synced and not self.incremental
+            ]
+            if deleted or modified:
+                # Forgotten by the checkpoint too: if one comes back with the
+                # same content, it must be ingested again
+                self.ingest_service.delete_by_files(
+                    deleted + modified, run_id=self.run_id
+                )
+                report.deleted = deleted
+
+            if to_ingest:
+                logger.info("Syncing count=%s files of the folder", len(to_ingest))
+                for file_report in self.ingest_service.bulk_ingest_report(
+                    to_ingest, run_id=self.run_id
+                ):
+                    if file_report.status == "failed":
+                        report.failed.append(file_report.file_name)
+                    else:
+                        report.ingested.append(file_report.file_name)
+
+            self._failed = {
+                file_name: stat
+                for file_name, stat in self._failed.items()
+                if file_name in stats
+            }
+            self._failed.update(
+                {file_name: stats[file_name] for file_name in report.failed}
+            )
+            synced = {
+                file_name: (stats[file_name], hashes[file_name])
+                for file_name in report.ingested + report.unchanged
+            }
+            self._state.save(str(self.folder), synced, deleted)
+            self._synced.update(synced)
+            for file_name in deleted:
+                self._synced.pop(file_name, None)
+            logger.info(
+                "Synced the folder: count=%s ingested, count=%s deleted, count=%s failed",
+                len(report.ingested),
+                len(report.deleted),
+                len(report.failed),
+            )
+            return report
+
+    def _changes(self) -> Iterator[object]:
+        """Yield after each change of the folder, or every `interval` seconds."""
+        try:
+            import watchfiles  # type: ignore
+        except ImportError:
+            while not self._stop.wait(self.interval):
+                yield None
+            return
+        yield from watchfiles.watch(
+            self.folder,
+            stop_event=self._stop,
+            rust_timeout=int(self.interval * 1000),
+            yield_on_timeout=True,
+        )
+
+    def _try_lock(self) -> IO | None:
+        """Take the lock of the folder sync, None if another process holds it."""
+        lock_file = self._lock_path.open("a")
+        if fcntl is None:
+            return lock_file
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return None
+        return lock_file
+
+    def _run(self) -> None:
+        lock_file = self._try_lock()
+        if lock_file is None:
+            logger.info("Folder=%s is synced by another process", self.folder)
+        while lock_file is None:
+            if self._stop.wait(self.interval):
+                return
+            lock_file = self._try_lock()
+        # Closing the file releases the lock
+        with lock_file:
+            with self._lock:
+                # Synced by another process until now
+                self._synced = self._state.load(str(self.folder))
+            logger.info("Watching folder=%s", self.folder)
+            for _ in itertools.chain([None], self._changes()):
+                if self._stop.is_set():
+                    break
+                try:
+                    self.sync_once()
+                except Exception:
+                    logger.exception("Failed to sync folder=%s", self.folder)
+
+    def start(self) -> None:
+        """Sync the folder in a background thread, until `stop` is called."""
+        if self._thread is not None:
+            return
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="folder-sync", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+@lru_cache
+def get_folder_sync_service() -> FolderSyncService:
+    return FolderSyncService()
@@ -1,15 +1,23 @@
+import collections
+import hashlib
+import os
+import tarfile
 import tempfile
+import threading
+import zipfile
+from collections.abc import Iterator
+from datetime import datetime, timezone
 from functools import lru_cache
-from pathlib import Path
+from pathlib import Path, PurePosixPath
 from typing import TYPE_CHECKING, Annotated, Any, AnyStr, BinaryIO, Literal
 
 import structlog.stdlib
 from fastapi import Depends
-from llama_index.core.node_parser import SentenceWindowNodeParser
-from llama_index.core.schema import Document
+from llama_index.core.schema import Document, TransformComponent
 from llama_index.core.storage import StorageContext
 from pydantic import BaseModel, Field
 
+from app.config.settings import EmbeddingSettings, get_rag_settings
 from app.dependencies.components import (
     EmbeddingComponent,
     LLMComponent,
@@ -22,6 +30,14 @@ from app.dependencies.components import (
     get_node_store_component,
     get_vector_store_component,
 )
+from app.dependencies.components.dedup import NearDuplicateFilter
+from app.dependencies.components.embedding_scheduler import EmbeddingBatchScheduler
+from app.dependencies.components.eta import StageProgress
+from app.dependencies.components.ingest import IngestEvent, StreamedFiles
+from app.dependencies.components.sentence_window import (
+    get_sentence_window_node_parser,
+)
+from app.paths import dedup_index_path
 
 if TYPE_CHECKING:
     from llama_index.core.storage.docstore.types import RefDocInfo
@@ -29,6 +45,16 @@ if TYPE_CHECKING:
 
 logger = structlog.stdlib.get_logger(__name__)
 
+ARCHIVE_SUFFIXES = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz")
+
+
+class BulkIngestLimitError(ValueError):
+    """Raised when a bulk upload exceeds the configured number of files or size."""
+
+
+class DuplicateFileNameError(ValueError):
+    """Raised when several files of a bulk ingestion have the same name."""
+
 
 class IngestedDoc(BaseModel):
     object: Literal["ingest.document"]
@@ -59,6 +85,215 @@ class IngestedDoc(BaseModel):
         )
 
 
+class IngestFileReport(BaseModel):
+    object: Literal["ingest.file"]
+    file_name: str = Field(examples=["reports/Sales Report Q3 2023.pdf"])
+    status: Literal["ingested", "skipped", "failed"]
+    documents: list[IngestedDoc]
+    error: str | None = None
+
+
+class IngestStageProgress(BaseModel):
+    done: int = Field(examples=[3])
+    total: int = Field(examples=[10])
+    files_per_minute: float | None = Field(default=None, examples=[4.0])
+    seconds_left: float | None = Field(default=None, examples=[90.0])
+    eta: str | None = Field(default=None, examples=["1m 30s @ 4/min"])
+
+    @staticmethod
+    def from_stage_progress(progress: StageProgress) -> "IngestStageProgress":
+        return IngestStageProgress(
+            done=progress.done,
+            total=progress.total,
+            files_per_minute=(
+                progress.rate * 60 if progress.rate is not None else None
+            ),
+            seconds_left=progress.seconds_left,
+            eta=progress.eta,
+        )
+
+
+class IngestRunProgress(BaseModel):
+    object: Literal["ingest.run"]
+    run_id: str = Field(examples=["folder-sync:/data/inbox"])
+    started_at: datetime
+    progress: dict[str, IngestStageProgress]
+
+
+class _BulkStager:
+    """Stream uploaded files and archive members to the ingestion.
+
+    The uploads are read twice. First only their sizes and the headers of the
+    archive members, to check the limits and list the files before any of
+    them is staged. Then member by member, while the files are ingested: each
+    file is copied to its own temporary file (the readers need a path) when
+    the ingestion pulls it, and deleted as soon as it's parsed. At most
+    `window` files are staged at once, archives are never extracted to disk
+    nor loaded in memory.
+    """
+
+    CHUNK_SIZE = 1024 * 1024
+
+    def __init__(
+        self,
+        directory: Path,
+        embed_settings: EmbeddingSettings,
+        uploads: list[tuple[str, BinaryIO]],
+    ) -> None:
+        self.directory = directory
+        self.max_files = embed_settings.bulk_ingest_max_files
+        self.max_bytes = embed_settings.bulk_ingest_max_mb * 1024 * 1024
+        # Enough staged files to keep all the parsers busy
+        self.window = 2 * max(embed_settings.count_workers, 1)
+        self._uploads = uploads
+        self._slots = threading.Semaphore(self.window)
+        self._staged: dict[str, Path] = {}
+        self._staged_lock = threading.Lock()
+        self._count_staged = 0
+        self._staged_bytes = 0
+        self._closed = False
+
+    def scan(self, with_fingerprints: bool = False) -> StreamedFiles:
+        """List the files of the uploads from their headers, check the limits.
+
+        The fingerprints of archive members are taken from their headers
+        (CRC and size for zip, size and modification time for tar), the ones
+        of plain uploads hash their content, only if `with_fingerprints`.
+
+        :raises BulkIngestLimitError: if the uploads have too many files or are too big
+        """
+        file_names: list[str] = []
+        fingerprints: dict[str, str] = {}
+        total_bytes = 0
+        for upload_name, raw_file_data in self._uploads:
+            for file_name, size, fingerprint in self._headers(
+                upload_name, raw_file_data, with_fingerprints
+            ):
+                file_names.append(file_name)
+                fingerprints[file_name] = fingerprint
+                total_bytes += size
+                if len(file_names) > self.max_files:
+                    raise BulkIngestLimitError(f"Too many files, max={self.max_files}")
+                if total_bytes > self.max_bytes:
+                    raise BulkIngestLimitError(
+                        f"Upload too large, max={self.max_bytes} bytes"
+                    )
+        return StreamedFiles(file_names, fingerprints, self._stage)
+
+    def on_event(self, event: IngestEvent) -> None:
+        """Ingest listener deleting the staged files once parsed."""
+        if event.stage not in ("parse", "fail"):
+            return
+        with self._staged_lock:
+            paths = [
+                self._staged.pop(file_name)
+                for file_name in event.file_names
+                if file_name in self._staged
+            ]
+        for path in paths:
+            path.unlink(missing_ok=True)
+            self._slots.release()
+
+    def close(self) -> None:
+        """Stop staging files, the ingestion may have failed before pulling
+        them all (its thread pools must not stay blocked on a slot)."""
+        self._closed = True
+        self._slots.release()
+
+    def _stage(self, file_names: set[str]) -> Iterator[tuple[str, Path]]:
+        for upload_name, raw_file_data in self._uploads:
+            for file_name, file_data in self._members(upload_name, raw_file_data):
+                if file_name not in file_names:
+                    continue
+                self._slots.acquire()
+                if self._closed:
+                    return
+                yield file_name, self._stage_file(file_name, file_data)
+
+    def _stage_file(self, file_name: str, file_data: BinaryIO) -> Path:
+        # Never use the uploaded name in the path, only keep its extension
+        path = self.directory / f"{self._count_staged}{PurePosixPath(file_name).suffix}"
+        self._count_staged += 1
+        with path.open("wb") as staged_file:
+            while chunk := file_data.read(self.CHUNK_SIZE):
+                # The headers were checked, not the data they describe
+                self._staged_bytes += len(chunk)
+                if self._staged_bytes > self.max_bytes:
+                    raise BulkIngestLimitError(
+                        f"Upload too large, max={self.max_bytes} bytes"
+                    )
+                staged_file.write(chunk)
+        with self._staged_lock:
+            self._staged[file_name] = path
+        return path
+
+    @staticmethod
+    def _member_name(member_name: str) -> str | None:
+        parts = PurePosixPath(member_name).parts
+        # Skip hidden files and OS metadata (e.g. __MACOSX/, .DS_Store)
+        if any(part.startswith((".", "__MACOSX")) for part in parts):
+            return None
+        return str(PurePosixPath(*parts))
+
+    def _headers(
+        self, upload_name: str, raw_file_data: BinaryIO, with_fingerprints: bool
+    ) -> Iterator[tuple[str, int, str]]:
+        raw_file_data.seek(0)
+        if not upload_name.lower().endswith(ARCHIVE_SUFFIXES):
+            digest = hashlib.sha256()
+            if with_fingerprints:
+                while chunk := raw_file_data.read(self.CHUNK_SIZE):
+                    digest.update(chunk)
+            size = raw_file_data.seek(0, os.SEEK_END)
+            yield upload_name, size, digest.hexdigest()
+        elif upload_name.lower().endswith(".zip"):
+            with zipfile.ZipFile(raw_file_data) as archive:
+                for info in archive.infolist():
+                    file_name = self._member_name(info.filename)
+                    if not info.is_dir() and file_name is not None:
+                        fingerprint = f"zip:{info.CRC:08x}:{info.file_size}"
+                        yield file_name, info.file_size, fingerprint
+        else:
+            # Only the headers are read, the data of the members is skipped
+            with tarfile.open(fileobj=raw_file_data, mode="r|*") as archive:
+                for member in archive:
+                    file_name = self._member_name(member.name)
+                    if member.isfile() and file_name is not None:
+                        fingerprint = f"tar:{member.size}:{member.mtime}"
+                        yield file_name, member.size, fingerprint
+
+    def _members(
+        self, upload_name: str, raw_file_data: BinaryIO
+    ) -> Iterator[tuple[str, BinaryIO]]:
+        raw_file_data.seek(0)
+        if not upload_name.lower().endswith(ARCHIVE_SUFFIXES):
+            yield upload_name, raw_file_data
+        elif upload_name.lower().endswith(".zip"):
+            # The zip central directory is at the end: the upload must be seekable
+            with zipfile.ZipFile(raw_file_data) as archive:
+                for info in archive.infolist():
+                    file_name = self._member_name(info.filename)
+                    if not info.is_dir() and file_name is not None:
+                        with archive.open(info) as member_data:
+                            yield file_name, member_data
+        else:
+            logger.debug("Streaming members of archive=%s", upload_name)
+            with tarfile.open(fileobj=raw_file_data, mode="r|*") as archive:
+                for member in archive:
+                    file_name = self._member_name(member.name)
+                    member_data = (
+                        archive.extractfile(member) if member.isfile() else None
+                    )
+                    if member_data is not None and file_name is not None:
+                        yield file_name, member_data
+
+
+def _file_names(files: list[tuple[str, Path]] | StreamedFiles) -> list[str]:
+    if isinstance(files, StreamedFiles):
+        return files.file_names
+    return [file_name for file_name, _ in files]
+
+
 class IngestService:
     def __init__(
         self,
@@ -79,13 +314,35 @@ class IngestService:
             docstore=node_store_component.doc_store,
             index_store=node_store_component.index_store,
         )
-        node_parser = SentenceWindowNodeParser.from_defaults()
+        node_parser = get_sentence_window_node_parser(get_rag_settings())
 
+        self.embed_settings = get_embeddings_settings()
+        embedder: TransformComponent = embedding_component.embedding_model
+        if self.embed_settings.batch_token_budget > 0:
+            embedder = EmbeddingBatchScheduler(
+                embed_model=embedding_component.embedding_model,
+                token_budget=self.embed_settings.batch_token_budget,
+                max_batch_size=self.embed_settings.batch_max_size,
+            )
+        transformations: list[TransformComponent] = [node_parser, embedder]
+        if self.embed_settings.dedup_mode != "off":
+            # Before the embedder, duplicates are not embedded
+            transformations.insert(
+                1,
+                NearDuplicateFilter(
+                    docstore=self.storage_context.docstore,
+                    path=dedup_index_path,
+                    action=self.embed_settings.dedup_mode,
+                    threshold=self.embed_settings.dedup_threshold,
+                    num_perm=self.embed_settings.dedup_num_perm,
+                    bands=self.embed_settings.dedup_bands,
+                ),
+            )
         self.ingest_component = get_ingestion_component(
             self.storage_context,
             embed_model=embedding_component.embedding_model,
-            transformations=[node_parser, embedding_component.embedding_model],
-            embed_settings=get_embeddings_settings(),
+            transformations=transformations,
+            embed_settings=self.embed_settings,
         )
 
     def _ingest_data(self, file_name: str, file_data: AnyStr) -> list[IngestedDoc]:
@@ -122,12 +379,141 @@ class IngestService:
         file_data = raw_file_data.read()
         return self._ingest_data(file_name, file_data)
 
-    def bulk_ingest(self, files: list[tuple[str, Path]]) -> list[IngestedDoc]:
-        logger.info("Ingesting file_names=%s", [f[0] for f in files])
-        documents = self.ingest_component.bulk_ingest(files)
-        logger.info("Finished ingestion file_name=%s", [f[0] for f in files])
+    def bulk_ingest(
+        self,
+        files: list[tuple[str, Path]] | StreamedFiles,
+        run_id: str | None = None,
+    ) -> list[IngestedDoc]:
+        """Ingest many files at once.
+
+        With a `run_id`, an interrupted run can be resumed by calling this
+        method again with the same `run_id`: files already persisted by the
+        previous attempt are skipped.
+        """
+        logger.info("Ingesting file_names=%s", _file_names(files))
+        documents = self.ingest_component.bulk_ingest(files, run_id=run_id)
+        logger.info("Finished ingestion file_name=%s", _file_names(files))
         return [IngestedDoc.from_document(document) for document in documents]
 
+    def bulk_ingest_bin_data(
+        self, files: list[tuple[str, BinaryIO]], run_id: str | None = None
+    ) -> list[IngestFileReport]:
+        """Ingest many files at once, zip and tar archives are unpacked.
+
+        All the files are given to the ingest component in a single
+        `bulk_ingest` call, to benefit from its batching. They are staged on
+        disk a few at a time, as the ingestion parses them.
+
+        :raises BulkIngestLimitError: if the upload has too many files or is too big
+        :raises DuplicateFileNameError: if several files have the same name
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            stager = _BulkStager(Path(tmp_dir), self.embed_settings, files)
+            streamed_files = stager.scan(with_fingerprints=run_id is not None)
+            logger.info(
+                "Streaming count=%s files to bulk ingest",
+                len(streamed_files.file_names),
+            )
+            self.ingest_component.add_listener(stager.on_event)
+            try:
+                return self.bulk_ingest_report(streamed_files, run_id)
+            finally:
+                self.ingest_component.remove_listener(stager.on_event)
+                stager.close()
+
+    def bulk_ingest_report(
+        self,
+        files: list[tuple[str, Path]] | StreamedFiles,
+        run_id: str | None = None,
+    ) -> list[IngestFileReport]:
+        """Same as `bulk_ingest`, with a report of the outcome of each file.
+
+        :raises DuplicateFileNameError: if several files have the same name
+        """
+        all_file_names = _file_names(files)
+        file_names = set(all_file_names)
+        if len(file_names) < len(all_file_names):
+            duplicates = [
+                name
+                for name, count in collections.Counter(all_file_names).items()
+                if count > 1
+            ]
+            # The documents and the events are matched to the files by name
+            raise DuplicateFileNameError(f"Duplicate file names: {duplicates}")
+        errors: dict[str, str] = {}
+        skipped: set[str] = set()
+        errors_lock = threading.Lock()
+
+        def collect_failures(event: IngestEvent) -> None:
+            if event.stage == "fail":
+                with errors_lock:
+                    for file_name in file_names.intersection(event.file_names):
+                        errors[file_name] = event.error or "Failed to ingest the file"
+            elif event.stage == "skip":
+                with errors_lock:
+                    skipped.update(file_names.intersection(event.file_names))
+
+        self.ingest_component.add_listener(collect_failures)
+        try:
+            documents = self.bulk_ingest(files, run_id=run_id)
+        except Exception as e:
+            logger.warning("Bulk ingestion failed", exc_info=True)
+            return [
+                IngestFileReport(
+                    object="ingest.file",
+                    file_name=file_name,
+                    status="failed",
+                    documents=[],
+                    error=str(e),
+                )
+                for file_name in all_file_names
+            ]
+        finally:
+            self.ingest_component.remove_listener(collect_failures)
+
+        documents_by_file: dict[str, list[IngestedDoc]] = {
+            file_name: [] for file_name in all_file_names
+        }
+        for document in documents:
+            file_name = (document.doc_metadata or {}).get("file_name")
+            if file_name in documents_by_file:
+                documents_by_file[file_name].append(document)
+        return [
+            IngestFileReport(
+                object="ingest.file",
+                file_name=file_name,
+                status=(
+                    "failed"
+                    if file_name in errors
+                    # Already ingested by a previous attempt of the run
+                    else (
+                        "skipped"
+                        if file_name in skipped and not file_documents
+                        else "ingested"
+                    )
+                ),
+                documents=file_documents,
+                error=errors.get(file_name),
+            )
+            for file_name, file_documents in documents_by_file.items()
+        ]
+
+    def running(self) -> list[IngestRunProgress]:
+        """Progress of each stage of the bulk ingestions running, in any of the
+        API processes."""
+        return [
+            IngestRunProgress(
+                object="ingest.run",
+                run_id=run_id,
+                started_at=datetime.fromtimestamp(run.started_at, tz=timezone.utc),
+                progress={
+                    stage: IngestStageProgress.from_stage_progress(progress)
+                    for stage, progress in run.stages.items()
+                },
+            )
+            for run_id, run in self.ingest_component.running().items()
+        ]
+
     def list_ingested(self) -> list[IngestedDoc]:
         ingested_docs: list[IngestedDoc] = []
         try:
@@ -164,6 +550,31 @@ class IngestService:
         )
         self.ingest_component.delete(doc_id)
 
+    def delete_many(self, doc_ids: list[str]) -> list[str]:
+        """Delete many ingested documents at once, return the deleted IDs.
+
+        Unknown IDs are ignored.
+        """
+        logger.info("Deleting count=%s ingested documents", len(doc_ids))
+        return self.ingest_component.delete_many(doc_ids)
+
+    def delete_by_file(self, file_name: str) -> list[str]:
+        """Delete all the documents of an ingested file, return the deleted IDs."""
+        return self.delete_by_files([file_name])
+
+    def delete_by_files(
+        self, file_names: list[str], run_id: str | None = None
+    ) -> list[str]:
+        """Delete all the documents of many ingested files at once.
+
+        With a `run_id`, the files are forgotten by the checkpoint of the run
+        too, so that they are ingested again by the run, even if unchanged.
+        """
+        if run_id is not None:
+            self.ingest_component.forget_checkpoint(run_id, file_names)
+        logger.info("Deleting the documents of count=%s files", len(file_names))
+        return self.ingest_component.delete_files(file_names)
+
 
 @lru_cache
 def get_ingest_service() -> IngestService:
@@ -0,0 +1,253 @@
+import tempfile
+import threading
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from functools import lru_cache
+from pathlib import Path
+from typing import BinaryIO, Literal
+
+import structlog.stdlib
+from pydantic import BaseModel, Field
+from redis import Redis
+
+from app.config.settings import (
+    EmbeddingSettings,
+    RedisSettings,
+    get_embeddings_settings,
+    get_redis_settings,
+)
+from app.dependencies.components.eta import ProgressTracker
+from app.dependencies.components.ingest import PROGRESS_STAGES, IngestEvent
+from app.dependencies.services.ingest import (
+    IngestedDoc,
+    IngestService,
+    IngestStageProgress,
+    get_ingest_service,
+)
+
+logger = structlog.stdlib.get_logger(__name__)
+
+_JOB_KEY_PREFIX = "ingest:job:"
+# Sorted set of the job IDs, by creation time
+_JOBS_KEY = "ingest:jobs"
+
+
+class IngestJobQueueFullError(Exception):
+    """Raised when too many ingest jobs are waiting to be processed."""
+
+
+class IngestJob(BaseModel):
+    object: Literal["ingest.job"]
+    job_id: str = Field(examples=["3f1c7a0e-2d6a-4c1b-9a41-5d0a3c2f1b7e"])
+    status: Literal["queued", "running", "completed", "failed"]
+    file_names: list[str] = Field(examples=[["Sales Report Q3 2023.pdf"]])
+    created_at: datetime
+    started_at: datetime | None = None
+    finished_at: datetime | None = None
+    progress: dict[str, IngestStageProgress]
+    data: list[IngestedDoc] | None = None
+    error: str | None = None
+
+
+class _Job:
+    """State of a job run by this process, only accessed holding the service lock.
+
+    Except for `progress`, which has a lock of its own: it is fed by the
+    ingest events, from the ingestion threads.
+    """
+
+    def __init__(self, file_names: list[str]) -> None:
+        self.job_id = str(uuid.uuid4())
+        self.status: Literal["queued", "running", "completed", "failed"] = "queued"
+        self.file_names = file_names
+        self.created_at = datetime.now(tz=timezone.utc)
+        self.started_at: datetime | None = None
+        self.finished_at: datetime | None = None
+        self.data: list[IngestedDoc] | None = None
+        self.error: str | None = None
+        self.progress = ProgressTracker(file_names, PROGRESS_STAGES)
+
+    def to_model(self) -> IngestJob:
+        progress = {
+            stage: IngestStageProgress.from_stage_progress(stage_progress)
+            for stage, stage_progress in self.progress.snapshot().items()
+        }
+        return IngestJob(
+            object="ingest.job",
+            job_id=self.job_id,
+            status=self.status,
+            file_names=self.file_names,
+            created_at=self.created_at,
+            started_at=self.started_at,
+            finished_at=self.finished_at,
+            progress=progress,
+            data=self.data,
+            error=self.error,
+        )
+
+
+class IngestJobService:
+    """Run ingestions in background jobs, and track their progress.
+
+    Uploaded data is staged in temporary files, and the jobs are run by a
+    bounded pool of worker threads through the `IngestService`. The progress
+    of each stage is fed by the events of the ingest component.
+
+    A job runs in the API process that accepted it, but its state is written
+    to Redis (expiring after `ingest_job_ttl` seconds) on every change, so any
+    process can return it. The queue size limit is the one of each process.
+
+    Events are matched to jobs by file name, so two jobs running concurrently
+    with the same file name share their progress.
+    """
+
+    def __init__(
+        self,
+        ingest_service: IngestService = get_ingest_service(),
+        embed_settings: EmbeddingSettings = get_embeddings_settings(),
+        redis_settings: RedisSettings = get_redis_settings(),
+        redis_client: Redis | None = None,
+    ) -> None:
+        self.ingest_service = ingest_service
+        self.queue_size = embed_settings.ingest_job_queue_size
+        self.history_size = embed_settings.ingest_job_history
+        self.ttl = embed_settings.ingest_job_ttl
+        self._redis = redis_client or Redis.from_url(str(redis_settings.dsn))
+        self._lock = threading.Lock()
+        self._publish_lock = threading.Lock()
+        # Jobs of this process, until they are finished
+        self._jobs: dict[str, _Job] = {}
+        self._running: list[_Job] = []
+        self._executor = ThreadPoolExecutor(
+            max_workers=embed_settings.ingest_job_workers,
+            thread_name_prefix="ingest-job",
+        )
+        ingest_service.ingest_component.add_listener(self._on_ingest_event)
+
+    def submit_bin_data(self, file_name: str, raw_file_data: BinaryIO) -> IngestJob:
+        logger.debug("Staging binary data with file_name=%s", file_name)
+        with tempfile.NamedTemporaryFile(delete=False) as tmp:
+            while chunk := raw_file_data.read(1024 * 1024):
+                tmp.write(chunk)
+        return self.submit_files([(file_name, Path(tmp.name))])
+
+    def submit_text(self, file_name: str, text: str) -> IngestJob:
+        logger.debug("Staging text data with file_name=%s", file_name)
+        with tempfile.NamedTemporaryFile(delete=False) as tmp:
+            tmp.write(text.encode())
+        return self.submit_files([(file_name, Path(tmp.name))])
+
+    def submit_files(self, files: list[tuple[str, Path]]) -> IngestJob:
+        """Submit staged files, which are deleted once the job is finished.
+
+        :raises IngestJobQueueFullError: if too many jobs are already queued
+        """
+        job = _Job([file_name for file_name, _ in files])
+        with self._lock:
+            queued = sum(1 for j in self._jobs.values() if j.status == "queued")
+            if queued >= self.queue_size:
+                for _, file_data in files:
+                    file_data.unlink(missing_ok=True)
+                raise IngestJobQueueFullError(
+                    f"Too many ingest jobs waiting, count={queued}"
+                )
+            self._jobs[job.job_id] = job
+            model = job.to_model()
+        self._redis.zadd(_JOBS_KEY, {job.job_id: job.created_at.timestamp()})
+        self._publish(model)
+        self._forget_finished_jobs()
+        logger.info("Submitted ingest job=%s", job.job_id, file_names=job.file_names)
+        self._executor.submit(self._run, job, files)
+        return model
+
+    def get(self, job_id: str) -> IngestJob | None:
+        data = self._redis.get(_JOB_KEY_PREFIX + job_id)
+        return IngestJob.model_validate_json(data) if data is not None else None
+
+    def list_jobs(self) -> list[IngestJob]:
+        """The jobs of all the processes, by creation time."""
+        job_ids = [job_id.decode() for job_id in self._redis.zrange(_JOBS_KEY, 0, -1)]
+        if not job_ids:
+            return []
+        jobs = []
+        expired_job_ids = []
+        for job_id, data in zip(
+            job_ids, self._redis.mget([_JOB_KEY_PREFIX + i for i in job_ids])
+        ):
+            if data is None:
+                expired_job_ids.append(job_id)
+            else:
+                jobs.append(IngestJob.model_validate_json(data))
+        if expired_job_ids:
+            self._redis.zrem(_JOBS_KEY, *expired_job_ids)
+        return jobs
+
+    def _publish(self, job: IngestJob) -> None:
+        self._redis.set(
+            _JOB_KEY_PREFIX + job.job_id, job.model_dump_json(), ex=self.ttl
+        )
+
+    def _update(self, job: _Job) -> None:
+        # Serialized, so that a late progress update doesn't overwrite the end
+        with self._publish_lock:
+            with self._lock:
+                model = job.to_model()
+            self._publish(model)
+
+    def _forget_finished_jobs(self) -> None:
+        jobs = self.list_jobs()
+        finished = [job.job_id for job in jobs if job.status in ("completed", "failed")]
+        forgotten = finished[: max(len(jobs) - self.history_size, 0)]
+        if forgotten:
+            self._redis.delete(*[_JOB_KEY_PREFIX + job_id for job_id in forgotten])
+            self._redis.zrem(_JOBS_KEY, *forgotten)
+
+    def _run(self, job: _Job, files: list[tuple[str, Path]]) -> None:
+        with self._lock:
+            job.status = "running"
+            job.started_at = datetime.now(tz=timezone.utc)
+            self._running.append(job)
+        self._update(job)
+        try:
+            if len(files) == 1:
+                documents = self.ingest_service.ingest_file(*files[0])
+            else:
+                documents = self.ingest_service.bulk_ingest(files)
+            with self._lock:
+                job.status = "completed"
+                job.data = documents
+                # E.g. files without text are not embedded nor persisted
+                job.progress.stop(job.file_names)
+        except Exception as e:
+            logger.warning("Ingest job=%s failed", job.job_id, exc_info=True)
+            with self._lock:
+                job.status = "failed"
+                job.error = "".join(traceback.format_exception_only(e)).strip()
+        finally:
+            with self._lock:
+                job.finished_at = datetime.now(tz=timezone.utc)
+                self._running.remove(job)
+                del self._jobs[job.job_id]
+            self._update(job)
+            for _, file_data in files:
+                file_data.unlink(missing_ok=True)
+
+    def _on_ingest_event(self, event: IngestEvent) -> None:
+        with self._lock:
+            running = list(self._running)
+        # Files which are not part of a job are ignored by its progress
+        for job in running:
+            if not set(event.file_names) & set(job.file_names):
+                continue
+            if event.stage in PROGRESS_STAGES:
+                job.progress.advance(event.stage, event.file_names)
+            elif event.stage in ("fail", "skip"):
+                job.progress.stop(event.file_names)
+            self._update(job)
+
+
+@lru_cache
+def get_ingest_job_service() -> IngestJobService:
+    return IngestJobService()
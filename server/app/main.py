@@ -1,3 +1,4 @@
+import asyncio
 from contextlib import asynccontextmanager
 
 import structlog.stdlib
@@ -5,12 +6,18 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from app.config.logging import setup_fastapi, setup_logging
-from app.config.settings import AppSettings, get_app_settings
+from app.config.settings import (
+    AppSettings,
+    get_app_settings,
+    get_embeddings_settings,
+)
+from app.dependencies.components import get_retrieval_component
 from app.dependencies.database import close_mongo_connection, connect_to_mongo
 from app.dependencies.session import RedisClient
 from app.routes.auth import router as auth_router
 from app.routes.chat import chat_router
 from app.routes.ingest import router as ingest_router
+from app.routes.metrics import metrics_router
 from app.routes.users import router as users_router
 
 logger = structlog.stdlib.get_logger(__name__)
@@ -20,7 +27,18 @@ logger = structlog.stdlib.get_logger(__name__)
 async def lifespan(app: FastAPI):
     db_client = await connect_to_mongo()
     red = RedisClient()
+    # Built once and shared by the requests, warmed up before serving them
+    await asyncio.to_thread(get_retrieval_component().warm_up)
+    folder_sync = None
+    if get_embeddings_settings().watch_folder is not None:
+        # Imported here, it loads the models of the ingest service
+        from app.dependencies.services.folder_sync import get_folder_sync_service
+
+        folder_sync = get_folder_sync_service()
+        folder_sync.start()
     yield
+    if folder_sync is not None:
+        folder_sync.stop()
     await close_mongo_connection(db_client)
     await red.close()
 
@@ -48,5 +66,6 @@ def init_app(app_settings: AppSettings = get_app_settings()):
     fast_app.include_router(users_router)
     fast_app.include_router(ingest_router)
     fast_app.include_router(chat_router)
+    fast_app.include_router(metrics_router)
 
     return fast_app
@@ -13,3 +13,18 @@ models_path: Path = PROJECT_ROOT_PATH / "llm"
 models_cache_path: Path = models_path / "cache"
 docs_path: Path = PROJECT_ROOT_PATH / "docs"
 local_data_path: Path = _absolute_or_from_project_root("local_data/private_gpt")
+embedding_cache_path: Path = _absolute_or_from_project_root(
+    "local_data/embedding_cache.sqlite3"
+)
+ingest_checkpoint_path: Path = _absolute_or_from_project_root(
+    "local_data/ingest_checkpoints.sqlite3"
+)
+folder_sync_state_path: Path = _absolute_or_from_project_root(
+    "local_data/folder_sync.sqlite3"
+)
+dedup_index_path: Path = _absolute_or_from_project_root(
+    "local_data/dedup_index.sqlite3"
+)
+local_vector_store_path: Path = _absolute_or_from_project_root(
+    "local_data/vector_store"
+)
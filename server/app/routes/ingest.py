@@ -1,13 +1,25 @@
+import tarfile
+import zipfile
 from typing import Annotated, Literal
 
-from fastapi import APIRouter, Depends, HTTPException, Request, UploadFile
+from fastapi import APIRouter, Depends, HTTPException, Request, UploadFile, status
 from pydantic import BaseModel, Field
 
 from app.dependencies.services.ingest import (
+    BulkIngestLimitError,
+    DuplicateFileNameError,
     IngestedDoc,
+    IngestFileReport,
+    IngestRunProgress,
     IngestService,
     get_ingest_service,
 )
+from app.dependencies.services.ingest_jobs import (
+    IngestJob,
+    IngestJobQueueFullError,
+    IngestJobService,
+    get_ingest_job_service,
+)
 
 router = APIRouter(prefix="/api/v1")
 
@@ -24,12 +36,41 @@ class IngestTextBody(BaseModel):
     )
 
 
+class DeleteIngestedBody(BaseModel):
+    doc_ids: list[str] | None = Field(
+        default=None, examples=[["c202d5e6-7b69-4869-81cc-dd574ee8ee11"]]
+    )
+    file_name: str | None = Field(default=None, examples=["Sales Report Q3 2023.pdf"])
+
+
+class DeleteIngestedResponse(BaseModel):
+    object: Literal["list"]
+    model: Literal["private-gpt"]
+    data: list[str]
+
+
 class IngestResponse(BaseModel):
     object: Literal["list"]
     model: Literal["private-gpt"]
     data: list[IngestedDoc]
 
 
+class BulkIngestResponse(BaseModel):
+    object: Literal["list"]
+    model: Literal["private-gpt"]
+    data: list[IngestFileReport]
+
+
+class IngestRunListResponse(BaseModel):
+    object: Literal["list"]
+    data: list[IngestRunProgress]
+
+
+class IngestJobListResponse(BaseModel):
+    object: Literal["list"]
+    data: list[IngestJob]
+
+
 @router.post("/ingest", tags=["Ingestion"], deprecated=True)
 def ingest(request: Request, file: UploadFile) -> IngestResponse:
     """Ingests and processes a file.
@@ -87,9 +128,130 @@ def ingest_text(
     return IngestResponse(object="list", model="private-gpt", data=ingested_documents)
 
 
+@router.post("/ingest/bulk", tags=["Ingestion"])
+def bulk_ingest(
+    service: Annotated[IngestService, Depends(get_ingest_service)],
+    files: list[UploadFile],
+    run_id: str | None = None,
+) -> BulkIngestResponse:
+    """Ingests many files at once, storing their chunks to be used as context.
+
+    Files can be uploaded as is, or packed in `.zip` and `.tar` (optionally
+    compressed) archives, which are unpacked member by member. All the files
+    are ingested together, which is much faster than one file per request
+    with the `batch`, `parallel` and `pipeline` ingest modes.
+
+    The response has one report per file (archive members are named after
+    their path in the archive), with its status and its ingested Documents.
+    The names of the files must be unique.
+
+    When a `run_id` is given, the progress of each file is checkpointed. If
+    the ingestion is interrupted, uploading the same files with the same
+    `run_id` resumes it: the files already ingested are `skipped`.
+    """
+
+    if any(file.filename is None for file in files):
+        raise HTTPException(400, "No file name provided")
+    try:
+        reports = service.bulk_ingest_bin_data(
+            [(file.filename, file.file) for file in files],  # type: ignore[misc]
+            run_id=run_id,
+        )
+    except (
+        BulkIngestLimitError,
+        DuplicateFileNameError,
+        tarfile.TarError,
+        zipfile.BadZipFile,
+    ) as e:
+        raise HTTPException(400, str(e)) from e
+    return BulkIngestResponse(object="list", model="private-gpt", data=reports)
+
+
+@router.post(
+    "/ingest/jobs/file", tags=["Ingestion"], status_code=status.HTTP_202_ACCEPTED
+)
+def submit_ingest_file_job(
+    service: Annotated[IngestJobService, Depends(get_ingest_job_service)],
+    file: UploadFile,
+) -> IngestJob:
+    """Submits a file to be ingested in background, and returns the created job.
+
+    Same as `/ingest/file`, but the request returns as soon as the file is
+    uploaded. The job can be polled with `/ingest/jobs/{job_id}`, which reports
+    the progress of each ingestion stage (parse, embed and persist) and, once
+    completed, the ingested Documents.
+    """
+
+    if file.filename is None:
+        raise HTTPException(400, "No file name provided")
+    try:
+        return service.submit_bin_data(file.filename, file.file)
+    except IngestJobQueueFullError as e:
+        raise HTTPException(status.HTTP_429_TOO_MANY_REQUESTS, str(e)) from e
+
+
+@router.post(
+    "/ingest/jobs/text", tags=["Ingestion"], status_code=status.HTTP_202_ACCEPTED
+)
+def submit_ingest_text_job(
+    service: Annotated[IngestJobService, Depends(get_ingest_job_service)],
+    body: IngestTextBody,
+) -> IngestJob:
+    """Submits a text to be ingested in background, and returns the created job.
+
+    Same as `/ingest/text`, but the request returns right away. The job can be
+    polled with `/ingest/jobs/{job_id}`.
+    """
+
+    if len(body.file_name) == 0:
+        raise HTTPException(400, "No file name provided")
+    try:
+        return service.submit_text(body.file_name, body.text)
+    except IngestJobQueueFullError as e:
+        raise HTTPException(status.HTTP_429_TOO_MANY_REQUESTS, str(e)) from e
+
+
+@router.get("/ingest/jobs", tags=["Ingestion"])
+def list_ingest_jobs(
+    service: Annotated[IngestJobService, Depends(get_ingest_job_service)],
+) -> IngestJobListResponse:
+    """Lists the queued, running and recently finished ingest jobs."""
+
+    return IngestJobListResponse(object="list", data=service.list_jobs())
+
+
+@router.get("/ingest/jobs/{job_id}", tags=["Ingestion"])
+def get_ingest_job(
+    service: Annotated[IngestJobService, Depends(get_ingest_job_service)],
+    job_id: str,
+) -> IngestJob:
+    """Gets the status and progress of an ingest job."""
+
+    job = service.get(job_id)
+    if job is None:
+        raise HTTPException(404, "Ingest job not found")
+    return job
+
+
+@router.get("/ingest/progress", tags=["Ingestion"])
+def list_running_ingestions(
+    service: Annotated[IngestService, Depends(get_ingest_service)],
+) -> IngestRunListResponse:
+    """Lists the bulk ingestions running, with the progress of each stage.
+
+    Bulk ingestions run by `/ingest/bulk`, by ingest jobs and by the folder
+    sync are reported, by run ID (a random one when none was given), whichever
+    API process runs them. Each of
+    the parse, embed and persist stages reports its count of files done, its
+    throughput and an estimate of the time left.
+    """
+
+    return IngestRunListResponse(object="list", data=service.running())
+
+
 @router.get("/ingest/list", tags=["Ingestion"])
 def list_ingested(
-    service: Annotated[IngestService, Depends(get_ingest_service)]
+    service: Annotated[IngestService, Depends(get_ingest_service)],
 ) -> IngestResponse:
     """Lists already ingested Documents including their Document ID and metadata.
 
@@ -111,3 +273,27 @@ def delete_ingested(
     The document will be effectively deleted from your storage context.
     """
     service.delete(doc_id)
+
+
+@router.post("/ingest/delete", tags=["Ingestion"])
+def delete_many_ingested(
+    service: Annotated[IngestService, Depends(get_ingest_service)],
+    body: DeleteIngestedBody,
+) -> DeleteIngestedResponse:
+    """Delete many ingested Documents at once.
+
+    Either give the `doc_ids` to delete, as obtained from the `GET /ingest/list`
+    endpoint, or a `file_name` to delete all the Documents of that file (for
+    example all the pages of a PDF). The deletion is done in a single batch.
+
+    The response contains the IDs of the deleted Documents, unknown IDs are ignored.
+    """
+    if (body.doc_ids is None) == (body.file_name is None):
+        raise HTTPException(400, "Exactly one of doc_ids or file_name is required")
+    if body.file_name is not None:
+        deleted_doc_ids = service.delete_by_file(body.file_name)
+    else:
+        deleted_doc_ids = service.delete_many(body.doc_ids)  # type: ignore[arg-type]
+    return DeleteIngestedResponse(
+        object="list", model="private-gpt", data=deleted_doc_ids
+    )
@@ -0,0 +1,21 @@
+from typing import Annotated
+
+from fastapi import APIRouter, Depends
+from fastapi.responses import PlainTextResponse
+
+from app.dependencies.components.metrics import MetricsRegistry, get_metrics_registry
+
+metrics_router = APIRouter()
+
+
+@metrics_router.get("/metrics", tags=["Metrics"], response_class=PlainTextResponse)
+def metrics(
+    registry: Annotated[MetricsRegistry, Depends(get_metrics_registry)],
+) -> PlainTextResponse:
+    """Metrics of this process, in the Prometheus text format.
+
+    Reports the ingestion queue depths, the time spent in each stage (parse,
+    embed, insert, persist), the busy workers and the count of files per
+    outcome. Each API worker process has its own metrics.
+    """
+    return PlainTextResponse(registry.render(), media_type=registry.CONTENT_TYPE)
@@ -0,0 +1,94 @@
+"""Compare the ONNX embedding backend with the PyTorch (HuggingFace) one.
+
+Embeds the same synthetic corpus with each backend, then reports their
+throughput in vectors per second and the cosine similarity of the ONNX
+vectors to the PyTorch ones (1.0 means no drift).
+
+    python -m development.export_onnx
+    python -m development.benchmark_embedding --texts 512 --batch-size 32
+"""
+
+import argparse
+import random
+import time
+
+import numpy as np
+from llama_index.core.embeddings import BaseEmbedding
+
+from app.config.settings import get_app_settings, get_embeddings_settings
+from app.dependencies.components.onnx_embedding import OnnxEmbedding
+from app.paths import PROJECT_ROOT_PATH, models_cache_path
+
+WORDS = (
+    "the index stores nodes embedded by a model and retrieved by similarity "
+    "while documents are parsed into sentences split with a window of context "
+    "queries are answered from the most relevant chunks of the ingested files"
+).split()
+
+
+def make_texts(count: int, seed: int = 0) -> list[str]:
+    rng = random.Random(seed)
+    # Lengths spread like the chunks of the sentence splitter
+    return [" ".join(rng.choices(WORDS, k=rng.randint(16, 256))) for _ in range(count)]
+
+
+def run(
+    embed_model: BaseEmbedding, texts: list[str], batch_size: int
+) -> tuple[np.ndarray, float]:
+    # Warm up, not to measure the first run allocations
+    embed_model.get_text_embedding_batch(texts[:batch_size])
+    start = time.perf_counter()
+    embeddings = []
+    for i in range(0, len(texts), batch_size):
+        embeddings.extend(embed_model._get_text_embeddings(texts[i : i + batch_size]))
+    return np.array(embeddings), len(texts) / (time.perf_counter() - start)
+
+
+def main() -> None:
+    embed_settings = get_embeddings_settings()
+    model_name = get_app_settings().embedding_hf_model_name
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--texts", type=int, default=512)
+    parser.add_argument("--batch-size", type=int, default=32)
+    args = parser.parse_args()
+    texts = make_texts(args.texts)
+
+    from llama_index.embeddings.huggingface import HuggingFaceEmbedding  # type: ignore
+
+    backends: dict[str, BaseEmbedding] = {
+        "pytorch": HuggingFaceEmbedding(
+            model_name=model_name,
+            cache_folder=str(models_cache_path),
+            # Not to split the batches of the benchmark
+            embed_batch_size=args.batch_size,
+        )
+    }
+    for quantized in (False, True):
+        try:
+            backends["onnx-int8" if quantized else "onnx"] = OnnxEmbedding(
+                model_path=PROJECT_ROOT_PATH / embed_settings.onnx_model_path,
+                model_name=model_name,
+                quantized=quantized,
+                intra_op_threads=embed_settings.onnx_intra_op_threads,
+                inter_op_threads=embed_settings.onnx_inter_op_threads,
+            )
+        except FileNotFoundError as e:
+            print(f"Skipping: {e}")
+
+    reference = None
+    for name, embed_model in backends.items():
+        embeddings, vectors_per_second = run(embed_model, texts, args.batch_size)
+        line = f"{name:>9}: {vectors_per_second:8.1f} vectors/s"
+        if reference is None:
+            reference = embeddings
+        else:
+            # The vectors are normalized, the cosine is the dot product
+            cosine = (embeddings * reference).sum(axis=1)
+            line += (
+                f", cosine to pytorch mean {cosine.mean():.5f} min {cosine.min():.5f}"
+            )
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+"""Measure the ingestion throughput of each ingest mode on a synthetic corpus.
+
+Generates a corpus of text, markdown, PDF and CSV files, then ingests it with
+each ingest component, each in a fresh interpreter with in-memory stores and
+a mock embedding model answering after a fixed latency. Reports files/s,
+nodes/s, peak resident memory and the time spent in each stage, as reported
+by the ingest events (stages overlap in the parallel modes).
+
+    python -m development.benchmark_ingest --files 200 --workers 4
+    python -m development.benchmark_ingest --modes simple pipeline --latency-ms 20
+"""
+
+import argparse
+import json
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+MODES = ("simple", "batch", "parallel", "pipeline")
+FORMATS = ("txt", "md", "pdf", "csv")
+
+WORDS = (
+    "index node document embedding vector query retrieval context window "
+    "sentence chunk parser store model batch latency throughput memory token "
+    "file page table column value answer question search similarity score"
+).split()
+
+
+def _sentences(rng: random.Random, count: int) -> list[str]:
+    return [
+        " ".join(rng.choices(WORDS, k=rng.randint(8, 24))).capitalize() + "."
+        for _ in range(count)
+    ]
+
+
+def _make_pdf(pages: list[str]) -> bytes:
+    # Smallest valid PDF with one line of Helvetica text per page
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        "",
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    kids = []
+    for text in pages:
+        stream = f"BT /F1 10 Tf 36 720 Td ({text}) Tj ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(
+            "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>"
+        )
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+
+    pdf = b"%PDF-1.4\n"
+    offsets = []
+    for number, pdf_object in enumerate(objects, 1):
+        offsets.append(len(pdf))
+        pdf += f"{number} 0 obj\n{pdf_object}\nendobj\n".encode()
+    xref_offset = len(pdf)
+    pdf += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    pdf += b"".join(f"{offset:010d} 00000 n \n".encode() for offset in offsets)
+    pdf += (
+        f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\n"
+        f"startxref\n{xref_offset}\n%%EOF\n"
+    ).encode()
+    return pdf
+
+
+def make_corpus(
+    path: Path, count_files: int, formats: list[str], paragraphs: int, seed: int = 0
+) -> list[Path]:
+    """Write `count_files` files, evenly spread over the formats."""
+    rng = random.Random(seed)
+    path.mkdir(parents=True, exist_ok=True)
+    files = []
+    for i in range(count_files):
+        file_format = formats[i % len(formats)]
+        file_path = path / f"file_{i:05d}.{file_format}"
+        if file_format == "txt":
+            file_path.write_text(
+                "\n\n".join(" ".join(_sentences(rng, 5)) for _ in range(paragraphs))
+            )
+        elif file_format == "md":
+            file_path.write_text(
+                "\n\n".join(
+                    f"## Section {section}\n\n" + " ".join(_sentences(rng, 5))
+                    for section in range(paragraphs)
+                )
+            )
+        elif file_format == "pdf":
+            file_path.write_bytes(
+                _make_pdf([" ".join(_sentences(rng, 5)) for _ in range(paragraphs)])
+            )
+        elif file_format == "csv":
+            rows = [
+                f"{row},{rng.choice(WORDS)},{rng.random():.4f},{_sentences(rng, 1)[0]}"
+                for row in range(paragraphs * 5)
+            ]
+            file_path.write_text("id,name,value,description\n" + "\n".join(rows))
+        files.append(file_path)
+    return files
+
+
+def run_mode(
+    mode: str, corpus_path: Path, workers: int, latency: float, batch_size: int
+) -> dict:
+    """Ingest the corpus with one ingest mode, in this interpreter."""
+    import resource
+
+    from llama_index.core.embeddings import MockEmbedding
+    from llama_index.core.node_parser import SentenceSplitter
+    from llama_index.core.storage import StorageContext
+
+    from app.config.settings import get_embeddings_settings
+    from app.dependencies.components.ingest import (
+        BatchIngestComponent,
+        IngestEvent,
+        ParallelizedIngestComponent,
+        PipelineIngestComponent,
+        SimpleIngestComponent,
+    )
+
+    class FixedLatencyEmbedding(MockEmbedding):
+        """Mock embedding taking `latency` seconds per batch, like a real model."""
+
+        def _get_text_embeddings(self, texts: list[str]) -> list[list[float]]:
+            time.sleep(latency)
+            return [self._get_vector() for _ in texts]
+
+        def _get_text_embedding(self, text: str) -> list[float]:
+            return self._get_text_embeddings([text])[0]
+
+    embed_settings = get_embeddings_settings().model_copy(
+        update={"count_workers": workers}
+    )
+    embed_model = FixedLatencyEmbedding(embed_dim=384, embed_batch_size=batch_size)
+    stage_seconds: dict[str, float] = defaultdict(float)
+    stage_counts: dict[str, int] = defaultdict(int)
+
+    def on_event(event: IngestEvent) -> None:
+        stage_seconds[event.stage] += event.seconds
+        stage_counts[event.stage] += (
+            len(event.file_names) if event.stage == "fail" else event.count
+        )
+
+    files = [(path.name, path) for path in sorted(corpus_path.iterdir())]
+    with tempfile.TemporaryDirectory() as persist_dir:
+        kwargs = {} if mode == "simple" else {"count_workers": workers}
+        component_cls = {
+            "simple": SimpleIngestComponent,
+            "batch": BatchIngestComponent,
+            "parallel": ParallelizedIngestComponent,
+            "pipeline": PipelineIngestComponent,
+        }[mode]
+        component = component_cls(
+            storage_context=StorageContext.from_defaults(),
+            embed_model=embed_model,
+            transformations=[SentenceSplitter(), embed_model],
+            persist_dir=Path(persist_dir),
+            checkpoint_path=Path(persist_dir) / "ingest_checkpoints.sqlite3",
+            embed_settings=embed_settings,
+            **kwargs,
+        )
+        # Start the parser processes first, they are long-lived in the API
+        warmup_file = Path(persist_dir) / "warmup.txt"
+        warmup_file.write_text("warmup")
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(
+                executor.map(
+                    lambda _: component._parser_pool.parse(
+                        warmup_file.name, warmup_file
+                    ),
+                    range(workers),
+                )
+            )
+        component.add_listener(on_event)
+        start = time.perf_counter()
+        component.bulk_ingest(files)
+        seconds = time.perf_counter() - start
+        component.close()
+
+    return {
+        "seconds": seconds,
+        "files_per_second": len(files) / seconds,
+        "nodes_per_second": stage_counts["embed"] / seconds,
+        "nodes": stage_counts["embed"],
+        "failed_files": stage_counts["fail"],
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        # The parser processes, stopped by `close`
+        "parser_peak_rss_mb": (
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+        ),
+        "stage_seconds": dict(stage_seconds),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=100)
+    parser.add_argument("--paragraphs", type=int, default=20, help="per file")
+    parser.add_argument("--formats", nargs="+", choices=FORMATS, default=FORMATS)
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=MODES)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--latency-ms", type=float, default=10.0, help="per batch")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--corpus", type=Path, help="reuse this corpus directory")
+    # Internal: run one mode in this interpreter and print its results
+    parser.add_argument("--run-mode", choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_mode:
+        result = run_mode(
+            args.run_mode,
+            args.corpus,
+            args.workers,
+            args.latency_ms / 1000,
+            args.batch_size,
+        )
+        print(json.dumps(result))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        corpus_path = args.corpus or Path(tmp_dir) / "corpus"
+        if not corpus_path.exists():
+            make_corpus(corpus_path, args.files, args.formats, args.paragraphs)
+        count_files = sum(1 for _ in corpus_path.iterdir())
+        print(
+            f"{count_files} files, {args.workers} workers, "
+            f"{args.latency_ms:g} ms per batch of {args.batch_size}"
+        )
+        for mode in args.modes:
+            # A fresh interpreter per mode, for a peak RSS of its own
+            output = subprocess.run(
+                [
+                    sys.executable,
+                    "-m",
+                    "development.benchmark_ingest",
+                    "--run-mode",
+                    mode,
+                    "--corpus",
+                    str(corpus_path),
+                    "--workers",
+                    str(args.workers),
+                    "--latency-ms",
+                    str(args.latency_ms),
+                    "--batch-size",
+                    str(args.batch_size),
+                ],
+                check=True,
+                capture_output=True,
+                text=True,
+            ).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            stages = ", ".join(
+                f"{stage} {seconds:.2f}s"
+                for stage, seconds in result["stage_seconds"].items()
+            )
+            print(
+                f"{mode:>8}: {result['files_per_second']:7.1f} files/s, "
+                f"{result['nodes_per_second']:8.1f} nodes/s, "
+                f"peak RSS {result['peak_rss_mb']:.0f} MB "
+                f"(parsers {result['parser_peak_rss_mb']:.0f} MB), "
+                f"{result['failed_files']} failed ({stages})"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Compare the startup cost of the lazy reader registry with eager imports.
+
+Each scenario runs in a fresh interpreter, which imports the ingestion helper
+(as every API worker does), optionally imports all the readers up front (the
+previous behaviour), then reports its import time and peak resident memory.
+
+    python -m development.benchmark_startup --runs 5
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+SCENARIO = """
+import json, resource, time
+start = time.perf_counter()
+from app.dependencies.components.ingest_helper import FILE_READER_CLS
+if {eager}:
+    FILE_READER_CLS.preload()
+seconds = time.perf_counter() - start
+rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+print(json.dumps({{"seconds": seconds, "rss_mb": rss_mb}}))
+"""
+
+
+def run_scenario(eager: bool) -> dict[str, float]:
+    output = subprocess.run(
+        [sys.executable, "-c", SCENARIO.format(eager=eager)],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    results = {}
+    for name, eager in (("eager", True), ("lazy", False)):
+        runs = [run_scenario(eager) for _ in range(args.runs)]
+        results[name] = {
+            "seconds": statistics.median(run["seconds"] for run in runs),
+            "rss_mb": statistics.median(run["rss_mb"] for run in runs),
+        }
+        print(
+            f"{name:>5}: import {results[name]['seconds']:.2f}s, "
+            f"peak RSS {results[name]['rss_mb']:.0f} MB (median of {args.runs})"
+        )
+
+    saved_seconds = results["eager"]["seconds"] - results["lazy"]["seconds"]
+    saved_mb = results["eager"]["rss_mb"] - results["lazy"]["rss_mb"]
+    print(f"saved: {saved_seconds:.2f}s and {saved_mb:.0f} MB per worker")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Export the embedding model to ONNX, and quantize it to int8 for the CPU.
+
+Writes `model.onnx`, `model_quantized.onnx`, the tokenizer files and the
+pooling config to the `onnx_model_path` of the embedding settings, to be run
+in the `onnx` mode. Needs `pip install optimum[onnxruntime]`.
+
+    python -m development.export_onnx
+"""
+
+import argparse
+import json
+import shutil
+import tempfile
+from pathlib import Path
+
+from app.config.settings import get_app_settings, get_embeddings_settings
+from app.dependencies.components.onnx_embedding import (
+    ONNX_MODEL_FILE,
+    ONNX_QUANTIZED_MODEL_FILE,
+    POOLING_CONFIG_FILE,
+)
+from app.paths import PROJECT_ROOT_PATH, models_cache_path, models_path
+
+
+def export_pooling_config(model_name: str, output_path: Path) -> None:
+    """Copy the sentence-transformers pooling config of the model.
+
+    Models without one are mean pooled by sentence-transformers, this is
+    written down too.
+    """
+    from huggingface_hub import hf_hub_download
+    from huggingface_hub.utils import EntryNotFoundError
+
+    config_file: Path | None = Path(model_name) / POOLING_CONFIG_FILE
+    if not Path(model_name).is_dir():
+        try:
+            config_file = Path(
+                hf_hub_download(
+                    model_name, POOLING_CONFIG_FILE, cache_dir=str(models_cache_path)
+                )
+            )
+        except EntryNotFoundError:
+            config_file = None
+    output_file = output_path / POOLING_CONFIG_FILE
+    output_file.parent.mkdir(parents=True, exist_ok=True)
+    if config_file is not None and config_file.exists():
+        shutil.copy(config_file, output_file)
+    else:
+        output_file.write_text(json.dumps({"pooling_mode_mean_tokens": True}))
+    print(f"Pooling config saved to {output_file}")
+
+
+def export(model_name: str, output_path: Path, quantize: bool) -> None:
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from optimum.onnxruntime import ORTModelForFeatureExtraction
+    from transformers import AutoTokenizer
+
+    output_path.mkdir(parents=True, exist_ok=True)
+    with tempfile.TemporaryDirectory() as export_dir:
+        print(f"Exporting {model_name} to ONNX")
+        model = ORTModelForFeatureExtraction.from_pretrained(
+            model_name, export=True, cache_dir=str(models_cache_path)
+        )
+        model.save_pretrained(export_dir)
+        shutil.copy(Path(export_dir) / ONNX_MODEL_FILE, output_path / ONNX_MODEL_FILE)
+    AutoTokenizer.from_pretrained(
+        model_name, cache_dir=str(models_cache_path)
+    ).save_pretrained(output_path)
+    export_pooling_config(model_name, output_path)
+
+    if quantize:
+        print("Quantizing the weights to int8")
+        quantize_dynamic(
+            output_path / ONNX_MODEL_FILE,
+            output_path / ONNX_QUANTIZED_MODEL_FILE,
+            weight_type=QuantType.QInt8,
+        )
+    print(f"ONNX model saved to {output_path}")
+
+
+def main() -> None:
+    embed_settings = get_embeddings_settings()
+    # The model downloaded by `setup_llm`, if any, to avoid downloading it again
+    local_model_path = models_path / "embedding"
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--model",
+        default=(
+            str(local_model_path)
+            if local_model_path.exists()
+            else get_app_settings().embedding_hf_model_name
+        ),
+    )
+    parser.add_argument(
+        "--output", default=str(PROJECT_ROOT_PATH / embed_settings.onnx_model_path)
+    )
+    parser.add_argument("--no-quantize", action="store_true")
+    args = parser.parse_args()
+    export(args.model, Path(args.output), quantize=not args.no_quantize)
+
+
+if __name__ == "__main__":
+    main()
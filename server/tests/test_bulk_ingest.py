@@ -0,0 +1,143 @@
+import io
+import tarfile
+import zipfile
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from llama_index.core.schema import Document
+
+from app.dependencies.components import get_embeddings_settings
+from app.dependencies.components.ingest import IngestEvent, StreamedFiles
+from app.dependencies.services.ingest import IngestService, get_ingest_service
+from app.routes.ingest import router
+
+
+class _IngestComponent:
+    """Parses the files as it pulls them, one document per file."""
+
+    def __init__(self) -> None:
+        self.listeners = []
+        self.contents: dict[str, bytes] = {}
+        self.max_staged = 0
+
+    def add_listener(self, listener) -> None:
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener) -> None:
+        self.listeners.remove(listener)
+
+    def bulk_ingest(self, files: StreamedFiles, run_id=None) -> list[Document]:
+        documents = []
+        for file_name, file_data in files.stage(set(files.file_names)):
+            self.max_staged = max(
+                self.max_staged, len(list(file_data.parent.iterdir()))
+            )
+            self.contents[file_name] = file_data.read_bytes()
+            documents.append(Document(text="text", metadata={"file_name": file_name}))
+            for listener in self.listeners:
+                listener(IngestEvent("parse", [file_name], count=1))
+            assert not file_data.exists()
+        return documents
+
+
+class _IngestService(IngestService):
+    def __init__(self, **embed_settings) -> None:
+        self.embed_settings = get_embeddings_settings().model_copy(
+            update=embed_settings
+        )
+        self.ingest_component = _IngestComponent()
+
+
+def _zip(members: dict[str, bytes]) -> bytes:
+    data = io.BytesIO()
+    with zipfile.ZipFile(data, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, content in members.items():
+            archive.writestr(name, content)
+    return data.getvalue()
+
+
+def _tar_gz(members: dict[str, bytes]) -> bytes:
+    data = io.BytesIO()
+    with tarfile.open(fileobj=data, mode="w:gz") as archive:
+        for name, content in members.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            archive.addfile(info, io.BytesIO(content))
+    return data.getvalue()
+
+
+@pytest.fixture
+def client_for():
+    def client_for(service: IngestService) -> TestClient:
+        app = FastAPI()
+        app.include_router(router)
+        app.dependency_overrides[get_ingest_service] = lambda: service
+        return TestClient(app)
+
+    return client_for
+
+
+def test_bulk_ingest_streams_the_files(client_for):
+    service = _IngestService(count_workers=1)
+    response = client_for(service).post(
+        "/api/v1/ingest/bulk",
+        files=[
+            ("files", ("a.txt", b"a")),
+            (
+                "files",
+                ("docs.zip", _zip({"docs/b.txt": b"b", "__MACOSX/._b.txt": b""})),
+            ),
+            ("files", ("more.tar.gz", _tar_gz({"c.md": b"c", "d.txt": b"d"}))),
+        ],
+    )
+
+    assert response.status_code == 200
+    reports = response.json()["data"]
+    assert [(r["file_name"], r["status"]) for r in reports] == [
+        ("a.txt", "ingested"),
+        ("docs/b.txt", "ingested"),
+        ("c.md", "ingested"),
+        ("d.txt", "ingested"),
+    ]
+    assert service.ingest_component.contents == {
+        "a.txt": b"a",
+        "docs/b.txt": b"b",
+        "c.md": b"c",
+        "d.txt": b"d",
+    }
+    # Staged as pulled, deleted once parsed
+    assert service.ingest_component.max_staged == 1
+
+
+@pytest.mark.parametrize(
+    ("upload", "error"),
+    [
+        (("docs.zip", _zip({"a.txt": b"a", "b.txt": b"b", "c.txt": b"c"})), "Too many"),
+        (("docs.tar.gz", _tar_gz({"a.txt": bytes(2 * 1024 * 1024)})), "too large"),
+        (("docs.zip", _zip({"a.txt": b"a", "./a.txt": b"b"})), "Duplicate"),
+    ],
+)
+def test_bulk_ingest_rejects_uploads_before_staging(client_for, upload, error):
+    service = _IngestService(bulk_ingest_max_files=2, bulk_ingest_max_mb=1)
+    response = client_for(service).post(
+        "/api/v1/ingest/bulk", files=[("files", upload)]
+    )
+
+    assert response.status_code == 400
+    assert error in response.json()["detail"]
+    assert service.ingest_component.contents == {}
+
+
+def test_bulk_ingest_rejects_duplicate_names_across_uploads(client_for):
+    service = _IngestService()
+    response = client_for(service).post(
+        "/api/v1/ingest/bulk",
+        files=[
+            ("files", ("a.txt", b"a")),
+            ("files", ("docs.zip", _zip({"a.txt": b"b"}))),
+        ],
+    )
+
+    assert response.status_code == 400
+    assert "Duplicate file names: ['a.txt']" in response.json()["detail"]
@@ -0,0 +1,72 @@
+from pathlib import Path
+
+from app.dependencies.components.checkpoint import IngestCheckpoint
+from app.dependencies.components.ingest import IngestEvent
+
+
+def _write_files(directory: Path, contents: dict[str, str]) -> list[tuple[str, Path]]:
+    files = []
+    for file_name, content in contents.items():
+        path = directory / file_name
+        path.write_text(content)
+        files.append((file_name, path))
+    return files
+
+
+def test_resume_after_crash_skips_the_persisted_files(tmp_path):
+    files = _write_files(tmp_path, {"a.txt": "a", "b.txt": "b", "c.txt": "c"})
+    checkpoint = IngestCheckpoint(tmp_path / "checkpoints.sqlite3")
+    assert checkpoint.start("run", files) == files
+    on_event = checkpoint.listener("run")
+    on_event(IngestEvent("parse", ["a.txt", "b.txt"], count=2))
+    on_event(IngestEvent("embed", ["a.txt", "b.txt"], count=10))
+    on_event(IngestEvent("persist", ["a.txt"], count=5))
+    # Crash while persisting b.txt, before `finish`
+    checkpoint.close()
+
+    checkpoint = IngestCheckpoint(tmp_path / "checkpoints.sqlite3")
+    assert checkpoint.progress("run") == {"persisted": 1, "embedded": 1, "pending": 1}
+    remaining = checkpoint.start("run", files)
+    assert remaining == files[1:]
+    on_event = checkpoint.listener("run")
+    on_event(IngestEvent("parse", ["b.txt", "c.txt"], count=2))
+    on_event(IngestEvent("embed", ["b.txt", "c.txt"], count=10))
+    on_event(IngestEvent("persist", ["b.txt", "c.txt"], count=10))
+
+    assert checkpoint.finish("run")
+    assert checkpoint.progress("run") == {}
+
+
+def test_changed_file_is_ingested_again(tmp_path):
+    files = _write_files(tmp_path, {"a.txt": "a"})
+    checkpoint = IngestCheckpoint(tmp_path / "checkpoints.sqlite3")
+    checkpoint.start("run", files)
+    checkpoint.advance("run", ["a.txt"], "persisted")
+
+    files[0][1].write_text("changed")
+
+    assert checkpoint.start("run", files) == files
+
+
+def test_files_with_nothing_to_persist_finish_the_run(tmp_path):
+    files = _write_files(tmp_path, {"same.txt": "same", "empty.txt": ""})
+    checkpoint = IngestCheckpoint(tmp_path / "checkpoints.sqlite3")
+    checkpoint.start("run", files)
+    on_event = checkpoint.listener("run")
+    on_event(IngestEvent("parse", ["same.txt"], count=1))
+    on_event(IngestEvent("skip", ["same.txt"], count=1))
+    on_event(IngestEvent("parse", ["empty.txt"], count=0))
+
+    assert checkpoint.finish("run")
+
+
+def test_failed_file_keeps_the_run(tmp_path):
+    files = _write_files(tmp_path, {"a.txt": "a", "b.txt": "b"})
+    checkpoint = IngestCheckpoint(tmp_path / "checkpoints.sqlite3")
+    checkpoint.start("run", files)
+    on_event = checkpoint.listener("run")
+    on_event(IngestEvent("persist", ["a.txt"], count=1))
+    on_event(IngestEvent("fail", ["b.txt"], error="boom"))
+
+    assert not checkpoint.finish("run")
+    assert checkpoint.start("run", files) == files[1:]
@@ -0,0 +1,85 @@
+from llama_index.core.schema import TextNode
+from llama_index.core.storage.docstore import SimpleDocumentStore
+
+from app.dependencies.components.dedup import (
+    DUPLICATE_OF_METADATA_KEY,
+    NearDuplicateFilter,
+)
+
+_PARAGRAPHS = [
+    "The quick brown fox jumps over the lazy dog near the river bank "
+    "while the farmer watches from the old wooden fence at dawn.",
+    "Quarterly revenue grew by twelve percent thanks to the new product "
+    "line and the expansion of the sales team into three new regions.",
+]
+
+
+def _nodes(*texts: str) -> list[TextNode]:
+    return [TextNode(text=text) for text in texts]
+
+
+def _new_filter(tmp_path, docstore, **kwargs) -> NearDuplicateFilter:
+    return NearDuplicateFilter(docstore, tmp_path / "dedup.sqlite3", **kwargs)
+
+
+def test_duplicates_of_stored_nodes_are_skipped(tmp_path):
+    docstore = SimpleDocumentStore()
+    dedup = _new_filter(tmp_path, docstore)
+    originals = dedup(_nodes(*_PARAGRAPHS))
+    assert len(originals) == 2
+    docstore.add_documents(originals)
+
+    # Again, and twice in the same batch
+    assert dedup(_nodes(_PARAGRAPHS[0], _PARAGRAPHS[0])) == []
+
+
+def test_alias_points_to_the_stored_original(tmp_path):
+    docstore = SimpleDocumentStore()
+    dedup = _new_filter(tmp_path, docstore, action="alias")
+    originals = dedup(_nodes(_PARAGRAPHS[0]))
+    docstore.add_documents(originals)
+
+    [alias] = dedup(_nodes(_PARAGRAPHS[0]))
+    assert alias.metadata[DUPLICATE_OF_METADATA_KEY] == originals[0].node_id
+    assert DUPLICATE_OF_METADATA_KEY in alias.excluded_embed_metadata_keys
+
+
+def test_retry_after_a_failed_insert_is_not_skipped(tmp_path):
+    docstore = SimpleDocumentStore()
+    dedup = _new_filter(tmp_path, docstore)
+    assert len(dedup(_nodes(*_PARAGRAPHS))) == 2
+    # The insert failed: nothing reached the docstore
+
+    retried = dedup(_nodes(*_PARAGRAPHS))
+    assert len(retried) == 2
+    docstore.add_documents(retried)
+    assert dedup(_nodes(*_PARAGRAPHS)) == []
+
+
+def test_reingest_after_delete_is_not_skipped(tmp_path):
+    docstore = SimpleDocumentStore()
+    dedup = _new_filter(tmp_path, docstore)
+    originals = dedup(_nodes(*_PARAGRAPHS))
+    docstore.add_documents(originals)
+    for node in originals:
+        docstore.delete_document(node.node_id)
+
+    assert len(dedup(_nodes(*_PARAGRAPHS))) == 2
+
+    # Also from a new process, where the deleted originals are stale
+    dedup.close()
+    dedup = _new_filter(tmp_path, docstore)
+    assert len(dedup(_nodes(*_PARAGRAPHS))) == 2
+
+
+def test_incremental_edit_keeps_the_unchanged_paragraphs(tmp_path):
+    docstore = SimpleDocumentStore()
+    dedup = _new_filter(tmp_path, docstore)
+    originals = dedup(_nodes(*_PARAGRAPHS))
+    docstore.add_documents(originals)
+
+    # The edited document replaces its old nodes before being ingested again
+    for node in originals:
+        docstore.delete_document(node.node_id)
+    edited = _nodes(_PARAGRAPHS[0], _PARAGRAPHS[1] + " Costs were flat.")
+    assert dedup(edited) == edited
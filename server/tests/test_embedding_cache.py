@@ -0,0 +1,46 @@
+from llama_index.core.base.embeddings.base import BaseEmbedding
+
+from app.dependencies.components.embedding_cache import CachedEmbedding, EmbeddingCache
+
+
+class _CountingEmbedding(BaseEmbedding):
+    count_texts: int = 0
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CountingEmbedding"
+
+    def _vector(self, text: str) -> list[float]:
+        # Not exactly representable in float32
+        return [1 / 3, len(text) / 7, 0.1]
+
+    def _get_query_embedding(self, query: str) -> list[float]:
+        return self._vector(query)
+
+    async def _aget_query_embedding(self, query: str) -> list[float]:
+        return self._vector(query)
+
+    def _get_text_embedding(self, text: str) -> list[float]:
+        self.count_texts += 1
+        return self._vector(text)
+
+    def _get_text_embeddings(self, texts: list[str]) -> list[list[float]]:
+        return [self._get_text_embedding(text) for text in texts]
+
+
+def _cached(tmp_path) -> tuple[CachedEmbedding, _CountingEmbedding]:
+    embed_model = _CountingEmbedding(model_name="counting")
+    cache = EmbeddingCache(tmp_path / "embeddings.sqlite3", max_size_bytes=1 << 20)
+    return CachedEmbedding(embed_model, cache), embed_model
+
+
+def test_hits_and_misses_return_the_same_vectors(tmp_path):
+    cached, embed_model = _cached(tmp_path)
+
+    missed = cached.get_text_embedding_batch(["hello", "world!", "hello"])
+    hit = cached.get_text_embedding_batch(["hello", "world!"])
+
+    assert embed_model.count_texts == 2
+    assert hit == missed[:2]
+    assert missed[0] == missed[2]
+    assert cached.get_query_embedding("query") == cached.get_query_embedding("query")
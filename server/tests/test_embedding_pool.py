@@ -0,0 +1,51 @@
+import os
+import signal
+
+import pytest
+
+from app.config.settings import (
+    get_app_settings,
+    get_embeddings_settings,
+    get_ollama_settings,
+)
+from app.dependencies.components.embedding_pool import (
+    EmbeddingWorkerError,
+    ProcessEmbedding,
+)
+
+
+@pytest.fixture
+def pool():
+    embeddings_settings = get_embeddings_settings().model_copy(
+        update={"mode": "mock", "embedding_worker_timeout": 1.0}
+    )
+    pool = ProcessEmbedding(
+        app_settings=get_app_settings(),
+        ollama_settings=get_ollama_settings(),
+        embeddings_settings=embeddings_settings,
+        count_workers=1,
+    )
+    yield pool
+    pool.close()
+
+
+@pytest.mark.skipif(not hasattr(signal, "SIGSTOP"), reason="POSIX signals")
+def test_hung_worker_is_killed_and_replaced(pool):
+    (worker,) = pool._workers
+    os.kill(worker.process.pid, signal.SIGSTOP)
+    with pytest.raises(EmbeddingWorkerError, match="still running after 1.0s"):
+        pool.get_text_embedding("text")
+    assert not worker.process.is_alive()
+
+    assert len(pool.get_text_embedding("text")) == 384
+    assert pool._workers != [worker]
+
+
+def test_dead_worker_is_replaced(pool):
+    (worker,) = pool._workers
+    worker.process.kill()
+    worker.process.join()
+    with pytest.raises(EmbeddingWorkerError):
+        pool.get_text_embedding("text")
+
+    assert len(pool.get_text_embedding("text")) == 384
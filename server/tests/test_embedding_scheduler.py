@@ -0,0 +1,41 @@
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.schema import TextNode
+
+from app.dependencies.components.embedding_scheduler import EmbeddingBatchScheduler
+
+
+class _RecordingEmbedding(BaseEmbedding):
+    batch_sizes: list[int] = []
+
+    def _get_query_embedding(self, query: str) -> list[float]:
+        return [0.0]
+
+    async def _aget_query_embedding(self, query: str) -> list[float]:
+        return [0.0]
+
+    def _get_text_embedding(self, text: str) -> list[float]:
+        return self._get_text_embeddings([text])[0]
+
+    def _get_text_embeddings(self, texts: list[str]) -> list[list[float]]:
+        self.batch_sizes.append(len(texts))
+        return [[float(len(text.split()))] for text in texts]
+
+
+def test_each_batch_is_embedded_in_one_call():
+    embed_model = _RecordingEmbedding(embed_batch_size=4)
+    scheduler = EmbeddingBatchScheduler(
+        embed_model=embed_model, token_budget=16, max_batch_size=8
+    )
+    texts = ["word " * count for count in (1, 12, 1, 1, 1, 1)]
+    nodes = scheduler([TextNode(text=text) for text in texts])
+
+    # The short texts by `embed_batch_size`, then the long one alone
+    assert embed_model.batch_sizes == [4, 1, 1]
+    assert [node.embedding for node in nodes] == [
+        [1.0],
+        [12.0],
+        [1.0],
+        [1.0],
+        [1.0],
+        [1.0],
+    ]
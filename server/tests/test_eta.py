@@ -0,0 +1,47 @@
+import types
+
+import pytest
+
+from app.dependencies.components import eta
+from app.dependencies.components.eta import ProgressTracker
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = types.SimpleNamespace(now=0.0)
+    monkeypatch.setattr(eta, "time", types.SimpleNamespace(time=lambda: clock.now))
+    return clock
+
+
+def test_advance_and_stop_update_the_totals(clock):
+    tracker = ProgressTracker(["a", "b", "c", "d"], ["parse", "embed"])
+
+    assert tracker.advance("parse", ["a", "unknown"]) == 1
+    # Reaching a stage counts the previous ones
+    assert tracker.advance("embed", ["b"]) == 1
+    assert tracker.advance("parse", ["b"]) == 0
+    assert tracker.stop(["c", "b", "unknown"]) == 1
+
+    snapshot = tracker.snapshot()
+    assert (snapshot["parse"].done, snapshot["parse"].total) == (2, 3)
+    assert (snapshot["embed"].done, snapshot["embed"].total) == (1, 3)
+
+
+def test_eta_follows_the_rate(clock):
+    tracker = ProgressTracker(["a", "b", "c", "d", "e"], ["parse"])
+    for item in ["a", "b", "c"]:
+        clock.now += 1
+        tracker.advance("parse", [item])
+
+    progress = tracker.snapshot()["parse"]
+    assert progress.rate == pytest.approx(1.0)
+    assert progress.seconds_left == pytest.approx(2.0)
+    assert progress.eta == "2s @ 60/min"
+
+    # One file less to go
+    tracker.stop(["e"])
+    assert tracker.snapshot()["parse"].seconds_left == pytest.approx(1.0)
+
+    tracker.advance("parse", ["d"])
+    progress = tracker.snapshot()["parse"]
+    assert (progress.done, progress.total, progress.eta) == (4, 4, None)
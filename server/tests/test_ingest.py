@@ -0,0 +1,105 @@
+import pytest
+from llama_index.core import MockEmbedding, StorageContext
+from llama_index.core.node_parser import SentenceSplitter
+from llama_index.core.schema import Document, TransformComponent
+
+from app.config.settings import get_embeddings_settings
+from app.dependencies.components.ingest import SimpleIngestComponent
+
+
+class _FailingEmbedding(TransformComponent):
+    fail: bool = False
+
+    def __call__(self, nodes, **kwargs):
+        if self.fail:
+            raise RuntimeError("embedding failed")
+        return nodes
+
+
+@pytest.fixture
+def failing_embedding():
+    return _FailingEmbedding()
+
+
+@pytest.fixture
+def component(tmp_path, failing_embedding):
+    embed_model = MockEmbedding(embed_dim=4)
+    component = SimpleIngestComponent(
+        StorageContext.from_defaults(),
+        embed_model,
+        [SentenceSplitter(), failing_embedding, embed_model],
+        incremental=True,
+        persist_dir=tmp_path,
+        checkpoint_path=tmp_path / "checkpoints.sqlite3",
+        embed_settings=get_embeddings_settings(),
+    )
+    yield component
+    component.close()
+
+
+def _parse_into(monkeypatch, component, texts: list[str]) -> None:
+    documents = [Document(text=text, metadata={"file_name": "a.txt"}) for text in texts]
+    monkeypatch.setattr(
+        component._parser_pool, "parse", lambda file_name, file_data: (documents, 0.0)
+    )
+
+
+def _stored_texts(component) -> list[str]:
+    docstore = component._index.docstore
+    return sorted(
+        docstore.get_node(node_id).get_content()
+        for node_id in component._index.index_struct.nodes_dict
+    )
+
+
+def test_failed_embedding_keeps_the_previous_version(
+    monkeypatch, tmp_path, component, failing_embedding
+):
+    _parse_into(monkeypatch, component, ["first page", "second page"])
+    component.ingest("a.txt", tmp_path / "a.txt")
+    assert _stored_texts(component) == ["first page", "second page"]
+
+    _parse_into(monkeypatch, component, ["first page", "second page, edited"])
+    failing_embedding.fail = True
+    with pytest.raises(RuntimeError, match="embedding failed"):
+        component.ingest("a.txt", tmp_path / "a.txt")
+    assert _stored_texts(component) == ["first page", "second page"]
+
+    failing_embedding.fail = False
+    component.ingest("a.txt", tmp_path / "a.txt")
+    assert _stored_texts(component) == ["first page", "second page, edited"]
+
+
+def test_file_without_documents_loses_its_previous_ones(
+    monkeypatch, tmp_path, component
+):
+    _parse_into(monkeypatch, component, ["first page", "second page"])
+    component.ingest("a.txt", tmp_path / "a.txt")
+
+    _parse_into(monkeypatch, component, [])
+    component.ingest("a.txt", tmp_path / "a.txt")
+    assert _stored_texts(component) == []
+    assert component._index.docstore.get_all_ref_doc_info() == {}
+
+
+def test_delete_files_resolves_the_documents_per_file(monkeypatch, tmp_path, component):
+    monkeypatch.setattr(
+        component._parser_pool,
+        "parse",
+        lambda file_name, file_data: (
+            [
+                Document(text=f"{file_name} {page}", metadata={"file_name": file_name})
+                for page in ("first", "second")
+            ],
+            0.0,
+        ),
+    )
+    component.ingest("a.txt", tmp_path / "a.txt")
+    component.ingest("b.txt", tmp_path / "b.txt")
+
+    def scan():
+        raise AssertionError("The whole docstore is scanned")
+
+    monkeypatch.setattr(component._index.docstore, "get_all_ref_doc_info", scan)
+    assert len(component.delete_files(["a.txt", "unknown.txt"])) == 2
+    assert _stored_texts(component) == ["b.txt first", "b.txt second"]
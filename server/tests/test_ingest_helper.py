@@ -0,0 +1,16 @@
+from llama_index.core.readers import StringIterableReader
+
+from app.dependencies.components.ingest_helper import LazyReaderRegistry
+
+_READER = "llama_index.core.readers:StringIterableReader"
+
+
+def test_extensions_are_case_insensitive():
+    registry = LazyReaderRegistry({".TXT": _READER}, allowed_extensions=[".Txt", ".md"])
+    registry.register(".MD", _READER)
+
+    assert registry.is_allowed(".TXT")
+    assert registry[".TXT"] is StringIterableReader
+    assert registry.get(".txt") is StringIterableReader
+    assert ".Md" in registry
+    assert not registry.is_allowed(".pdf")
@@ -0,0 +1,67 @@
+import threading
+
+import fakeredis
+import pytest
+
+from app.dependencies.components.ingest import IngestEvent
+from app.dependencies.services.ingest_jobs import IngestJobService
+
+
+class _IngestComponent:
+    def __init__(self) -> None:
+        self.listeners = []
+
+    def add_listener(self, listener) -> None:
+        self.listeners.append(listener)
+
+
+class _IngestService:
+    """Ingests a file once `release` is set, reporting its progress."""
+
+    def __init__(self) -> None:
+        self.ingest_component = _IngestComponent()
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def ingest_file(self, file_name, file_data):
+        self.started.set()
+        for listener in self.ingest_component.listeners:
+            listener(IngestEvent("parse", [file_name], count=1))
+        self.release.wait(10)
+        return []
+
+
+@pytest.fixture
+def redis_client():
+    return fakeredis.FakeRedis()
+
+
+def test_jobs_are_read_from_any_service_instance(redis_client):
+    ingest_service = _IngestService()
+    # As the API processes, sharing Redis
+    first = IngestJobService(ingest_service, redis_client=redis_client)
+    second = IngestJobService(_IngestService(), redis_client=redis_client)
+
+    job = first.submit_text("a.txt", "text")
+    assert ingest_service.started.wait(10)
+    running = second.get(job.job_id)
+    assert running.status == "running"
+    assert running.progress["parse"].done == 1
+
+    ingest_service.release.set()
+    first._executor.shutdown(wait=True)
+    assert second.get(job.job_id).status == "completed"
+    assert [j.job_id for j in second.list_jobs()] == [job.job_id]
+    assert second.get("unknown") is None
+
+
+def test_expired_jobs_are_not_listed(redis_client):
+    ingest_service = _IngestService()
+    ingest_service.release.set()
+    service = IngestJobService(ingest_service, redis_client=redis_client)
+    job = service.submit_text("a.txt", "text")
+    service._executor.shutdown(wait=True)
+
+    redis_client.delete(f"ingest:job:{job.job_id}")
+    assert service.list_jobs() == []
+    assert redis_client.zcard("ingest:jobs") == 0
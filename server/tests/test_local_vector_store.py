@@ -0,0 +1,127 @@
+import numpy as np
+import pytest
+from llama_index.core.schema import NodeRelationship, RelatedNodeInfo, TextNode
+from llama_index.core.vector_stores.types import VectorStoreQuery
+
+from app.dependencies.components.local_vector_store import LocalVectorStore
+
+
+def _nodes(vectors: np.ndarray, doc_id: str, prefix: str = "") -> list[TextNode]:
+    nodes = []
+    for i, vector in enumerate(vectors):
+        node = TextNode(
+            id_=f"{prefix}{doc_id}-{i}", text=f"{doc_id} {i}", embedding=list(vector)
+        )
+        node.relationships[NodeRelationship.SOURCE] = RelatedNodeInfo(node_id=doc_id)
+        nodes.append(node)
+    return nodes
+
+
+def _query(store: LocalVectorStore, vector, top_k: int = 1, **kwargs) -> list[str]:
+    result = store.query(
+        VectorStoreQuery(query_embedding=list(vector), similarity_top_k=top_k, **kwargs)
+    )
+    return result.ids
+
+
+def test_append_and_query(tmp_path):
+    store = LocalVectorStore(tmp_path)
+    vectors = np.eye(4, dtype=np.float32)
+    store.add(_nodes(vectors[:2], "a"))
+    store.add(_nodes(vectors[2:], "b"))
+
+    assert _query(store, [0, 0, 3, 0]) == ["b-0"]
+    assert set(_query(store, [1, 1, 1, 0], top_k=3, doc_ids=["a"])) == {"a-0", "a-1"}
+    # Added again: replaced, not duplicated
+    store.add(_nodes(vectors[[3]], "a"))
+    assert set(_query(store, vectors[3], top_k=2)) == {"a-0", "b-1"}
+    assert _query(store, vectors[0], top_k=4).count("a-0") == 1
+
+
+def test_delete_and_compaction(tmp_path):
+    store = LocalVectorStore(tmp_path)
+    vectors = np.eye(6, dtype=np.float32)
+    store.add(_nodes(vectors[:2], "a"))
+    store.add(_nodes(vectors[2:4], "b"))
+    store.add(_nodes(vectors[4:], "c"))
+
+    store.delete("a")
+    assert set(_query(store, vectors[0], top_k=6)) == {"b-0", "b-1", "c-0", "c-1"}
+    # More than half of the rows deleted: compacted into a new generation
+    store.delete_many(["b"])
+    assert [path.name for path in tmp_path.glob("vectors.*")] == ["vectors.1.float32"]
+    assert _query(store, vectors[5]) == ["c-1"]
+    assert set(_query(store, vectors[0], top_k=6)) == {"c-0", "c-1"}
+
+    store.close()
+    store = LocalVectorStore(tmp_path)
+    assert _query(store, vectors[4]) == ["c-0"]
+
+
+def test_reopen_drops_the_uncommitted_vectors(tmp_path):
+    store = LocalVectorStore(tmp_path)
+    vectors = np.eye(4, dtype=np.float32)
+    store.add(_nodes(vectors[:2], "a"))
+    store.close()
+    # A crash between writing the vectors and committing their rows
+    matrix_path = tmp_path / "vectors.0.float32"
+    with matrix_path.open("ab") as matrix_file:
+        matrix_file.write(vectors[2:].tobytes())
+
+    store = LocalVectorStore(tmp_path)
+    assert matrix_path.stat().st_size == 2 * vectors[0].nbytes
+    store.add(_nodes(vectors[2:], "b"))
+    assert _query(store, vectors[3]) == ["b-1"]
+    assert _query(store, vectors[0]) == ["a-0"]
+    store.close()
+
+    # Committed vectors missing from the file
+    with matrix_path.open("r+b") as matrix_file:
+        matrix_file.truncate(vectors[0].nbytes)
+    with pytest.raises(RuntimeError, match="truncated"):
+        LocalVectorStore(tmp_path)
+
+
+def test_stores_sharing_a_path_see_each_other(tmp_path):
+    # As the processes of the API do
+    first, second = LocalVectorStore(tmp_path), LocalVectorStore(tmp_path)
+    vectors = np.eye(8, dtype=np.float32)
+    first.add(_nodes(vectors[:2], "a"))
+    second.add(_nodes(vectors[2:4], "b"))
+    first.add(_nodes(vectors[4:6], "c"))
+
+    for store in (first, second):
+        for i, node_id in enumerate(["a-0", "a-1", "b-0", "b-1", "c-0", "c-1"]):
+            assert _query(store, vectors[i]) == [node_id]
+
+    # Compacted by the second one, the first one reads the new generation
+    second.delete_many(["a", "b"])
+    assert _query(first, vectors[5]) == ["c-1"]
+    first.add(_nodes(vectors[6:], "d"))
+    assert _query(second, vectors[7]) == ["d-1"]
+    assert set(_query(second, vectors[0], top_k=8)) == {"c-0", "c-1", "d-0", "d-1"}
+
+
+def test_ivf_recall(tmp_path):
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(20, 32))
+    vectors = (
+        centers[rng.integers(0, len(centers), 4000)] + 0.3 * rng.normal(size=(4000, 32))
+    ).astype(np.float32)
+    exact = LocalVectorStore(tmp_path / "exact")
+    ivf = LocalVectorStore(tmp_path / "ivf", ivf_threshold=1000, ivf_nprobe=8)
+    for start in range(0, len(vectors), 500):
+        batch = _nodes(vectors[start : start + 500], "doc", prefix=str(start))
+        exact.add(batch)
+        ivf.add(batch)
+
+    queries = vectors[rng.choice(len(vectors), 50, replace=False)]
+    queries = queries + 0.1 * rng.normal(size=queries.shape).astype(np.float32)
+    recall = np.mean(
+        [
+            len(set(_query(ivf, query, top_k=10)) & set(_query(exact, query, top_k=10)))
+            / 10
+            for query in queries
+        ]
+    )
+    assert recall >= 0.9
@@ -0,0 +1,151 @@
+import json
+
+import fakeredis
+import pytest
+from llama_index.core.data_structs.data_structs import IndexDict
+from llama_index.core.schema import NodeRelationship, RelatedNodeInfo, TextNode
+from llama_index.core.storage.docstore import SimpleDocumentStore
+from llama_index.core.storage.index_store.utils import index_struct_to_json
+from llama_index.storage.kvstore.redis import RedisKVStore
+
+from app.dependencies.components import node_store
+from app.dependencies.components.node_store import (
+    RedisDeltaIndexStore,
+    walk_neighbors,
+)
+from app.dependencies.components.sentence_window import SentenceWindowReconstructor
+
+
+@pytest.fixture
+def redis_client():
+    return fakeredis.FakeRedis()
+
+
+def _new_store(redis_client) -> RedisDeltaIndexStore:
+    return RedisDeltaIndexStore(RedisKVStore.from_redis_client(redis_client))
+
+
+def _new_index_struct(node_ids) -> IndexDict:
+    return IndexDict(index_id="index", nodes_dict={i: i for i in node_ids})
+
+
+def test_nodes_are_written_once_then_updated_one_by_one(redis_client):
+    store = _new_store(redis_client)
+    index_struct = _new_index_struct(["a", "b"])
+    store.add_index_struct(index_struct)
+
+    index_struct.nodes_dict["c"] = "c"
+    index_struct.nodes_dict.pop("a")
+    # Not written by `add_index_struct` anymore, only by `update_nodes`
+    store.add_index_struct(index_struct)
+    assert set(_new_store(redis_client).get_index_struct("index").nodes_dict) == {
+        "a",
+        "b",
+    }
+    store.update_nodes(index_struct, ["c", "a"])
+
+    loaded = _new_store(redis_client).get_index_struct("index")
+    assert loaded.nodes_dict == {"b": "b", "c": "c"}
+    base = json.loads(redis_client.hget("index_store/index", "index"))
+    assert json.loads(base["__data__"])["nodes_dict"] == {}
+
+
+def test_loaded_index_is_not_rewritten(redis_client):
+    _new_store(redis_client).add_index_struct(_new_index_struct(["a"]))
+    other_process = _new_store(redis_client)
+    index_struct = other_process.index_structs()[0]
+
+    index_struct.nodes_dict["b"] = "b"
+    other_process.update_nodes(index_struct, ["b"])
+    other_process.add_index_struct(index_struct)
+    # Another process adds a node meanwhile
+    redis_client.hset("index_store/nodes/index", "c", "c")
+    other_process.add_index_struct(index_struct)
+
+    loaded = _new_store(redis_client).get_index_struct("index")
+    assert loaded.nodes_dict == {"a": "a", "b": "b", "c": "c"}
+
+
+def test_legacy_index_struct_is_migrated(redis_client):
+    legacy = _new_index_struct(["a", "b"])
+    redis_client.hset(
+        "index_store/index", "index", json.dumps(index_struct_to_json(legacy))
+    )
+    store = _new_store(redis_client)
+
+    index_struct = store.get_index_struct()
+    assert index_struct.nodes_dict == {"a": "a", "b": "b"}
+    index_struct.nodes_dict.pop("a")
+    store.update_nodes(index_struct, ["a"])
+
+    loaded = _new_store(redis_client).get_index_struct("index")
+    assert loaded.nodes_dict == {"b": "b"}
+
+
+def _chained_nodes(doc_id: str, count: int) -> list[TextNode]:
+    nodes = [TextNode(id_=f"{doc_id}-{i}", text=f"{doc_id}{i}.") for i in range(count)]
+    for i, node in enumerate(nodes):
+        node.relationships[NodeRelationship.SOURCE] = RelatedNodeInfo(node_id=doc_id)
+        if i > 0:
+            node.relationships[NodeRelationship.PREVIOUS] = RelatedNodeInfo(
+                node_id=nodes[i - 1].node_id
+            )
+        if i < count - 1:
+            node.relationships[NodeRelationship.NEXT] = RelatedNodeInfo(
+                node_id=nodes[i + 1].node_id
+            )
+    return nodes
+
+
+def _node_ids(neighbors) -> tuple[list[str], list[str]]:
+    previous, following = neighbors
+    return [n.node_id for n in previous], [n.node_id for n in following]
+
+
+def test_overlapping_windows_fetch_each_neighbor_once(monkeypatch):
+    doc_store = SimpleDocumentStore()
+    nodes = _chained_nodes("a", 6)
+    doc_store.add_documents(nodes)
+    fetched = []
+    fetch = node_store.get_nodes
+
+    def get_nodes(doc_store, node_ids):
+        fetched.extend(node_ids)
+        return fetch(doc_store, node_ids)
+
+    monkeypatch.setattr(node_store, "get_nodes", get_nodes)
+
+    neighbors = walk_neighbors(doc_store, [nodes[2], nodes[3]], depth=2)
+
+    assert _node_ids(neighbors["a-2"]) == (["a-1", "a-0"], ["a-3", "a-4"])
+    assert _node_ids(neighbors["a-3"]) == (["a-2", "a-1"], ["a-4", "a-5"])
+    # The retrieved nodes and the shared neighbors are not fetched again
+    assert sorted(fetched) == ["a-0", "a-1", "a-4", "a-5"]
+
+
+def test_walk_stops_at_a_missing_neighbor_and_at_the_document():
+    doc_store = SimpleDocumentStore()
+    nodes = _chained_nodes("a", 5)
+    other = _chained_nodes("b", 1)[0]
+    # Linked to another document, e.g. by a stale relationship
+    nodes[-1].relationships[NodeRelationship.NEXT] = RelatedNodeInfo(
+        node_id=other.node_id
+    )
+    doc_store.add_documents([*nodes, other])
+    doc_store.delete_document("a-1")
+
+    neighbors = walk_neighbors(doc_store, [nodes[3]], depth=3)
+
+    assert _node_ids(neighbors["a-3"]) == (["a-2"], ["a-4"])
+
+
+def test_sentence_windows_are_rebuilt_from_the_neighbors():
+    doc_store = SimpleDocumentStore()
+    nodes = _chained_nodes("a", 5)
+    doc_store.add_documents(nodes)
+    doc_store.delete_document("a-4")
+    reconstructor = SentenceWindowReconstructor(doc_store, window_size=2)
+
+    windows = reconstructor._build_windows([nodes[1], nodes[3]])
+
+    assert windows == {"a-1": "a0. a1. a2. a3.", "a-3": "a1. a2. a3."}
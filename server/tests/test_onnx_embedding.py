@@ -0,0 +1,28 @@
+import json
+
+import pytest
+
+from app.dependencies.components.onnx_embedding import POOLING_CONFIG_FILE, read_pooling
+
+
+def _write_pooling_config(model_path, **config) -> None:
+    config_file = model_path / POOLING_CONFIG_FILE
+    config_file.parent.mkdir(parents=True)
+    config_file.write_text(json.dumps(config))
+
+
+def test_pooling_is_read_from_the_config(tmp_path):
+    _write_pooling_config(
+        tmp_path, pooling_mode_cls_token=False, pooling_mode_mean_tokens=True
+    )
+    assert read_pooling(tmp_path) == "mean"
+
+
+def test_models_exported_without_config_are_cls_pooled(tmp_path):
+    assert read_pooling(tmp_path) == "cls"
+
+
+def test_unsupported_pooling_is_rejected(tmp_path):
+    _write_pooling_config(tmp_path, pooling_mode_max_tokens=True)
+    with pytest.raises(ValueError, match="Unsupported pooling"):
+        read_pooling(tmp_path)
@@ -0,0 +1,110 @@
+import threading
+
+from llama_index.core import (
+    MockEmbedding,
+    StorageContext,
+    VectorStoreIndex,
+    load_index_from_storage,
+)
+from llama_index.core.schema import Document, NodeRelationship, TextNode
+
+from app.dependencies.components.persistence import DeltaPersister
+
+
+def _new_index(persist_dir=None) -> VectorStoreIndex:
+    embed_model = MockEmbedding(embed_dim=4)
+    if persist_dir is not None and (persist_dir / "docstore.json").exists():
+        storage_context = StorageContext.from_defaults(persist_dir=str(persist_dir))
+        return load_index_from_storage(storage_context, embed_model=embed_model)
+    return VectorStoreIndex(nodes=[], embed_model=embed_model)
+
+
+def _new_persister(index: VectorStoreIndex, persist_dir) -> DeltaPersister:
+    return DeltaPersister(
+        index,
+        threading.Lock(),
+        persist_dir,
+        compaction_interval=3600,
+        compaction_log_bytes=1 << 30,
+    )
+
+
+def _insert(index: VectorStoreIndex, persister: DeltaPersister, doc_id: str):
+    document = Document(text=f"text of {doc_id}", doc_id=doc_id)
+    node = TextNode(text=document.text, embedding=[0.1, 0.2, 0.3, 0.4])
+    node.relationships[NodeRelationship.SOURCE] = document.as_related_node_info()
+    index.insert_nodes([node])
+    index.docstore.set_document_hash(doc_id, document.hash)
+    persister.record([node], [document])
+    return node
+
+
+def _node_ids(index: VectorStoreIndex) -> set[str]:
+    return set(index.index_struct.nodes_dict)
+
+
+def test_replay_restores_the_logged_changes(tmp_path):
+    index = _new_index()
+    persister = _new_persister(index, tmp_path)
+    kept = _insert(index, persister, "kept")
+    deleted = _insert(index, persister, "deleted")
+    persister.record(deleted_doc_ids=["deleted"])
+    index.docstore.delete_ref_doc("deleted")
+    index.index_struct.nodes_dict.pop(deleted.node_id)
+
+    # Crash before any compaction: only the change log is on disk
+    assert not (tmp_path / "docstore.json").exists()
+    restarted = _new_index(tmp_path)
+    restarted_persister = _new_persister(restarted, tmp_path)
+
+    assert _node_ids(restarted) == {kept.node_id}
+    assert restarted.docstore.get_node(kept.node_id).text == "text of kept"
+    assert restarted.docstore.get_document_hash("kept") is not None
+    assert restarted.docstore.get_document_hash("deleted") is None
+    assert restarted.docstore.get_ref_doc_info("deleted") is None
+    restarted_persister.compact()
+
+
+def test_replay_ignores_a_truncated_record(tmp_path):
+    index = _new_index()
+    persister = _new_persister(index, tmp_path)
+    node = _insert(index, persister, "doc")
+    with (tmp_path / DeltaPersister.CHANGE_LOG_FNAME).open("a") as change_log:
+        change_log.write('{"op": "insert", "nodes": [{"__da')
+
+    restarted = _new_index(tmp_path)
+    restarted_persister = _new_persister(restarted, tmp_path)
+
+    assert _node_ids(restarted) == {node.node_id}
+    restarted_persister.compact()
+
+
+def test_compaction_writes_a_snapshot_and_resets_the_log(tmp_path):
+    index = _new_index()
+    persister = _new_persister(index, tmp_path)
+    first = _insert(index, persister, "first")
+    change_log_path = tmp_path / DeltaPersister.CHANGE_LOG_FNAME
+    assert change_log_path.exists()
+
+    persister.compact()
+
+    assert not change_log_path.exists()
+    second = _insert(index, persister, "second")
+    # Restart from the snapshot plus the changes logged after it
+    restarted = _new_index(tmp_path)
+    assert _node_ids(restarted) == {first.node_id}
+    restarted_persister = _new_persister(restarted, tmp_path)
+    assert _node_ids(restarted) == {first.node_id, second.node_id}
+
+    restarted_persister.compact()
+    assert not change_log_path.exists()
+    assert _node_ids(_new_index(tmp_path)) == {first.node_id, second.node_id}
+
+
+def test_compaction_is_skipped_without_changes(tmp_path):
+    index = _new_index()
+    persister = _new_persister(index, tmp_path)
+
+    persister.compact()
+
+    assert not (tmp_path / "docstore.json").exists()
@@ -0,0 +1,33 @@
+import fakeredis
+
+from app.dependencies.components.eta import ProgressTracker
+from app.dependencies.components.run_progress import RunProgressStore
+
+
+def test_runs_are_read_from_any_process():
+    redis_client = fakeredis.FakeRedis()
+    # As the API processes, sharing Redis
+    first = RunProgressStore(redis_client=redis_client)
+    second = RunProgressStore(redis_client=redis_client)
+
+    tracker = ProgressTracker(["a.txt", "b.txt"], ["parse", "embed"])
+    tracker.advance("parse", ["a.txt"])
+    first.publish("run", tracker)
+
+    run = second.running()["run"]
+    assert run.started_at == tracker.started_at
+    assert (run.stages["parse"].done, run.stages["parse"].total) == (1, 2)
+    assert (run.stages["embed"].done, run.stages["embed"].total) == (0, 2)
+
+    first.remove("run")
+    assert second.running() == {}
+
+
+def test_expired_runs_are_not_listed():
+    redis_client = fakeredis.FakeRedis()
+    store = RunProgressStore(redis_client=redis_client)
+    store.publish("run", ProgressTracker(["a.txt"], ["parse"]))
+
+    redis_client.delete("ingest:run:run")
+    assert store.running() == {}
+    assert redis_client.zcard("ingest:runs") == 0